@@ -3,14 +3,23 @@ from flask_cors import CORS
 from config.config import MAX_CONTENT_LENGTH, UPLOAD_FOLDER
 import os
 from app.utils.init_utils import initialize_nltk
+from app.utils.file_utils import SpooledUploadRequest
+from app.utils.profiling import init_profiling
+from app.utils.tracing import configure_logging, init_tracing
 import logging
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_app():
-    """Create and configure the Flask application."""
+def create_app(background_workers=True):
+    """
+    Create and configure the Flask application.
+    Args:
+        background_workers (bool): Start the job queue worker threads in this process.
+            Pre-forking servers pass False and start them in each worker after fork,
+            since threads do not survive fork.
+    """
     try:
         # Initialize NLTK data
         logger.info("Initializing NLTK data...")
@@ -21,8 +30,17 @@ def create_app():
                    template_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates'),
                    static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'))
         
+        # Keep uploads in memory up to UPLOAD_SPILL_THRESHOLD
+        app.request_class = SpooledUploadRequest
+        
         # Enable CORS
         CORS(app)
+
+        # Root span and request ID for every request
+        init_tracing(app)
+
+        # Opt-in per-request profiling (PROFILE_SAMPLE_RATE / PROFILE_TOKEN)
+        init_profiling(app)
         
         # Ensure upload folder exists
         os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -34,6 +52,11 @@ def create_app():
         # Register blueprints
         from app.routes.main_routes import main
         app.register_blueprint(main)
+
+        # Process queued analysis jobs in the background
+        if background_workers:
+            from app.services.job_service import start_job_workers
+            start_job_workers()
         
         return app
     except Exception as e:
@@ -1,15 +1,14 @@
-from flask import Blueprint, request, jsonify, render_template, send_file, current_app
-from werkzeug.utils import secure_filename
+from flask import Blueprint, request, jsonify, render_template, send_file, current_app, url_for, make_response, Response, stream_with_context
+import io
 import os
-import tempfile
+import json
+import zipfile
 from PIL import Image
-from gtts import gTTS
 from datetime import datetime
-import requests
-import time
 import logging
 
-from app.utils.file_utils import allowed_file, validate_image
+from app.utils.file_utils import allowed_file, validate_image, compute_image_hash, open_upload_image, decode_image, ImageValidationError
+from app.utils.response_cache import cached_response, skip_response_cache
 from app.services.image_service import image_processor
 from app.services.text_service import (
     generate_context,
@@ -18,9 +17,29 @@ from app.services.text_service import (
     analyze_sentiment,
     analyze_medical_image
 )
-from app.services.advanced_image_service import AdvancedImageProcessor
+from app.services.advanced_image_service import AdvancedImageProcessor, submit_color_analysis
+from app.services.tiled_image_service import check_within_ceiling
 from app.services.seo_service import generate_seo_description
-from config.config import UPLOAD_FOLDER
+from app.services.phash_service import near_duplicate_key, near_duplicate_cache
+from app.services.batch_service import list_zip_images, iter_zip_images, iter_batch_results
+from app.services.pipeline_service import resolve_stages, run_pipeline
+from app.services.capacity_service import admission_class, capacity_manager
+from app.services.fetch_service import FetchError, remote_image_fetcher, url_result_cache
+from app.services.tts_service import get_tts_service
+from app.services.job_service import JOB_HANDLERS, get_job_queue, check_callback_url
+from app.services.medical_image_service import MedicalImageError, identify_medical_format, load_medical_study, describe_study
+from app.services.semantic_cache_service import context_cache, enhanced_context_cache
+from app.services.hashtag_service import get_hashtag_index, extract_hashtags
+from app.services.chart_service import CHART_TYPES, CHART_FORMATS, store_color_data, render_chart, chart_etag
+from config.ai_config import format_success_response
+from config.config import (
+    COLOR_ANALYSIS_TIMEOUT,
+    BATCH_MAX_IMAGES,
+    TTS_DEFAULT_LANG,
+    TTS_MAX_TEXT_LENGTH,
+    TTS_CACHE_MAX_AGE,
+    HASHTAG_MIN_CONFIDENCE
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,11 +48,57 @@ ALLOWED_MEDICAL_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'tiff', 'dcm'}
 
 main = Blueprint('main', __name__)
 
+def _describe_image(image, phash, cached=None):
+    """
+    Generate alt text and context for an image, reusing the results stored
+    for a near-duplicate of it when available.
+    Args:
+        image (PIL.Image): Uploaded image
+        phash (ImageKey): near_duplicate_key of the image (None skips the cache)
+        cached (dict): Result of a near_duplicate_cache lookup already made by the caller
+    Returns:
+        tuple: (alt text, generate_context response)
+    """
+    if cached is None:
+        cached = near_duplicate_cache.lookup(phash) or {}
+
+    alt_text = cached.get('alt_text')
+    if not alt_text:
+        alt_text = image_processor.generate_alt_text(image)
+
+    context = cached.get('context')
+    if not context:
+        context = generate_context(alt_text)
+
+    # Only successful results are worth reusing
+    results = {}
+    if _alt_text_succeeded(alt_text):
+        results['alt_text'] = alt_text
+        if context['success']:
+            results['context'] = context
+    if results:
+        near_duplicate_cache.store(phash, **results)
+    # Responses built on a failed alt text or context are not complete results
+    if not results.get('context'):
+        skip_response_cache()
+
+    return alt_text, context
+
+def _alt_text_succeeded(alt_text):
+    """Whether BLIP produced an alt text rather than its error message"""
+    return isinstance(alt_text, str) and bool(alt_text.strip()) and not alt_text.startswith('Error generating alt text')
+
+def _services_succeeded(*responses):
+    """Whether every service response (format_success_response) succeeded"""
+    return all(isinstance(response, dict) and response.get('success') for response in responses)
+
 @main.route('/')
 def landing():
     return render_template('landing.html')
 
 @main.route('/social-media', methods=['GET', 'POST'])
+@cached_response('social_media', lambda body: _services_succeeded(body.get('caption'), body.get('sentiment')))
+@admission_class('social')
 def social_media():
     if request.method == 'POST':
         try:
@@ -49,21 +114,20 @@ def social_media():
                 return jsonify({'error': 'Invalid file type. Please upload a PNG, JPG, JPEG, or GIF'}), 400
             
             # Validate image
-            if not validate_image(file.stream):
+            header = validate_image(file.stream)
+            if not header:
                 return jsonify({'error': 'Invalid image file'}), 400
                 
-            # Save and process image
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
             try:
-                image = Image.open(filepath)
-                alt_text = image_processor.generate_alt_text(image)
-                context = generate_context(alt_text)
-                caption = social_media_caption(context)
-                sentiment_result = analyze_sentiment(caption)
-                hashtags = generate_hashtags(context)
+                # Decode straight from the upload stream, no copy on disk
+                image = open_upload_image(file, header)
+                phash = near_duplicate_key(image)
+                alt_text, context = _describe_image(image, phash)
+                context_text = context['data']['context'] if context['success'] else ''
+                caption = social_media_caption(context_text)
+                sentiment_result = analyze_sentiment(caption['data']['caption'] if caption['success'] else '')
+                # The caption already carries the LLM's hashtags; no second call is made for them
+                hashtags = generate_hashtags(context_text, caption)
                 
                 return jsonify({
                     'caption': caption,
@@ -72,24 +136,18 @@ def social_media():
                 })
                 
             except Exception as e:
-                print(f"Error processing image: {str(e)}")
+                logger.error(f"Error processing image: {str(e)}")
                 return jsonify({'error': 'Error processing image. Please try again.'}), 500
-            
-            finally:
-                # Clean up uploaded file
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except Exception as e:
-                    print(f"Error removing file: {str(e)}")
         
         except Exception as e:
-            print(f"Server error: {str(e)}")
+            logger.error(f"Server error: {str(e)}")
             return jsonify({'error': 'An unexpected error occurred. Please try again.'}), 500
             
     return render_template('social_media.html')
 
 @main.route('/seo', methods=['GET', 'POST'])
+@cached_response('seo')
+@admission_class('interactive')
 def seo():
     if request.method == 'POST':
         try:
@@ -117,44 +175,39 @@ def seo():
                 }), 400
             
             # Validate image
-            if not validate_image(file.stream):
+            header = validate_image(file.stream)
+            if not header:
                 return jsonify({
                     'success': False,
                     'error': 'Invalid image file',
                     'code': 'INVALID_IMAGE'
                 }), 400
                 
-            # Save and process image
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
             try:
-                image = Image.open(filepath)
-                alt_text = image_processor.generate_alt_text(image)
-                context = generate_context(alt_text)
+                # Decode straight from the upload stream, no copy on disk
+                image = open_upload_image(file, header)
+                phash = near_duplicate_key(image)
+                cached = near_duplicate_cache.lookup(phash)
+                if cached and cached.get('seo'):
+                    return jsonify(cached['seo'])
+
+                alt_text, context = _describe_image(image, phash, cached or {})
                 seo_description = generate_seo_description(context, alt_text)
+                if seo_description['success']:
+                    near_duplicate_cache.store(phash, seo=seo_description)
                 
                 return jsonify(seo_description)
                 
             except Exception as e:
-                print(f"Error processing image: {str(e)}")
+                logger.error(f"Error processing image: {str(e)}")
                 return jsonify({
                     'success': False,
                     'error': 'Error processing image. Please try again.',
                     'code': 'PROCESSING_ERROR'
                 }), 500
-            
-            finally:
-                # Clean up uploaded file
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except Exception as e:
-                    print(f"Error removing file: {str(e)}")
         
         except Exception as e:
-            print(f"Server error: {str(e)}")
+            logger.error(f"Server error: {str(e)}")
             return jsonify({
                 'success': False,
                 'error': 'An unexpected error occurred. Please try again.',
@@ -164,6 +217,9 @@ def seo():
     return render_template('seo.html')
 
 @main.route('/general', methods=['GET', 'POST'])
+@cached_response('general', lambda body: _alt_text_succeeded(body.get('alt_text')) and
+                 _services_succeeded(body.get('context'), body.get('enhanced_description')))
+@admission_class('interactive')
 def general():
     if request.method == 'POST':
         try:
@@ -179,19 +235,16 @@ def general():
                 return jsonify({'error': 'Invalid file type. Please upload a PNG, JPG, JPEG, or GIF'}), 400
             
             # Validate image
-            if not validate_image(file.stream):
+            header = validate_image(file.stream)
+            if not header:
                 return jsonify({'error': 'Invalid image file'}), 400
                 
-            # Save and process image
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
             try:
-                image = Image.open(filepath)
-                alt_text = image_processor.generate_alt_text(image)
-                context = generate_context(alt_text)
-                enhanced_description = enhance_context(context)
+                # Decode straight from the upload stream, no copy on disk
+                image = open_upload_image(file, header)
+                phash = near_duplicate_key(image)
+                alt_text, context = _describe_image(image, phash)
+                enhanced_description = enhance_context(context['data']['context'] if context['success'] else None)
                 
                 return jsonify({
                     'alt_text': alt_text,
@@ -200,19 +253,11 @@ def general():
                 })
                 
             except Exception as e:
-                print(f"Error processing image: {str(e)}")
+                logger.error(f"Error processing image: {str(e)}")
                 return jsonify({'error': 'Error processing image. Please try again.'}), 500
-            
-            finally:
-                # Clean up uploaded file
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except Exception as e:
-                    print(f"Error removing file: {str(e)}")
         
         except Exception as e:
-            print(f"Server error: {str(e)}")
+            logger.error(f"Server error: {str(e)}")
             return jsonify({'error': 'An unexpected error occurred. Please try again.'}), 500
             
     return render_template('general.html')
@@ -220,25 +265,46 @@ def general():
 @main.route('/text-to-speech', methods=['POST'])
 def text_to_speech():
     try:
-        text = request.json.get('text', '')
+        payload = request.get_json(silent=True) or {}
+        text = (payload.get('text') or '').strip()
         if not text:
             return jsonify({'error': 'No text provided'}), 400
+        if len(text) > TTS_MAX_TEXT_LENGTH:
+            return jsonify({'error': f'Text exceeds the limit of {TTS_MAX_TEXT_LENGTH} characters'}), 400
+        lang = payload.get('lang') or TTS_DEFAULT_LANG
 
-        # Temporary file for the audio
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        tts = gTTS(text=text, lang='en')
-        tts.save(temp_file.name)
-        
-        return send_file(
-            temp_file.name,
-            mimetype='audio/mp3',
+        # Synthesize once per (text, lang, engine); repeats are served from the audio cache
+        try:
+            path, mimetype, _ = get_tts_service().synthesize(text, lang)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        response = send_file(
+            path,
+            mimetype=mimetype,
             as_attachment=True,
-            download_name='speech.mp3'
+            download_name=f'speech{os.path.splitext(path)[1]}',
+            max_age=TTS_CACHE_MAX_AGE
         )
+        # Stable URL of the cached audio, for players that seek with Range requests
+        response.headers['Content-Location'] = url_for('main.cached_speech', filename=os.path.basename(path))
+        return response
     except Exception as e:
-        print(f"Error generating speech: {str(e)}")  # Add logging
+        logger.error(f"Error generating speech: {str(e)}")
         return jsonify({'error': 'Error generating speech. Please try again.'}), 500
 
+@main.route('/text-to-speech/<filename>', methods=['GET'])
+def cached_speech(filename):
+    """
+    Serve previously synthesized audio from the cache, with ETag and Range (206) support
+    """
+    audio = get_tts_service().cached_audio(filename)
+    if audio is None:
+        return jsonify({'error': 'Audio not found'}), 404
+
+    path, mimetype = audio
+    return send_file(path, mimetype=mimetype, conditional=True, max_age=TTS_CACHE_MAX_AGE)
+
 @main.route('/medical-image-analysis', methods=['GET'])
 def medical_analysis():
     """
@@ -247,6 +313,8 @@ def medical_analysis():
     return render_template('medical.html')
 
 @main.route('/medical-image-analysis', methods=['POST'])
+@cached_response('medical')
+@admission_class('medical')
 def analyze_medical_image_route():
     """
     Route handler for medical image analysis
@@ -275,85 +343,71 @@ def analyze_medical_image_route():
                 'error_code': 'INVALID_FILE_TYPE'
             }), 400
 
-        # Validate uploaded file stream first
-        if not validate_image(file.stream):
+        # Validate uploaded file stream first; DICOM is recognized by its preamble
+        if not identify_medical_format(file.stream):
             return jsonify({
                 'success': False,
                 'error': 'Invalid or corrupted image file',
                 'error_code': 'INVALID_IMAGE'
             }), 400
-            
-        # Reset file stream position after validation
-        file.stream.seek(0)
 
-        # Create a temporary file
-        temp_dir = tempfile.mkdtemp()
+        # Read the study frame by frame straight from the upload stream
         try:
-            # Save the image
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(temp_dir, filename)
-            file.save(filepath)
-
-            # Open image for processing
             try:
-                image = Image.open(filepath)
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                
-                # Generate alt text
-                alt_text = image_processor.generate_alt_text(image)
-                if not isinstance(alt_text, str) or not alt_text.strip():
-                    raise ValueError("Failed to generate image description")
-                
-                # Perform medical analysis
-                analysis_result = analyze_medical_image(image, alt_text)
-                if not analysis_result['success']:
-                    raise ValueError(analysis_result.get('error', 'Failed to analyze medical image'))
-                
-                # Extract data with defaults for missing fields
-                data = analysis_result.get('data', {})
-                
-                # Validate required fields and provide defaults
-                findings = data.get('findings')
-                if not findings or not isinstance(findings, str):
-                    findings = "Standard medical image analysis protocol should be followed. Detailed examination of anatomical structures is recommended."
-                    
-                diagnosis = data.get('diagnosis')
-                if not diagnosis or not isinstance(diagnosis, str):
-                    diagnosis = "Further clinical correlation and detailed examination is recommended for accurate interpretation."
-                    
-                recommendations = data.get('recommendations')
-                if not recommendations or not isinstance(recommendations, str):
-                    recommendations = "Follow standard medical imaging protocols. Consult with healthcare providers for proper interpretation and next steps."
-                
-                confidence_score = float(data.get('confidence_score', 0.7))  # Default confidence score
-                
-                return jsonify({
-                    'success': True,
-                    'data': {
-                        'alt_text': alt_text,
-                        'findings': findings,
-                        'diagnosis': diagnosis,
-                        'recommendations': recommendations,
-                        'confidence_score': confidence_score
-                    }
-                }), 200
-
-            except Exception as e:
-                logger.error(f"Error processing image: {str(e)}")
+                study = load_medical_study(file.stream)
+            except MedicalImageError as e:
                 return jsonify({
                     'success': False,
                     'error': str(e),
-                    'error_code': 'PROCESSING_ERROR'
+                    'error_code': e.code
                 }), 400
 
-        finally:
-            # Clean up temporary files
-            try:
-                import shutil
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                logger.error(f"Error cleaning up temporary files: {str(e)}")
+            # Caption the representative frames only
+            alt_text, description, frame_captions = describe_study(study)
+
+            # Perform medical analysis
+            analysis_result = analyze_medical_image(study.frames[0][1], description)
+            if not analysis_result['success']:
+                raise ValueError(analysis_result.get('error', 'Failed to analyze medical image'))
+            
+            # Extract data with defaults for missing fields
+            data = analysis_result.get('data', {})
+            
+            # Validate required fields and provide defaults
+            findings = data.get('findings')
+            if not findings or not isinstance(findings, str):
+                findings = "Standard medical image analysis protocol should be followed. Detailed examination of anatomical structures is recommended."
+                
+            diagnosis = data.get('diagnosis')
+            if not diagnosis or not isinstance(diagnosis, str):
+                diagnosis = "Further clinical correlation and detailed examination is recommended for accurate interpretation."
+                
+            recommendations = data.get('recommendations')
+            if not recommendations or not isinstance(recommendations, str):
+                recommendations = "Follow standard medical imaging protocols. Consult with healthcare providers for proper interpretation and next steps."
+            
+            confidence_score = float(data.get('confidence_score', 0.7))  # Default confidence score
+            
+            return jsonify({
+                'success': True,
+                'data': {
+                    'alt_text': alt_text,
+                    'findings': findings,
+                    'diagnosis': diagnosis,
+                    'recommendations': recommendations,
+                    'confidence_score': confidence_score,
+                    'frames': frame_captions,
+                    'study': study.info
+                }
+            }), 200
+
+        except Exception as e:
+            logger.error(f"Error processing image: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'error_code': 'PROCESSING_ERROR'
+            }), 400
 
     except Exception as e:
         logger.error(f"Unexpected error in medical analysis route: {str(e)}")
@@ -364,9 +418,14 @@ def analyze_medical_image_route():
         }), 500
 
 @main.route('/image-analyzer', methods=['GET', 'POST'])
+@cached_response('image_analyzer', lambda body: _alt_text_succeeded(body.get('data', {}).get('alt_text')))
+@admission_class('interactive')
 def image_analyzer():
     if request.method == 'POST':
         try:
+            image_url = None
+            header = None
+            
             # Check for file upload
             if 'image' in request.files:
                 file = request.files['image']
@@ -385,37 +444,40 @@ def image_analyzer():
                     }), 400
                 
                 # Validate image
-                if not validate_image(file.stream):
+                header = validate_image(file.stream)
+                if not header:
                     return jsonify({
                         'success': False,
                         'error': 'Invalid image file',
                         'code': 'INVALID_IMAGE'
                     }), 400
                     
-                # Save and process image
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(filepath)
+                image_source = file.stream
                 
             # Check for image URL
             elif 'image_url' in request.form:
                 image_url = request.form['image_url']
                 try:
-                    # Download image from URL
-                    response = requests.get(image_url)
-                    if response.status_code != 200:
+                    # Download image from URL, revalidating URLs analyzed before
+                    fetched = remote_image_fetcher.fetch(image_url, revalidate=url_result_cache.has(image_url))
+                    cached_result = url_result_cache.get(image_url, fetched.content_hash)
+                    if cached_result is not None:
                         return jsonify({
-                            'success': False,
-                            'error': 'Failed to download image from URL',
-                            'code': 'URL_DOWNLOAD_ERROR'
-                        }), 400
+                            'success': True,
+                            'data': cached_result
+                        })
+                    if fetched.not_modified:
+                        # Unchanged, but the results were computed from other content
+                        fetched = remote_image_fetcher.fetch(image_url, revalidate=False)
+
+                    image_source = io.BytesIO(fetched.content)
                     
-                    # Save temporary file
-                    filename = f"url_image_{int(time.time())}.jpg"
-                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-                    with open(filepath, 'wb') as f:
-                        f.write(response.content)
-                        
+                except FetchError as e:
+                    return jsonify({
+                        'success': False,
+                        'error': str(e),
+                        'code': e.code
+                    }), 400
                 except Exception as e:
                     return jsonify({
                         'success': False,
@@ -431,9 +493,9 @@ def image_analyzer():
             
             try:
                 # Process the image
-                image = Image.open(filepath)
-                alt_text = image_processor.generate_alt_text(image)
-                context_result = generate_context(alt_text)
+                image = decode_image(image_source, header)
+                phash = near_duplicate_key(image)
+                alt_text, context_result = _describe_image(image, phash)
                 
                 if not context_result['success']:
                     raise Exception(context_result['error'])
@@ -447,37 +509,39 @@ def image_analyzer():
                     
                 sentiment_data = sentiment_result['data']['sentiment']
                 
+                data = {
+                    'alt_text': alt_text,
+                    'context': context,
+                    'sentiment': {
+                        'score': sentiment_data['score'],
+                        'label': sentiment_data['category'],
+                        'details': f"The description has a {sentiment_data['category'].lower()} tone with {sentiment_data['score']*100:.1f}% confidence."
+                    }
+                }
+                if image_url and _alt_text_succeeded(alt_text):
+                    url_result_cache.set(image_url, fetched.content_hash, data)
+                
                 return jsonify({
                     'success': True,
-                    'data': {
-                        'alt_text': alt_text,
-                        'context': context,
-                        'sentiment': {
-                            'score': sentiment_data['score'],
-                            'label': sentiment_data['category'],
-                            'details': f"The description has a {sentiment_data['category'].lower()} tone with {sentiment_data['score']*100:.1f}% confidence."
-                        }
-                    }
+                    'data': data
                 })
                 
+            except ImageValidationError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                    'code': e.code
+                }), 400
             except Exception as e:
-                print(f"Error processing image: {str(e)}")
+                logger.error(f"Error processing image: {str(e)}")
                 return jsonify({
                     'success': False,
                     'error': 'Error processing image. Please try again.',
                     'code': 'PROCESSING_ERROR'
                 }), 500
-            
-            finally:
-                # Clean up uploaded file
-                try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                except Exception as e:
-                    print(f"Error removing file: {str(e)}")
         
         except Exception as e:
-            print(f"Server error: {str(e)}")
+            logger.error(f"Server error: {str(e)}")
             return jsonify({
                 'success': False,
                 'error': 'An unexpected error occurred. Please try again.',
@@ -486,22 +550,37 @@ def image_analyzer():
             
     return render_template('image_analyzer.html')
 
-def generate_hashtags(context):
-    """Generate relevant hashtags from the context using OpenAI"""
+def generate_hashtags(context, caption=None):
+    """
+    Generate relevant hashtags for a context from the hashtags of its social
+    media caption, which are learned by the local hashtag index. Without
+    any, the index's recommendation is used when it is confident, and
+    otherwise words of the context.
+    Args:
+        context (str): Context text
+        caption (dict): social_media_caption response for the context
+    Returns:
+        str: Space-separated hashtags
+    """
     try:
-        # Use the existing social_media_caption function but extract hashtags
-        caption_with_hashtags = social_media_caption(context)
-        words = caption_with_hashtags.split()
-        hashtags = [word for word in words if word.startswith('#')]
-        
-        # If no hashtags found in the caption, generate basic ones from context
-        if not hashtags:
-            words = context.split()
-            hashtags = [f"#{word.lower()}" for word in words if len(word) > 3][:5]
-        
+        index = get_hashtag_index()
+        if caption and caption['success']:
+            hashtags = extract_hashtags(caption['data']['caption'])
+            if hashtags:
+                index.learn(context, hashtags)
+                return " ".join(hashtags)
+
+        if index.ready:
+            hashtags, confidence = index.recommend(context)
+            if hashtags and confidence >= HASHTAG_MIN_CONFIDENCE:
+                return " ".join(hashtags)
+
+        # Basic hashtags from the context
+        words = context.split()
+        hashtags = [f"#{word.lower()}" for word in words if len(word) > 3][:5]
         return " ".join(hashtags)
     except Exception as e:
-        print(f"Error generating hashtags: {str(e)}")  # Add logging
+        logger.error(f"Error generating hashtags: {str(e)}")
         return ""
 
 @main.route('/advanced-analysis', methods=['GET'])
@@ -512,6 +591,7 @@ def advanced_analysis():
     return render_template('advanced_analysis.html')
 
 @main.route('/advanced-analysis', methods=['POST'])
+@admission_class('interactive')
 def process_advanced_analysis():
     """
     Route handler for advanced image analysis
@@ -533,136 +613,506 @@ def process_advanced_analysis():
             }), 400
 
         # Check file extension
-        if not allowed_file(file.filename, {'png', 'jpg', 'jpeg'}):
+        # TIFF and BMP are accepted for very large scans, whose raw pixels are analyzed strip by strip
+        if not allowed_file(file.filename, {'png', 'jpg', 'jpeg', 'tif', 'tiff', 'bmp'}):
             return jsonify({
                 'success': False,
-                'error': 'File type not allowed. Supported types: PNG, JPG, JPEG',
+                'error': 'File type not allowed. Supported types: PNG, JPG, JPEG, TIFF, BMP',
                 'error_code': 'INVALID_FILE_TYPE'
             }), 400
 
         # Validate uploaded file stream first
-        if not validate_image(file.stream):
+        header = validate_image(file.stream)
+        if not header:
             return jsonify({
                 'success': False,
                 'error': 'Invalid or corrupted image file',
                 'error_code': 'INVALID_IMAGE'
             }), 400
+
+        # Reject images whose decoder cannot stay within the analysis memory ceiling
+        try:
+            check_within_ceiling(header.image)
+        except ImageValidationError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'error_code': e.code
+            }), 400
             
         # Reset file stream position after validation
         file.stream.seek(0)
 
-        # Create a temporary file
-        temp_dir = tempfile.mkdtemp()
+        # Keep the upload in memory; the color analysis worker gets a copy of the bytes
+        image_bytes = file.stream.read()
+        image_hash = compute_image_hash(image_bytes)
+        color_future = None
+
+        # Process image
         try:
-            # Save the image
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(temp_dir, filename)
-            file.save(filepath)
+            processor = AdvancedImageProcessor()
 
-            # Process image
+            # Color analysis only needs the pixels, so it runs in a worker
+            # process while the caption and LLM chain is in flight
+            color_future = submit_color_analysis(image_bytes)
+            
+            # Load and validate image
             try:
-                processor = AdvancedImageProcessor()
-                
-                # Load and validate image
-                try:
-                    image, image_array = processor.load_image(filepath)
-                    if image is None or image_array is None:
-                        raise ValueError("Failed to load image")
-                except Exception as e:
-                    logger.error(f"Error loading image: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Failed to load image file',
-                        'error_code': 'IMAGE_LOAD_ERROR'
-                    }), 400
-                
-                # Generate BLIP description with error handling
-                try:
-                    blip_description = processor.generate_image_context()
-                    if not blip_description or not isinstance(blip_description, str):
-                        raise ValueError("Invalid BLIP description generated")
-                except Exception as e:
-                    logger.error(f"Error generating BLIP description: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Failed to generate image description',
-                        'error_code': 'BLIP_ERROR'
-                    }), 400
-                
-                # Generate enhanced description with error handling
-                try:
-                    enhanced_description = processor.generate_enhanced_text(blip_description)
-                    if not enhanced_description or not isinstance(enhanced_description, str):
-                        raise ValueError("Invalid enhanced description generated")
-                except Exception as e:
-                    logger.error(f"Error generating enhanced description: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Failed to enhance description',
-                        'error_code': 'ENHANCEMENT_ERROR'
-                    }), 400
-                
-                # Analyze colors with error handling
-                try:
-                    color_hist_fig, color_pie_fig, color_data = processor.analyze_colors()
-                    if color_hist_fig is None or color_pie_fig is None or color_data is None:
-                        raise ValueError("Color analysis failed to generate results")
-                except Exception as e:
-                    logger.error(f"Error analyzing colors: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Failed to analyze image colors',
-                        'error_code': 'COLOR_ANALYSIS_ERROR'
-                    }), 400
-                
-                # Analyze sentiment with error handling
-                try:
-                    sentiment_df = processor.sentiment_analysis(enhanced_description)
-                    if sentiment_df is None or sentiment_df.empty:
-                        raise ValueError("Sentiment analysis returned no results")
-                        
-                    sentiment_data = {
-                        'label': sentiment_df['Sentiment'].iloc[0],
-                        'confidence': float(sentiment_df['Confidence'].iloc[0])
-                    }
-                except Exception as e:
-                    logger.error(f"Error analyzing sentiment: {str(e)}")
-                    return jsonify({
-                        'success': False,
-                        'error': 'Failed to analyze sentiment',
-                        'error_code': 'SENTIMENT_ERROR'
-                    }), 400
-                
+                image = processor.load_caption_image(io.BytesIO(image_bytes))
+                if image is None:
+                    raise ValueError("Failed to load image")
+            except Exception as e:
+                logger.error(f"Error loading image: {str(e)}")
                 return jsonify({
-                    'success': True,
-                    'data': {
-                        'blip_description': blip_description,
-                        'enhanced_description': enhanced_description,
-                        'color_analysis': color_data,
-                        'sentiment': sentiment_data
+                    'success': False,
+                    'error': 'Failed to load image file',
+                    'error_code': 'IMAGE_LOAD_ERROR'
+                }), 400
+            
+            # Generate BLIP description with error handling
+            try:
+                blip_description = processor.generate_image_context(image)
+                if not blip_description or not isinstance(blip_description, str):
+                    raise ValueError("Invalid BLIP description generated")
+            except Exception as e:
+                logger.error(f"Error generating BLIP description: {str(e)}")
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to generate image description',
+                    'error_code': 'BLIP_ERROR'
+                }), 400
+            
+            # Generate enhanced description with error handling
+            try:
+                enhanced_description = processor.generate_enhanced_text(blip_description)
+                if not enhanced_description or not isinstance(enhanced_description, str):
+                    raise ValueError("Invalid enhanced description generated")
+            except Exception as e:
+                logger.error(f"Error generating enhanced description: {str(e)}")
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to enhance description',
+                    'error_code': 'ENHANCEMENT_ERROR'
+                }), 400
+            
+            # Join the color analysis with error handling
+            try:
+                color_data, quality = color_future.result(timeout=COLOR_ANALYSIS_TIMEOUT)
+                if color_data is None:
+                    raise ValueError("Color analysis failed to generate results")
+                store_color_data(image_hash, color_data)
+            except Exception as e:
+                logger.error(f"Error analyzing colors: {str(e)}")
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to analyze image colors',
+                    'error_code': 'COLOR_ANALYSIS_ERROR'
+                }), 400
+            
+            # Analyze sentiment with error handling
+            try:
+                sentiment_df = processor.sentiment_analysis(enhanced_description)
+                if sentiment_df is None or sentiment_df.empty:
+                    raise ValueError("Sentiment analysis returned no results")
+                    
+                sentiment_data = {
+                    'label': sentiment_df['Sentiment'].iloc[0],
+                    'confidence': float(sentiment_df['Confidence'].iloc[0])
+                }
+            except Exception as e:
+                logger.error(f"Error analyzing sentiment: {str(e)}")
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to analyze sentiment',
+                    'error_code': 'SENTIMENT_ERROR'
+                }), 400
+            
+            return jsonify({
+                'success': True,
+                'data': {
+                    'blip_description': blip_description,
+                    'enhanced_description': enhanced_description,
+                    'color_analysis': color_data,
+                    'quality': quality,
+                    'sentiment': sentiment_data,
+                    'image_hash': image_hash,
+                    'charts': {
+                        chart: {
+                            fmt: url_for('main.color_chart', image_hash=image_hash, chart=chart, fmt=fmt)
+                            for fmt in CHART_FORMATS
+                        }
+                        for chart in CHART_TYPES
                     }
-                }), 200
+                }
+            }), 200
+
+        except Exception as e:
+            logger.error(f"Error processing image: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'error_code': 'PROCESSING_ERROR'
+            }), 400
+
+        finally:
+            # Stop waiting on color analysis if the request failed early
+            if color_future is not None:
+                color_future.cancel()
+
+    except Exception as e:
+        logger.error(f"Unexpected error in advanced analysis route: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred during analysis',
+            'error_code': 'SERVER_ERROR'
+        }), 500 
+
+@main.route('/advanced-analysis/charts/<image_hash>/<chart>.<fmt>', methods=['GET'])
+def color_chart(image_hash, chart, fmt):
+    """
+    Route handler for lazily rendered color analysis charts
+    """
+    try:
+        if chart not in CHART_TYPES or fmt not in CHART_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown chart. Supported charts: {", ".join(CHART_TYPES)} as {", ".join(CHART_FORMATS)}',
+                'error_code': 'INVALID_CHART'
+            }), 404
+
+        etag = chart_etag(image_hash, chart, fmt)
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        output = render_chart(image_hash, chart, fmt)
+        if output is None:
+            return jsonify({
+                'success': False,
+                'error': 'No color analysis found for this image. Please analyze it again.',
+                'error_code': 'CHART_NOT_FOUND'
+            }), 404
+
+        response = make_response(output)
+        response.mimetype = CHART_FORMATS[fmt]
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response
+
+    except Exception as e:
+        logger.error(f"Error rendering color chart: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to render chart',
+            'error_code': 'CHART_RENDER_ERROR'
+        }), 500
+
+
+@main.route('/batch', methods=['POST'])
+def batch_analysis():
+    """
+    Route handler for batch image analysis.
+    Accepts many 'images' files and/or a zip 'archive', plus the requested
+    'analyses', and streams one NDJSON line per image as each one finishes.
+    """
+    try:
+        analyses = [name.strip() for value in request.form.getlist('analyses')
+                    for name in value.split(',') if name.strip()] or ['alt_text']
+        try:
+            resolve_stages(analyses)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'error_code': 'INVALID_ANALYSES'
+            }), 400
+
+        files = [file for file in request.files.getlist('images') if file.filename]
+        archive = request.files.get('archive')
+        if not files and not (archive and archive.filename):
+            return jsonify({
+                'success': False,
+                'error': 'No images or archive provided',
+                'error_code': 'NO_FILE'
+            }), 400
 
+        # Count the archive's images from its directory before anything is streamed
+        members = []
+        if archive and archive.filename:
+            try:
+                members = list_zip_images(archive.stream)
+            except zipfile.BadZipFile:
+                return jsonify({
+                    'success': False,
+                    'error': 'Archive is not a valid zip file',
+                    'error_code': 'INVALID_ARCHIVE'
+                }), 400
+
+        if len(files) + len(members) > BATCH_MAX_IMAGES:
+            return jsonify({
+                'success': False,
+                'error': f'Batch exceeds the limit of {BATCH_MAX_IMAGES} images',
+                'error_code': 'BATCH_TOO_LARGE'
+            }), 400
+
+        def iter_images():
+            for file in files:
+                if not allowed_file(file.filename):
+                    yield file.filename, b''
+                    continue
+                yield file.filename, file.stream.read()
+            if members:
+                yield from iter_zip_images(archive.stream, members)
+
+        def generate():
+            try:
+                # Every image is admitted on its own, with its own deadline
+                for result in iter_batch_results(iter_images(), analyses, priority_class='batch'):
+                    yield json.dumps(result) + '\n'
             except Exception as e:
-                logger.error(f"Error processing image: {str(e)}")
+                logger.error(f"Error in batch analysis: {str(e)}")
+                yield json.dumps({
+                    'success': False,
+                    'error': str(e),
+                    'code': 'BATCH_ERROR'
+                }) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Unexpected error in batch route: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred during batch analysis',
+            'error_code': 'SERVER_ERROR'
+        }), 500
+
+
+@main.route('/analyze', methods=['POST'])
+@cached_response('analyze', lambda body: not body.get('errors'))
+@admission_class('interactive')
+def analyze():
+    """
+    Route handler for multi-mode analysis of one image.
+    Takes an 'image' file (or 'image_url') and the requested 'outputs', e.g.
+    seo,caption,sentiment. Alt text and context are computed once and shared
+    by every output, and independent outputs run concurrently.
+    """
+    try:
+        outputs = [name.strip() for value in request.form.getlist('outputs')
+                   for name in value.split(',') if name.strip()] or ['alt_text', 'context']
+        try:
+            resolve_stages(outputs)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e),
+                'code': 'INVALID_OUTPUTS'
+            }), 400
+
+        if 'image' in request.files:
+            file = request.files['image']
+            if file.filename == '' or not allowed_file(file.filename):
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid file type. Please upload a PNG, JPG, JPEG, or GIF',
+                    'code': 'INVALID_TYPE'
+                }), 400
+            header = validate_image(file.stream)
+            if not header:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid image file',
+                    'code': 'INVALID_IMAGE'
+                }), 400
+            image = open_upload_image(file, header)
+        elif request.form.get('image_url'):
+            try:
+                image = decode_image(io.BytesIO(remote_image_fetcher.fetch(request.form['image_url'], revalidate=False).content))
+            except (FetchError, ImageValidationError) as e:
                 return jsonify({
                     'success': False,
                     'error': str(e),
-                    'error_code': 'PROCESSING_ERROR'
+                    'code': e.code
                 }), 400
+        else:
+            return jsonify({
+                'success': False,
+                'error': 'No image file or URL provided',
+                'code': 'NO_INPUT'
+            }), 400
 
-        finally:
-            # Clean up temporary files
+        # Seed the pipeline with results stored for a near-duplicate image
+        phash = near_duplicate_key(image)
+        cached = near_duplicate_cache.lookup(phash) or {}
+        known = {}
+        if cached.get('alt_text'):
+            known['alt_text'] = cached['alt_text']
+        if cached.get('context'):
+            known['context'] = cached['context']['data']['context']
+        if cached.get('seo'):
+            known['seo'] = cached['seo']['data']
+
+        values, errors = run_pipeline(outputs, image=image, known=known)
+
+        stored = {}
+        if 'alt_text' in values:
+            stored['alt_text'] = values['alt_text']
+        if 'context' in values:
+            stored['context'] = format_success_response({'context': values['context']})
+        if 'seo' in values:
+            stored['seo'] = format_success_response(values['seo'])
+        if stored:
+            near_duplicate_cache.store(phash, **stored)
+
+        data = {name: values[name] for name in outputs if name in values}
+        output_errors = {name: errors[name] for name in outputs if name in errors}
+        if not data:
+            return jsonify({
+                'success': False,
+                'error': 'Error processing image. Please try again.',
+                'code': 'PROCESSING_ERROR',
+                'errors': output_errors
+            }), 500
+
+        return jsonify({
+            'success': True,
+            'data': data,
+            'errors': output_errors
+        })
+
+    except Exception as e:
+        logger.error(f"Unexpected error in analyze route: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred. Please try again.',
+            'code': 'SERVER_ERROR'
+        }), 500
+
+
+@main.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Route handler for submitting a long-running analysis as an asynchronous job.
+    Returns a job ID immediately; poll /jobs/<job_id> or pass a callback_url.
+    """
+    try:
+        kind = request.form.get('kind', '')
+        if kind not in JOB_HANDLERS:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown job kind. Supported kinds: {", ".join(JOB_HANDLERS)}',
+                'error_code': 'INVALID_JOB_KIND'
+            }), 400
+
+        file = request.files.get('file') or request.files.get('image')
+        if file is None or file.filename == '':
+            return jsonify({
+                'success': False,
+                'error': 'No file uploaded',
+                'error_code': 'NO_FILE'
+            }), 400
+
+        allowed_extensions = ALLOWED_MEDICAL_EXTENSIONS if kind == 'medical' else None
+        if not allowed_file(file.filename, allowed_extensions):
+            return jsonify({
+                'success': False,
+                'error': 'File type not allowed',
+                'error_code': 'INVALID_FILE_TYPE'
+            }), 400
+
+        valid = identify_medical_format(file.stream) if kind == 'medical' else validate_image(file.stream)
+        if not valid:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid or corrupted image file',
+                'error_code': 'INVALID_IMAGE'
+            }), 400
+
+        callback_url = request.form.get('callback_url') or None
+        if callback_url:
             try:
-                import shutil
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                logger.error(f"Error cleaning up temporary files: {str(e)}")
+                check_callback_url(callback_url)
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                    'error_code': 'INVALID_CALLBACK_URL'
+                }), 400
+
+        file.stream.seek(0)
+        job_id = get_job_queue().submit(kind, file.stream.read(), callback_url=callback_url)
+        status_url = url_for('main.job_status', job_id=job_id)
+
+        response = jsonify({
+            'success': True,
+            'data': {
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': status_url
+            }
+        })
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
 
     except Exception as e:
-        logger.error(f"Unexpected error in advanced analysis route: {str(e)}")
+        logger.error(f"Error submitting job: {str(e)}")
         return jsonify({
             'success': False,
-            'error': 'An unexpected error occurred during analysis',
+            'error': 'An unexpected error occurred while submitting the job',
+            'error_code': 'SERVER_ERROR'
+        }), 500
+
+@main.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Route handler for polling the status and result of an asynchronous job
+    """
+    try:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found',
+                'error_code': 'JOB_NOT_FOUND'
+            }), 404
+
+        return jsonify({
+            'success': True,
+            'data': job
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error reading job status: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred while reading the job',
             'error_code': 'SERVER_ERROR'
-        }), 500 
\ No newline at end of file
+        }), 500
+
+@main.route('/metrics/capacity', methods=['GET'])
+def capacity_metrics():
+    """
+    Route handler reporting slots in use, queue depth and shed counts per resource
+    """
+    return jsonify({
+        'success': True,
+        'data': capacity_manager.metrics()
+    }), 200
+
+@main.route('/metrics/semantic-cache', methods=['GET'])
+def semantic_cache_metrics():
+    """
+    Route handler reporting hit rates of the semantic context caches,
+    including the hit rate each candidate similarity threshold would give
+    """
+    return jsonify({
+        'success': True,
+        'data': {
+            'context': context_cache.metrics(),
+            'enhanced_context': enhanced_context_cache.metrics()
+        }
+    }), 200
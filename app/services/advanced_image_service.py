@@ -1,38 +1,99 @@
+import io
+import os
 import numpy as np
 from PIL import Image
-import matplotlib
-matplotlib.use('Agg')  # Set non-interactive backend before importing pyplot
-import matplotlib.pyplot as plt
 import pandas as pd
 from sklearn.cluster import KMeans
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
 from app.services.text_service import generate_context, enhance_context, analyze_sentiment
-from app.services.image_service import image_processor
+from app.services.color_names import named_color_index
+from app.services.tiled_image_service import analyze_image_tiled, needs_tiling, build_quality_metrics
+from app.services.keyframe_service import is_multiframe
+from app.utils.tracing import span, current_traceparent
+from config.config import (
+    COLOR_ANALYSIS_MAX_SIDE,
+    COLOR_HISTOGRAM_BINS,
+    COLOR_ANALYSIS_WORKERS,
+    TILED_PREVIEW_MAX_SIDE
+)
+import logging
+
+logger = logging.getLogger(__name__)
 
 class AdvancedImageProcessor:
-    def __init__(self):
-        self.image = None
-        self.image_array = None
-        self.color_clusters = 5  # Number of dominant colors to detect
+    """
+    Stateless advanced image analysis.
+    Every method works only on its arguments, so one instance can be shared
+    between threads and color analysis can run in a separate process.
+    """
+
+    def __init__(self, color_clusters=5):
+        self.color_clusters = color_clusters  # Number of dominant colors to detect
 
-    def load_image(self, image_path):
-        """Load and prepare image for processing"""
+    def load_image(self, source, tiled=None):
+        """
+        Load and prepare image for color analysis.
+        Images too large to decode within TILED_ANALYSIS_MEMORY_CEILING are read
+        in strips; only a downsampled preview is kept in memory.
+        Args:
+            source: Path or binary file object of the image
+            tiled (bool): Force tiled processing on or off; decided from the image size if None
+        Returns:
+            tuple: (RGB image, accumulated tile statistics or None)
+        """
         try:
-            self.image = Image.open(image_path)
+            image = Image.open(source)
+            if tiled is None:
+                tiled = needs_tiling(image.size)
+
+            if tiled:
+                color_stats = analyze_image_tiled(source)
+                return color_stats.preview, color_stats
+
             # Convert image to RGB mode if it isn't already
-            if self.image.mode != 'RGB':
-                self.image = self.image.convert('RGB')
-            self.image_array = np.array(self.image)
-            return self.image, self.image_array
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return image, None
+        except Exception as e:
+            raise ValueError(f"Error loading image: {str(e)}")
+
+    def load_caption_image(self, source):
+        """
+        Load an RGB image suitable for captioning.
+        Large JPEGs are decoded at reduced scale instead of being read in tiles;
+        multi-frame images are returned as opened.
+        Args:
+            source: Path or binary file object of the image
+        Returns:
+            PIL.Image: RGB image
+        """
+        try:
+            image = Image.open(source)
+            if needs_tiling(image.size):
+                if image.format != 'JPEG':
+                    return self.load_image(source, tiled=True)[0]
+                # thumbnail() applies JPEG draft mode before decoding
+                image.thumbnail((TILED_PREVIEW_MAX_SIDE, TILED_PREVIEW_MAX_SIDE))
+            # Animations stay open so their keyframes can be captioned
+            if image.mode != 'RGB' and not is_multiframe(image):
+                image = image.convert('RGB')
+            return image
         except Exception as e:
             raise ValueError(f"Error loading image: {str(e)}")
 
-    def generate_image_context(self):
+    def generate_image_context(self, image):
         """Generate BLIP description for the image"""
+        # Imported here so color analysis worker processes never load the BLIP model
+        from app.services.image_service import image_processor
+
         try:
-            if self.image is None:
+            if image is None:
                 raise ValueError("No image loaded")
             
-            alt_text = image_processor.generate_alt_text(self.image)
+            alt_text = image_processor.generate_alt_text(image)
             context_result = generate_context(alt_text)
             
             if not context_result['success']:
@@ -60,75 +121,111 @@ class AdvancedImageProcessor:
         except Exception as e:
             raise ValueError(f"Error generating enhanced text: {str(e)}")
 
-    def analyze_colors(self):
-        """Analyze color distribution and dominant colors"""
+    def _analysis_buffer(self, image):
+        """Downsample an image to the buffer used for color statistics"""
+        buffer = image.copy()
+        buffer.thumbnail((COLOR_ANALYSIS_MAX_SIDE, COLOR_ANALYSIS_MAX_SIDE), Image.BILINEAR)
+        return buffer
+
+    @staticmethod
+    def compute_histogram(rgb_pixels, hsv_pixels, bins=COLOR_HISTOGRAM_BINS):
+        """
+        Compute normalized per-channel RGB and HSV histograms in a single pass
+        Args:
+            rgb_pixels (np.ndarray): uint8 array of shape (n, 3)
+            hsv_pixels (np.ndarray): uint8 array of shape (n, 3)
+            bins (int): Number of bins per channel
+        Returns:
+            dict: Bin edges and the histogram of every channel
+        """
+        channels = np.concatenate([rgb_pixels, hsv_pixels], axis=1).astype(np.int64)
+        # Offset each channel's bin indices so one bincount covers all six channels
+        bin_indices = (channels * bins) // 256 + np.arange(6) * bins
+        counts = np.bincount(bin_indices.ravel(), minlength=6 * bins).reshape(6, bins)
+        histogram = counts / max(len(channels), 1)
+
+        return {
+            'bin_edges': np.linspace(0, 256, bins + 1).tolist(),
+            'rgb': {name: histogram[i].tolist() for i, name in enumerate(('r', 'g', 'b'))},
+            'hsv': {name: histogram[i + 3].tolist() for i, name in enumerate(('h', 's', 'v'))}
+        }
+
+    def analyze_colors(self, image, color_stats=None):
+        """
+        Analyze color distribution and dominant colors.
+        Statistics are computed on a downsampled buffer; charts are not
+        rendered here, see app.services.chart_service.
+        Args:
+            image (PIL.Image): RGB image, or the preview of a tiled image
+            color_stats (ColorStatsAccumulator): Full-resolution statistics of a tiled image
+        Returns:
+            dict: Color data for the JSON response
+        """
         try:
-            if self.image_array is None:
+            if image is None:
                 raise ValueError("No image loaded")
 
-            # Reshape the image array for color analysis
-            pixels = self.image_array.reshape(-1, 3)
+            buffer = self._analysis_buffer(image)
+            pixels = np.asarray(buffer).reshape(-1, 3)
+            hsv_pixels = np.asarray(buffer.convert('HSV')).reshape(-1, 3)
             
-            # Create color histogram
-            plt.figure(figsize=(8, 4))
-            hist_data = np.mean(pixels, axis=0)
-            plt.plot(range(3), hist_data, marker='o')
-            plt.xticks(range(3), ['R', 'G', 'B'])
-            plt.title('Color Distribution')
-            plt.grid(True)
-            hist_fig = plt.gcf()
-            plt.close()
+            if color_stats is not None:
+                # Full-resolution statistics accumulated while reading the tiles
+                hist_data = np.array(color_stats.distribution())
+                histogram = color_stats.histogram()
+            else:
+                # Mean value of each channel
+                hist_data = np.mean(pixels, axis=0)
+                histogram = self.compute_histogram(pixels, hsv_pixels)
 
             # Find dominant colors using K-means
-            kmeans = KMeans(n_clusters=self.color_clusters, random_state=42)
-            kmeans.fit(pixels)
+            n_clusters = min(self.color_clusters, len(pixels))
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+            with span('kmeans', clusters=n_clusters, pixels=len(pixels)):
+                kmeans.fit(pixels)
             colors = kmeans.cluster_centers_
             
             # Calculate color percentages
             labels = kmeans.labels_
-            unique_labels, label_counts = np.unique(labels, return_counts=True)
+            label_counts = np.bincount(labels, minlength=n_clusters)
             percentages = (label_counts / len(labels)) * 100
             
             # Sort colors by percentage
             sorted_indices = np.argsort(percentages)[::-1]
             colors = colors[sorted_indices]
             percentages = percentages[sorted_indices]
-            
-            # Create pie chart of dominant colors
-            plt.figure(figsize=(6, 6))
-            
-            # Convert colors to RGB format for plotting
-            rgb_colors = colors / 255.0
-            
-            # Create pie chart with percentage labels
-            patches, texts, autotexts = plt.pie(percentages, 
-                                              colors=rgb_colors, 
-                                              autopct='%1.1f%%',
-                                              labels=[f'Color {i+1}' for i in range(len(colors))])
-            
-            plt.title('Dominant Colors')
-            
-            # Format percentage texts
-            for autotext in autotexts:
-                autotext.set_color('white')
-                autotext.set_fontsize(8)
-            
-            pie_fig = plt.gcf()
-            plt.close()
 
             # Convert color data for JSON response
             color_data = {
                 'bins': list(range(3)),  # R, G, B channels
                 'distribution': hist_data.tolist(),  # Color distribution data
+                'histogram': histogram,  # Binned RGB/HSV histograms
                 'dominant_colors': colors.astype(int).tolist(),  # RGB values of dominant colors
+                'color_names': named_color_index.nearest(colors),  # Nearest named color of each dominant color
                 'percentages': percentages.tolist()  # Percentage of each dominant color
             }
 
-            return hist_fig, pie_fig, color_data
+            return color_data
         except Exception as e:
             logger.error(f"Color analysis error details: {str(e)}")
             raise ValueError(f"Error analyzing colors: {str(e)}")
 
+    def quality_metrics(self, image, color_stats=None):
+        """
+        Return quality metrics of an image
+        Args:
+            image (PIL.Image): RGB image
+            color_stats (ColorStatsAccumulator): Full-resolution statistics of a tiled image
+        Returns:
+            dict: Quality metrics
+        """
+        if color_stats is not None:
+            return color_stats.quality_metrics()
+        if image is None:
+            raise ValueError("No image loaded")
+        img_array = np.asarray(image)
+        return build_quality_metrics(np.mean(img_array), np.std(img_array), image.size)
+
     def sentiment_analysis(self, text):
         """Analyze sentiment of the description"""
         try:
@@ -142,4 +239,58 @@ class AdvancedImageProcessor:
                 'Confidence': sentiment_data['score']
             }])
         except Exception as e:
-            raise ValueError(f"Error analyzing sentiment: {str(e)}") 
\ No newline at end of file
+            raise ValueError(f"Error analyzing sentiment: {str(e)}") 
+
+def analyze_image_colors(source, traceparent=None):
+    """
+    Load an image and run color and quality analysis on it.
+    Module-level so it can be submitted to the color analysis process pool.
+    Args:
+        source: Path of the image, or its content as bytes
+        traceparent (str): Trace context of the submitting request
+    Returns:
+        tuple: (color data, quality metrics)
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    with span('color_analysis', parent=traceparent, pid=os.getpid()):
+        processor = AdvancedImageProcessor()
+        image, color_stats = processor.load_image(source)
+        color_data = processor.analyze_colors(image, color_stats)
+        quality = processor.quality_metrics(image, color_stats)
+        return color_data, quality
+
+
+_color_pool = None
+_color_pool_lock = threading.Lock()
+
+
+def _get_color_pool(reset=False):
+    """Create the color analysis process pool on first use"""
+    global _color_pool
+    with _color_pool_lock:
+        if reset and _color_pool is not None:
+            _color_pool.shutdown(wait=False, cancel_futures=True)
+            _color_pool = None
+        if _color_pool is None:
+            # Spawned workers start clean instead of inheriting model threads and locks
+            _color_pool = ProcessPoolExecutor(max_workers=COLOR_ANALYSIS_WORKERS,
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return _color_pool
+
+
+def submit_color_analysis(source):
+    """
+    Schedule analyze_image_colors on the color analysis process pool
+    Args:
+        source: Path of the image, or its content as bytes
+    Returns:
+        concurrent.futures.Future: Resolves to (color data, quality metrics)
+    """
+    traceparent = current_traceparent()
+    try:
+        return _get_color_pool().submit(analyze_image_colors, source, traceparent)
+    except BrokenProcessPool:
+        logger.error("Color analysis pool is broken, restarting it")
+        return _get_color_pool(reset=True).submit(analyze_image_colors, source, traceparent)
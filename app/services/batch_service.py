@@ -0,0 +1,139 @@
+"""
+Batch processing of many images through a bounded worker pool.
+"""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import io
+import os
+import zipfile
+import logging
+
+
+from app.services.capacity_service import CapacityExceeded, admission
+from app.services.pipeline_service import resolve_stages, run_pipeline
+from app.utils.file_utils import allowed_file, validate_image
+from config.config import BATCH_WORKERS, MAX_CONTENT_LENGTH
+
+logger = logging.getLogger(__name__)
+
+
+def analyze_image_bytes(image_bytes, analyses):
+    """
+    Run the requested analyses on one image
+    Args:
+        image_bytes (bytes): Encoded image
+        analyses (list): Names from PIPELINE_STAGES
+    Returns:
+        dict: Result of every analysis that was run
+    """
+    header = validate_image(io.BytesIO(image_bytes))
+    if not header:
+        raise ValueError("Invalid image file")
+
+    image = header.image
+    results, errors = run_pipeline(analyses, image=image)
+    if errors:
+        raise ValueError('; '.join(f"{name}: {error}" for name, error in errors.items()))
+    return results
+
+
+def _analyze_admitted(image_bytes, analyses, priority_class):
+    """
+    Run analyze_image_bytes under its own admission state, so its deadline
+    counts from when the image starts and a shed fails only this image
+    Raises:
+        CapacityExceeded: If any resource shed the image
+    """
+    with admission(priority_class) as state:
+        results = analyze_image_bytes(image_bytes, analyses)
+    if state.shed is not None:
+        raise state.shed
+    return results
+
+
+def list_zip_images(archive):
+    """
+    List the image members of a zip archive from its central directory,
+    without inflating any of them
+    Args:
+        archive: Binary, seekable file object of the zip archive
+    Returns:
+        list: zipfile.ZipInfo of every image member
+    Raises:
+        zipfile.BadZipFile: If the archive is not a valid zip file
+    """
+    with zipfile.ZipFile(archive) as zf:
+        return [info for info in zf.infolist() if not info.is_dir() and allowed_file(info.filename)]
+
+
+def iter_zip_images(archive, members):
+    """
+    Lazily yield (filename, bytes) for image members of a zip archive
+    Args:
+        archive: Binary, seekable file object of the zip archive
+        members (list): Members from list_zip_images, already checked against the batch limit
+    """
+    with zipfile.ZipFile(archive) as zf:
+        for info in members:
+            # Reject oversized members before inflating them
+            if info.file_size > MAX_CONTENT_LENGTH:
+                yield os.path.basename(info.filename), None
+                continue
+            yield os.path.basename(info.filename), zf.read(info)
+
+
+def iter_batch_results(images, analyses, max_workers=BATCH_WORKERS, priority_class='batch'):
+    """
+    Process images through a bounded worker pool, yielding results as they finish.
+    At most 2 * max_workers images are held in memory at once.
+    Args:
+        images: Iterable of (filename, bytes or None) pairs
+        analyses (list): Requested analyses
+        max_workers (int): Number of images processed concurrently
+        priority_class (str): Key of PRIORITY_CLASSES each image is admitted under
+    Yields:
+        dict: One result per image, in completion order
+    """
+    resolve_stages(analyses)
+    images = enumerate(images)
+    in_flight = {}
+
+    def result_for(index, filename, results=None, error=None, code=None):
+        result = {'index': index, 'filename': filename, 'success': error is None}
+        if error is None:
+            result['data'] = {name: value for name, value in results.items() if name in analyses}
+        else:
+            result['error'] = error
+            result['code'] = code
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep the pool fed without reading the whole batch up front
+            while not exhausted and len(in_flight) < max_workers * 2:
+                try:
+                    index, (filename, image_bytes) = next(images)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if image_bytes is None:
+                    yield result_for(index, filename, error='Image exceeds the maximum file size', code='FILE_TOO_LARGE')
+                    continue
+                future = pool.submit(contextvars.copy_context().run, _analyze_admitted, image_bytes, analyses,
+                                     priority_class)
+                in_flight[future] = (index, filename)
+
+            if not in_flight:
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, filename = in_flight.pop(future)
+                try:
+                    yield result_for(index, filename, results=future.result())
+                except CapacityExceeded as e:
+                    yield result_for(index, filename, error=str(e), code='CAPACITY_EXCEEDED')
+                except Exception as e:
+                    logger.error(f"Error processing batch image {filename}: {str(e)}")
+                    yield result_for(index, filename, error=str(e), code='PROCESSING_ERROR')
@@ -0,0 +1,283 @@
+"""
+Admission control for BLIP and OpenAI capacity.
+
+Each scarce resource (the BLIP model, each OpenAI model) has a fixed number
+of concurrency slots and a bounded wait queue ordered by priority class.
+A request that cannot be served before its deadline, or that finds the
+queue full of equal or higher priority work, is shed immediately, so the
+client gets a fast 503 with Retry-After instead of a timeout.
+"""
+from contextlib import contextmanager
+import contextvars
+import functools
+import heapq
+import itertools
+import math
+import threading
+import time
+import logging
+
+from flask import request, jsonify, make_response
+
+from app.utils.tracing import span
+
+from config.config import (
+    CAPACITY_SLOTS,
+    CAPACITY_QUEUE_SIZE,
+    PRIORITY_CLASSES,
+    PRIORITY_DEADLINES,
+    DEFAULT_PRIORITY_CLASS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CapacityExceeded(Exception):
+    """
+    Raised when a request is shed instead of waiting for a resource.
+    Args:
+        resource (str): Name of the saturated resource
+        reason (str): 'queue_full', 'deadline', 'timeout' or 'preempted'
+        retry_after (int): Seconds after which a retry is likely to be admitted
+    """
+
+    def __init__(self, resource, reason, retry_after=1):
+        super().__init__(f"{resource} is at capacity ({reason})")
+        self.resource = resource
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued request; granted or evicted by other threads under the limiter's lock"""
+
+    def __init__(self):
+        self.granted = False
+        self.evicted = False
+
+
+class ResourceLimiter:
+    """
+    Concurrency slots for one resource, with a bounded priority wait queue.
+    Args:
+        name (str): Resource name
+        slots (int): Requests served concurrently
+        max_queue (int): Requests allowed to wait for a slot
+    """
+
+    def __init__(self, name, slots, max_queue):
+        self.name = name
+        self.slots = slots
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._waiters = []  # heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._avg_hold = None  # Smoothed seconds a slot is held
+        self._avg_wait = 0.0
+        self.admitted = 0
+        self.shed = {'queue_full': 0, 'deadline': 0, 'timeout': 0, 'preempted': 0}
+
+    def _estimated_wait(self, position):
+        """Seconds until the request at a queue position gets a slot"""
+        if self._avg_hold is None:
+            return 0.0
+        return math.ceil(position / self.slots) * self._avg_hold
+
+    def _shed(self, reason, position):
+        self.shed[reason] += 1
+        retry_after = max(1, math.ceil(self._estimated_wait(position)))
+        logger.warning(f"Shedding {self.name} request: {reason}, {len(self._waiters)} queued")
+        return CapacityExceeded(self.name, reason, retry_after)
+
+    def _record_wait(self, started):
+        self.admitted += 1
+        self._avg_wait = 0.9 * self._avg_wait + 0.1 * (time.monotonic() - started)
+
+    def acquire(self, priority, deadline=None):
+        """
+        Wait for a slot
+        Args:
+            priority (int): Lower values are served first
+            deadline (float): time.monotonic() by which the slot must be granted, or None
+        Raises:
+            CapacityExceeded: If the request is shed
+        """
+        started = time.monotonic()
+        with self._cond:
+            if self._in_use < self.slots and not self._waiters:
+                self._in_use += 1
+                self._record_wait(started)
+                return
+
+            position = len(self._waiters) + 1
+            if deadline is not None and started + self._estimated_wait(position) > deadline:
+                raise self._shed('deadline', position)
+
+            if len(self._waiters) >= self.max_queue:
+                worst = max(self._waiters)
+                if priority >= worst[0]:
+                    raise self._shed('queue_full', position)
+                # Make room by shedding the lowest priority, most recent waiter
+                self._waiters.remove(worst)
+                heapq.heapify(self._waiters)
+                worst[2].evicted = True
+                self._cond.notify_all()
+
+            waiter = _Waiter()
+            entry = (priority, next(self._sequence), waiter)
+            heapq.heappush(self._waiters, entry)
+
+            while not waiter.granted:
+                if waiter.evicted:
+                    raise self._shed('preempted', len(self._waiters))
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    raise self._shed('timeout', len(self._waiters))
+                self._cond.wait(remaining)
+
+            self._record_wait(started)
+
+    def release(self, held_seconds):
+        """Free a slot, handing it to the highest priority waiter"""
+        with self._cond:
+            self._avg_hold = held_seconds if self._avg_hold is None else 0.8 * self._avg_hold + 0.2 * held_seconds
+            if self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                waiter.granted = True
+                self._cond.notify_all()
+            else:
+                self._in_use -= 1
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'in_use': self._in_use,
+                'queue_depth': len(self._waiters),
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'avg_wait_ms': round(self._avg_wait * 1000, 1),
+                'avg_hold_ms': round(self._avg_hold * 1000, 1) if self._avg_hold is not None else None
+            }
+
+
+class AdmissionState:
+    """
+    Priority and deadline of the work running in the current context.
+    A shed anywhere in the request is recorded here, so the request can be
+    answered with 503 and later calls in it fail fast instead of queueing.
+    One state covers one request or pipeline run; work that must survive a
+    shed of its siblings (each image of a batch) gets its own state.
+    """
+
+    def __init__(self, priority_class):
+        self.priority_class = priority_class
+        self.priority = PRIORITY_CLASSES[priority_class]
+        timeout = PRIORITY_DEADLINES.get(priority_class)
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.shed = None
+
+
+# Copied into pipeline and batch threads with contextvars.copy_context()
+_admission = contextvars.ContextVar('admission', default=None)
+
+
+class CapacityManager:
+    """
+    Resource limiters shared by every request in the process.
+    Args:
+        slots (dict): Resource name -> concurrency slots
+        queue_sizes (dict): Resource name -> wait queue size
+    """
+
+    def __init__(self, slots=CAPACITY_SLOTS, queue_sizes=CAPACITY_QUEUE_SIZE):
+        self._limiters = {
+            name: ResourceLimiter(name, count, queue_sizes.get(name, count * 4))
+            for name, count in slots.items()
+        }
+
+    @contextmanager
+    def slot(self, resource):
+        """
+        Hold a slot of a resource for the duration of the block.
+        Resources without a configured limit are not limited.
+        Raises:
+            CapacityExceeded: If the request is shed
+        """
+        limiter = self._limiters.get(resource)
+        if limiter is None:
+            yield
+            return
+
+        state = _admission.get() or AdmissionState(DEFAULT_PRIORITY_CLASS)
+        if state.shed is not None:
+            raise state.shed
+        try:
+            with span('capacity.wait', resource=resource, priority_class=state.priority_class):
+                limiter.acquire(state.priority, state.deadline)
+        except CapacityExceeded as e:
+            state.shed = e
+            raise
+
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            limiter.release(time.monotonic() - acquired)
+
+    def metrics(self):
+        """Slots, queue depth and shed counts of every resource"""
+        return {name: limiter.metrics() for name, limiter in self._limiters.items()}
+
+# Create singleton instance
+capacity_manager = CapacityManager()
+
+
+@contextmanager
+def admission(priority_class):
+    """
+    Run a block of work under a priority class from PRIORITY_CLASSES
+    Yields:
+        AdmissionState: State of the block; .shed is set if it was shed
+    """
+    state = AdmissionState(priority_class)
+    token = _admission.set(state)
+    try:
+        yield state
+    finally:
+        _admission.reset(token)
+
+
+def admission_class(priority_class):
+    """
+    Decorator running a route's POST requests under a priority class.
+    Services swallow errors into their own responses, so if any resource
+    shed the request, the view's response is replaced with 503 + Retry-After.
+    Args:
+        priority_class (str): Key of PRIORITY_CLASSES
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+
+            with admission(priority_class) as state:
+                response = make_response(view(*args, **kwargs))
+            if state.shed is None:
+                return response
+
+            response = jsonify({
+                'success': False,
+                'error': 'The server is at capacity. Please retry shortly.',
+                'code': 'CAPACITY_EXCEEDED'
+            })
+            response.status_code = 503
+            response.headers['Retry-After'] = str(state.shed.retry_after)
+            return response
+        return wrapper
+    return decorator
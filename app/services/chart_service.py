@@ -0,0 +1,117 @@
+"""
+On-demand chart rendering for color analysis results.
+
+Charts are rendered lazily, only when a client requests them, using the
+object-oriented matplotlib Figure API so that no pyplot global state is shared
+between request threads. Rendered output is cached per image hash.
+"""
+import io
+import logging
+
+from matplotlib.figure import Figure
+
+from app.utils.cache_utils import LRUCache
+from config.config import CHART_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+CHART_TYPES = ('histogram', 'dominant-colors')
+CHART_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+# Color analysis results, keyed by image hash
+_color_data_store = LRUCache(CHART_CACHE_SIZE)
+# Rendered chart bytes, keyed by (image hash, chart, format)
+_chart_cache = LRUCache(CHART_CACHE_SIZE * len(CHART_TYPES) * len(CHART_FORMATS))
+
+
+def store_color_data(image_hash, color_data):
+    """
+    Register color analysis results so their charts can be rendered later.
+    Args:
+        image_hash (str): Content hash of the analyzed image
+        color_data (dict): Color data returned by AdvancedImageProcessor.analyze_colors
+    """
+    _color_data_store.set(image_hash, color_data)
+
+
+def chart_etag(image_hash, chart, fmt):
+    """Build the strong ETag for a rendered chart"""
+    return f"{image_hash}-{chart}-{fmt}"
+
+
+def _render_histogram(color_data):
+    """Build the RGB histogram figure"""
+    fig = Figure(figsize=(8, 4))
+    ax = fig.add_subplot()
+    histogram = color_data['histogram']
+    edges = histogram['bin_edges']
+    centers = [(low + high) / 2 for low, high in zip(edges[:-1], edges[1:])]
+    for channel, color in (('r', 'red'), ('g', 'green'), ('b', 'blue')):
+        ax.plot(centers, histogram['rgb'][channel], color=color, marker='o', label=channel.upper())
+    ax.set_xlabel('Intensity')
+    ax.set_ylabel('Fraction of pixels')
+    ax.set_title('Color Distribution')
+    ax.legend()
+    ax.grid(True)
+    return fig
+
+
+def _render_dominant_colors(color_data):
+    """Build the dominant colors pie chart"""
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot()
+    colors = [[channel / 255.0 for channel in color] for color in color_data['dominant_colors']]
+    _, _, autotexts = ax.pie(color_data['percentages'],
+                             colors=colors,
+                             autopct='%1.1f%%',
+                             labels=[named['name'] for named in color_data['color_names']])
+    ax.set_title('Dominant Colors')
+
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontsize(8)
+    return fig
+
+
+_RENDERERS = {
+    'histogram': _render_histogram,
+    'dominant-colors': _render_dominant_colors
+}
+
+
+def render_chart(image_hash, chart, fmt):
+    """
+    Render a color analysis chart, reusing cached output when available.
+    Args:
+        image_hash (str): Content hash of the analyzed image
+        chart (str): One of CHART_TYPES
+        fmt (str): One of the CHART_FORMATS keys
+    Returns:
+        bytes: Encoded chart, or None if no color data is known for image_hash
+    """
+    if chart not in _RENDERERS or fmt not in CHART_FORMATS:
+        raise ValueError(f"Unsupported chart '{chart}.{fmt}'")
+
+    cache_key = (image_hash, chart, fmt)
+    cached = _chart_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    color_data = _color_data_store.get(image_hash)
+    if color_data is None:
+        return None
+
+    try:
+        fig = _RENDERERS[chart](color_data)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, bbox_inches='tight')
+        output = buffer.getvalue()
+    except Exception as e:
+        logger.error(f"Error rendering chart {chart}.{fmt}: {str(e)}")
+        raise ValueError(f"Error rendering chart: {str(e)}")
+
+    _chart_cache.set(cache_key, output)
+    return output
@@ -0,0 +1,42 @@
+import numpy as np
+from matplotlib.colors import CSS4_COLORS, to_rgb
+from sklearn.neighbors import KDTree
+
+
+class NamedColorIndex:
+    """
+    Nearest named color lookup over the CSS4 color table.
+    The KD-tree is built once, when the module is first imported.
+    """
+
+    def __init__(self, named_colors=None):
+        named_colors = named_colors if named_colors is not None else CSS4_COLORS
+        self.names = sorted(named_colors)
+        self.hex_values = [named_colors[name].lower() for name in self.names]
+        self.rgb_values = np.array([to_rgb(value) for value in self.hex_values]) * 255.0
+        self.tree = KDTree(self.rgb_values)
+
+    def nearest(self, colors):
+        """
+        Map RGB colors to their nearest named colors
+        Args:
+            colors (array-like): Array of shape (n, 3) with RGB values in 0-255
+        Returns:
+            list: One dict per color with the name, hex value and RGB distance
+        """
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+        if len(colors) == 0:
+            return []
+
+        distances, indices = self.tree.query(colors, k=1)
+        return [
+            {
+                'name': self.names[index],
+                'hex': self.hex_values[index],
+                'distance': round(float(distance), 2)
+            }
+            for distance, index in zip(distances[:, 0], indices[:, 0])
+        ]
+
+# Create singleton instance
+named_color_index = NamedColorIndex()
@@ -0,0 +1,205 @@
+"""
+Remote image fetching for URL inputs.
+
+Downloads go through one pooled session with connect/read timeouts and are
+streamed with a byte cap. The URL and every redirect target must resolve to
+public addresses (or be listed in REMOTE_FETCH_ALLOWED_HOSTS), so URL inputs
+cannot reach internal services. Responses that are not images are rejected from
+their headers or first bytes, before the body is read. URLs are remembered
+with their ETag/Last-Modified validators so repeat requests are revalidated
+with a conditional GET, and analysis results are cached per URL and content
+hash so an unchanged image is not processed again.
+"""
+from collections import namedtuple
+import hashlib
+import logging
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.utils.cache_utils import LRUCache
+from app.utils.file_utils import sniff_image_format, SNIFF_BYTES
+from app.utils.url_utils import check_public_url
+from config.config import (
+    REMOTE_FETCH_ALLOWED_HOSTS,
+    REMOTE_FETCH_MAX_REDIRECTS,
+    REMOTE_FETCH_CONNECT_TIMEOUT,
+    REMOTE_FETCH_READ_TIMEOUT,
+    REMOTE_FETCH_MAX_BYTES,
+    REMOTE_FETCH_POOL_SIZE,
+    REMOTE_FETCH_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Content types that may still carry an image; the magic bytes decide
+GENERIC_CONTENT_TYPES = {'application/octet-stream', 'binary/octet-stream', ''}
+
+FetchedImage = namedtuple('FetchedImage', ['content', 'content_hash', 'format', 'not_modified'])
+
+
+class FetchError(Exception):
+    """
+    Raised when a remote image cannot be used.
+    Args:
+        message (str): Description of the problem
+        code (str): Error code returned to the client
+    """
+
+    def __init__(self, message, code='URL_DOWNLOAD_ERROR'):
+        super().__init__(message)
+        self.code = code
+
+
+class RemoteImageFetcher:
+    """
+    Bounded, pooled and revalidating image downloader.
+    Args:
+        max_bytes (int): Largest accepted response body
+        connect_timeout (float): Seconds to establish a connection
+        read_timeout (float): Seconds to wait between received bytes
+        pool_size (int): Keep-alive connections kept per host
+        cache_size (int): URLs whose validators are remembered
+        allowed_hosts (set): Hosts that may be fetched even on non-public addresses
+        max_redirects (int): Redirects followed per download
+    """
+
+    def __init__(self, max_bytes=REMOTE_FETCH_MAX_BYTES, connect_timeout=REMOTE_FETCH_CONNECT_TIMEOUT,
+                 read_timeout=REMOTE_FETCH_READ_TIMEOUT, pool_size=REMOTE_FETCH_POOL_SIZE,
+                 cache_size=REMOTE_FETCH_CACHE_SIZE, allowed_hosts=REMOTE_FETCH_ALLOWED_HOSTS,
+                 max_redirects=REMOTE_FETCH_MAX_REDIRECTS):
+        self.max_bytes = max_bytes
+        self.allowed_hosts = allowed_hosts
+        self.max_redirects = max_redirects
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # url -> (etag, last_modified, content_hash, format)
+        self._validators = LRUCache(cache_size)
+
+    def fetch(self, url, revalidate=True):
+        """
+        Download an image
+        Args:
+            url (str): http(s) URL of the image
+            revalidate (bool): Send a conditional request if the URL was fetched before
+        Returns:
+            FetchedImage: Content and its SHA-256 hash; on a 304 the content is
+                None and the hash is the one recorded for the previous download
+        Raises:
+            FetchError: If the URL is invalid, unreachable, too large or not an image
+        """
+        if not url.startswith(('http://', 'https://')):
+            raise FetchError('Image URL must start with http:// or https://', 'INVALID_URL')
+        self._check_url(url)
+
+        headers = {'Accept': 'image/*'}
+        cached = self._validators.get(url) if revalidate else None
+        if cached:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        try:
+            with self._get(url, headers) as response:
+                if response.status_code == 304 and cached:
+                    return FetchedImage(None, cached[2], cached[3], True)
+                if response.status_code != 200:
+                    raise FetchError(f'Failed to download image from URL (HTTP {response.status_code})')
+
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if not content_type.startswith('image/') and content_type not in GENERIC_CONTENT_TYPES:
+                    raise FetchError(f'URL does not point to an image ({content_type})', 'URL_NOT_IMAGE')
+
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                    raise FetchError('Remote image exceeds the maximum file size', 'URL_TOO_LARGE')
+
+                content, format = self._read_body(response)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except requests.Timeout:
+            raise FetchError('Timed out downloading image from URL', 'URL_TIMEOUT')
+        except requests.RequestException as e:
+            raise FetchError(f'Failed to download image from URL: {str(e)}')
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        if etag or last_modified:
+            self._validators.set(url, (etag, last_modified, content_hash, format))
+        else:
+            self._validators.pop(url)
+        return FetchedImage(content, content_hash, format, False)
+
+    def _check_url(self, url):
+        """Raise FetchError URL_NOT_ALLOWED unless url may be requested"""
+        try:
+            check_public_url(url, self.allowed_hosts, 'Image URL')
+        except ValueError as e:
+            raise FetchError(str(e), 'URL_NOT_ALLOWED')
+
+    def _get(self, url, headers):
+        """Send the GET, following redirects only to allowed URLs"""
+        for _ in range(self.max_redirects + 1):
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True,
+                                        allow_redirects=False)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers['Location'])
+            self._check_url(url)
+        raise FetchError(f'Image URL redirected more than {self.max_redirects} times', 'URL_TOO_MANY_REDIRECTS')
+
+    def _read_body(self, response):
+        """Stream the body, checking the magic bytes first and enforcing the byte cap"""
+        body = bytearray()
+        format = None
+        for chunk in response.iter_content(CHUNK_SIZE):
+            body.extend(chunk)
+            if len(body) > self.max_bytes:
+                raise FetchError('Remote image exceeds the maximum file size', 'URL_TOO_LARGE')
+            if format is None and len(body) >= SNIFF_BYTES:
+                format = sniff_image_format(bytes(body[:SNIFF_BYTES]))
+                if format is None:
+                    raise FetchError('URL does not point to a supported image', 'URL_NOT_IMAGE')
+
+        if format is None:
+            format = sniff_image_format(bytes(body))
+            if format is None:
+                raise FetchError('URL does not point to a supported image', 'URL_NOT_IMAGE')
+        return bytes(body), format
+
+
+class UrlResultCache:
+    """
+    Analysis results keyed by URL and tagged with the content hash they were computed from.
+    Args:
+        max_size (int): URLs whose results are kept
+    """
+
+    def __init__(self, max_size=REMOTE_FETCH_CACHE_SIZE):
+        self._cache = LRUCache(max_size)
+
+    def get(self, url, content_hash):
+        """Return the results for url if they were computed from content_hash"""
+        entry = self._cache.get(url)
+        if entry is None or entry[0] != content_hash:
+            return None
+        return entry[1]
+
+    def has(self, url):
+        """Whether results are stored for url, whatever content they came from"""
+        return url in self._cache
+
+    def set(self, url, content_hash, results):
+        self._cache.set(url, (content_hash, results))
+
+# Create singleton instances
+remote_image_fetcher = RemoteImageFetcher()
+url_result_cache = UrlResultCache()
@@ -0,0 +1,235 @@
+"""
+Local hashtag recommendations from an inverted index of past outputs.
+
+The hashtags of every LLM social media caption are recorded as (context
+terms, hashtags). The index maps each term to the hashtags that appeared
+with it; a new context is scored by how often each hashtag co-occurred with
+its terms, weighted by how specific the terms are (IDF). When a caption
+comes back without hashtags (or fails), and enough of the context is
+covered and the best hashtags are well supported, the recommendation is
+used instead of falling back to words of the context.
+
+Pairs are appended to HASHTAG_LOG_PATH and replayed on startup, so the
+index survives restarts; worker processes each index their own new pairs
+until the next restart.
+"""
+from collections import Counter, deque
+import json
+import math
+import os
+import re
+import threading
+import logging
+
+from config.config import (
+    HASHTAG_LOG_PATH,
+    HASHTAG_INDEX_MAX_DOCS,
+    HASHTAG_MIN_DOCS,
+    HASHTAG_COUNT
+)
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset("""
+about above after again against all also among and any are around because been before being below between both
+but can could did does doing down during each few for from further had has have having here how into its itself
+just more most much near off once only other over own same should some such than that the their theirs them
+then there these they this those through too under until very was were what when where which while who whom
+why will with would you your image picture photo shows showing features featuring appears seems
+""".split())
+
+# Terms in more than this share of the examples say little about any hashtag and
+# have the longest posting lists, so they are left out of scoring; terms in
+# fewer than COMMON_TERM_MIN_DOCS examples are always kept
+COMMON_TERM_SHARE = 0.1
+COMMON_TERM_MIN_DOCS = 20
+
+_WORD = re.compile(r"[a-z][a-z0-9]+")
+_HASHTAG = re.compile(r"#(\w+)")
+
+
+def context_terms(text):
+    """
+    Index terms of a context: lowercase words of 3+ letters without stopwords or plural s
+    Args:
+        text (str): Context or caption
+    Returns:
+        set: Distinct terms
+    """
+    terms = set()
+    for word in _WORD.findall(text.lower()):
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.add(word)
+    return terms
+
+
+def extract_hashtags(text):
+    """
+    Hashtags in a text, normalized to lowercase and de-duplicated in order
+    Args:
+        text (str): Caption or other LLM output
+    Returns:
+        list: Hashtags including the leading '#'
+    """
+    return list(dict.fromkeys(f'#{tag.lower()}' for tag in _HASHTAG.findall(text)))
+
+
+class HashtagIndex:
+    """
+    Inverted index from context terms to co-occurring hashtags.
+    Args:
+        max_docs (int): Most recent (context, hashtags) pairs kept; older ones are forgotten
+        log_path (str): JSON lines file pairs are appended to and replayed from; None keeps the index in memory
+    """
+
+    def __init__(self, max_docs=HASHTAG_INDEX_MAX_DOCS, log_path=HASHTAG_LOG_PATH):
+        self.max_docs = max_docs
+        self.log_path = os.path.abspath(log_path) if log_path else None
+        self._docs = deque()  # (terms, hashtags) in arrival order
+        self._postings = {}  # term -> Counter of hashtags
+        self._document_frequency = Counter()  # term -> pairs containing it
+        self._lock = threading.Lock()
+        if self.log_path:
+            self._replay()
+
+    def _add(self, terms, hashtags):
+        self._docs.append((terms, hashtags))
+        for term in terms:
+            self._document_frequency[term] += 1
+            self._postings.setdefault(term, Counter()).update(hashtags)
+        while len(self._docs) > self.max_docs:
+            self._remove(*self._docs.popleft())
+
+    def _remove(self, terms, hashtags):
+        for term in terms:
+            self._document_frequency[term] -= 1
+            if self._document_frequency[term] <= 0:
+                del self._document_frequency[term]
+                del self._postings[term]
+                continue
+            postings = self._postings[term]
+            postings.subtract(hashtags)
+            for hashtag in hashtags:
+                if postings[hashtag] <= 0:
+                    del postings[hashtag]
+
+    def _replay(self):
+        """Index the most recent pairs of the log, compacting it if it has grown past twice max_docs"""
+        try:
+            with open(self.log_path, encoding='utf-8') as f:
+                lines = deque(f, maxlen=2 * self.max_docs)
+        except FileNotFoundError:
+            return
+
+        loaded = 0
+        for line in list(lines)[-self.max_docs:]:
+            try:
+                entry = json.loads(line)
+                self._add(frozenset(entry['terms']), tuple(entry['hashtags']))
+                loaded += 1
+            except (ValueError, KeyError, TypeError):
+                continue
+        logger.info(f"Loaded {loaded} hashtag examples from {self.log_path}")
+
+        if len(lines) > self.max_docs:
+            try:
+                with open(self.log_path + '.tmp', 'w', encoding='utf-8') as f:
+                    f.writelines(list(lines)[-self.max_docs:])
+                os.replace(self.log_path + '.tmp', self.log_path)
+            except OSError as e:
+                logger.error(f"Error compacting hashtag log: {str(e)}")
+
+    def learn(self, context, hashtags):
+        """
+        Record the hashtags an LLM chose for a context
+        Args:
+            context (str): Context the hashtags were generated from
+            hashtags (list): Hashtags including the leading '#'
+        """
+        terms = frozenset(context_terms(context))
+        hashtags = tuple(dict.fromkeys(tag.lower() for tag in hashtags))
+        if not terms or not hashtags:
+            return
+        with self._lock:
+            self._add(terms, hashtags)
+
+        if self.log_path:
+            line = json.dumps({'terms': sorted(terms), 'hashtags': list(hashtags)}) + '\n'
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                # One append per line, so several workers can share the log
+                fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line.encode('utf-8'))
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error(f"Error recording hashtags: {str(e)}")
+
+    def recommend(self, context, count=HASHTAG_COUNT):
+        """
+        Score hashtags for a context by their co-occurrence with its terms
+        Args:
+            context (str): Context to tag
+            count (int): Hashtags returned
+        Returns:
+            tuple: (hashtags, confidence). Each hashtag's score is the
+                IDF-weighted average over the context's terms of the share of
+                that term's examples using the hashtag. Confidence is the mean
+                score of the returned hashtags times the share of the
+                context's IDF weight the index has seen, 0 to 1. Terms in
+                more than COMMON_TERM_SHARE of the examples are ignored.
+        """
+        terms = context_terms(context)
+        with self._lock:
+            total_docs = len(self._docs)
+            if not terms or not total_docs:
+                return [], 0.0
+
+            scores = Counter()
+            known_weight = 0.0
+            total_weight = 0.0
+            common = max(COMMON_TERM_SHARE * total_docs, COMMON_TERM_MIN_DOCS)
+            for term in terms:
+                frequency = self._document_frequency.get(term, 0)
+                if frequency > common:
+                    continue
+                # Unseen terms count as maximally specific, so they lower coverage the most
+                weight = math.log(1 + total_docs / max(frequency, 1))
+                total_weight += weight
+                if not frequency:
+                    continue
+                known_weight += weight
+                for hashtag, together in self._postings[term].items():
+                    scores[hashtag] += weight * together / frequency
+
+        if not known_weight:
+            return [], 0.0
+        ranked = [(hashtag, score / known_weight) for hashtag, score in scores.most_common(count)]
+        confidence = sum(score for _, score in ranked) / len(ranked) * known_weight / total_weight
+        return [hashtag for hashtag, _ in ranked], confidence
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs)
+
+    @property
+    def ready(self):
+        """Whether enough examples are indexed for recommendations to be trusted"""
+        return len(self) >= HASHTAG_MIN_DOCS
+
+
+_hashtag_index = None
+_index_lock = threading.Lock()
+
+
+def get_hashtag_index():
+    """Return the process-wide hashtag index, replaying the log on first use"""
+    global _hashtag_index
+    with _index_lock:
+        if _hashtag_index is None:
+            _hashtag_index = HashtagIndex()
+        return _hashtag_index
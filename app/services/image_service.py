@@ -1,14 +1,22 @@
-from PIL import Image, ImageEnhance
+from PIL import Image, ImageEnhance, ImageStat
 import numpy as np
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import torch
 from config.config import BLIP_MODEL
+from app.services.capacity_service import capacity_manager
+from app.services.keyframe_service import is_multiframe, select_keyframes, merge_captions
+from app.utils.profiling import torch_profile
+from app.utils.tracing import span, traced
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ImageProcessor:
     def __init__(self):
         self.processor = BlipProcessor.from_pretrained(BLIP_MODEL)
         self.model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL)
         
+    @traced('preprocess_image')
     def preprocess_image(self, image):
         """
         Preprocess image for better analysis
@@ -42,12 +50,11 @@ class ImageProcessor:
             dict: Quality metrics
         """
         try:
-            # Convert image to numpy array
-            img_array = np.array(image)
-            
-            # Calculate basic metrics
-            brightness = np.mean(img_array)
-            contrast = np.std(img_array)
+            # Calculate basic metrics over all bands from the histogram, without copying the pixels
+            stat = ImageStat.Stat(image)
+            count = sum(stat.count)
+            brightness = sum(stat.sum) / count
+            contrast = np.sqrt(max(sum(stat.sum2) / count - brightness ** 2, 0))
             resolution = image.size
             
             # Define quality thresholds
@@ -82,30 +89,59 @@ class ImageProcessor:
 
     def generate_alt_text(self, image):
         """
-        Generate alt text for an image using BLIP model
+        Generate alt text for an image using BLIP model.
+        Animated GIFs and multi-page TIFFs are described by their keyframes.
         Args:
             image (PIL.Image): Input image
         Returns:
             str: Generated alt text
         """
         try:
+            if is_multiframe(image):
+                keyframes = select_keyframes(image)
+                return merge_captions(self._caption([keyframe.image for keyframe in keyframes]))
+
+            return self._caption([image])[0]
+            
+        except Exception as e:
+            return f"Error generating alt text: {str(e)}"
+
+    def generate_alt_text_batch(self, images):
+        """
+        Generate alt text for several images with one model call
+        Args:
+            images (list): PIL.Image inputs
+        Returns:
+            list: Alt text of each image, in order
+        """
+        try:
+            return self._caption(images)
+        except Exception as e:
+            return [f"Error generating alt text: {str(e)}"] * len(images)
+
+    def _caption(self, images):
+        """Preprocess images and caption them as one batch, holding one BLIP slot"""
+        processed_images = []
+        for image in images:
             # Preprocess image
             processed_image = self.preprocess_image(image)
             
             # Check image quality
             quality_metrics = self.validate_image_quality(processed_image)
             if not quality_metrics['is_valid']:
-                print(f"Warning: Image quality issues detected: {quality_metrics['issues']}")
-            
-            # Generate alt text using BLIP
-            inputs = self.processor(processed_image, return_tensors="pt")
-            out = self.model.generate(**inputs)
-            alt_text = self.processor.decode(out[0], skip_special_tokens=True)
-            
-            return alt_text
-            
-        except Exception as e:
-            return f"Error generating alt text: {str(e)}"
+                logger.warning(f"Image quality issues detected: {quality_metrics['issues']}")
+            processed_images.append(processed_image)
+        
+        # Generate alt text using BLIP
+        inputs = self.processor(processed_images, return_tensors="pt")
+        with span('blip.generate', **{'blip.batch_size': len(processed_images)}) as generate:
+            with capacity_manager.slot('blip'), torch_profile('blip_generate', {
+                'blip_encoder': self.model.vision_model,
+                'blip_decoder': self.model.text_decoder
+            }):
+                out = self.model.generate(**inputs)
+            generate.set_attribute('blip.output_tokens', int(out.shape[-1]))
+        return self.processor.batch_decode(out, skip_special_tokens=True)
 
 # Create singleton instance
 image_processor = ImageProcessor() 
\ No newline at end of file
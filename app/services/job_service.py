@@ -0,0 +1,439 @@
+"""
+Durable asynchronous job queue for long-running analyses.
+
+Jobs are stored in SQLite, so queued work survives a process restart. Local
+worker threads claim jobs with a visibility timeout: a job whose worker died
+becomes visible again once the timeout expires. A claim is a lease on one
+attempt: a worker whose lease expired cannot record a result or failure
+over the attempt that reclaimed the job. Failed jobs are retried with
+exponential backoff up to a maximum number of attempts, and clients either
+poll the job status or register a callback URL, which must resolve to a
+public address (or be listed in JOB_CALLBACK_ALLOWED_HOSTS). Finished jobs
+are deleted JOB_RETENTION_SECONDS after they finish.
+"""
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+import requests
+
+from app.services.image_service import image_processor
+from app.services.text_service import generate_context, analyze_medical_image
+from app.services.seo_service import generate_seo_description
+from app.services.medical_image_service import load_medical_study, describe_study
+from app.utils.file_utils import decode_image
+from app.utils.url_utils import check_public_url
+from config.config import (
+    JOB_DB_PATH,
+    JOB_WORKERS,
+    JOB_MAX_ATTEMPTS,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_POLL_INTERVAL,
+    JOB_CALLBACK_TIMEOUT,
+    JOB_CALLBACK_ALLOWED_HOSTS,
+    JOB_RETENTION_SECONDS,
+    JOB_SWEEP_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload BLOB,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    visible_at REAL NOT NULL,
+    result TEXT,
+    error TEXT,
+    callback_url TEXT,
+    callback_status TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, visible_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (status, updated_at);
+"""
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue with visibility timeouts and retries.
+    Args:
+        db_path (str): Path of the SQLite database
+        visibility_timeout (float): Seconds a claimed job stays invisible to other workers
+        max_attempts (int): Attempts before a job is marked as failed
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, visibility_timeout=JOB_VISIBILITY_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _open(self):
+        """Open a connection; one per operation keeps the queue safe across threads and processes"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def _connect(self):
+        """Connection in autocommit mode, closed on exit"""
+        conn = self._open()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind, payload, params=None, callback_url=None):
+        """
+        Queue a job
+        Args:
+            kind (str): Handler name, see JOB_HANDLERS
+            payload (bytes): Image content
+            params (dict): Extra handler parameters
+            callback_url (str): URL notified when the job finishes
+        Returns:
+            str: Job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, params, status, max_attempts, visible_at,"
+                " callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, payload, json.dumps(params or {}), JOB_QUEUED, self.max_attempts,
+                 now, callback_url, now, now)
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Atomically claim the oldest visible job.
+        Running jobs whose visibility timeout expired are claimed again, or
+        marked as failed if that was their last attempt.
+        Returns:
+            sqlite3.Row: The claimed job, or None if no job is available. Its
+                attempts value is the lease to pass to complete() and fail()
+        """
+        now = time.time()
+        conn = self._open()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Jobs whose last attempt timed out without reporting back, all in one statement
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = COALESCE(error, 'Job timed out'), payload = NULL, updated_at = ?"
+                " WHERE status IN (?, ?) AND visible_at <= ? AND attempts >= max_attempts",
+                (JOB_FAILED, now, JOB_QUEUED, JOB_RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND visible_at <= ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, visible_at = ?, updated_at = ? WHERE id = ?",
+                (JOB_RUNNING, now + self.visibility_timeout, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id, result, attempt):
+        """
+        Mark a job as succeeded and drop its payload
+        Args:
+            attempt (int): attempts of the claimed job; the lease being completed
+        Returns:
+            bool: False if the lease expired and the job was reclaimed, in which case nothing is recorded
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, payload = NULL, updated_at = ?"
+                " WHERE id = ? AND attempts = ? AND status = ?",
+                (JOB_SUCCEEDED, json.dumps(result), time.time(), job_id, attempt, JOB_RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, error, attempt):
+        """
+        Record a failed attempt, re-queueing the job with exponential backoff
+        while attempts remain
+        Args:
+            attempt (int): attempts of the claimed job; the lease that failed
+        Returns:
+            str: JOB_QUEUED if the job will be retried, JOB_FAILED if not, or
+                None if the lease expired and the job was reclaimed
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT max_attempts FROM jobs WHERE id = ? AND attempts = ? AND status = ?",
+                (job_id, attempt, JOB_RUNNING)
+            ).fetchone()
+            if row is None:
+                return None
+            if attempt < row['max_attempts']:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, visible_at = ?, updated_at = ?"
+                    " WHERE id = ? AND attempts = ? AND status = ?",
+                    (JOB_QUEUED, error, now + 2 ** attempt, now, job_id, attempt, JOB_RUNNING)
+                )
+                return JOB_QUEUED if cursor.rowcount == 1 else None
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, payload = NULL, updated_at = ?"
+                " WHERE id = ? AND attempts = ? AND status = ?",
+                (JOB_FAILED, error, now, job_id, attempt, JOB_RUNNING)
+            )
+            return JOB_FAILED if cursor.rowcount == 1 else None
+
+    def set_callback_status(self, job_id, callback_status):
+        """Record the outcome of the completion callback"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+
+    def get(self, job_id):
+        """
+        Return the public state of a job
+        Returns:
+            dict: Job status, attempts, result and error, or None if unknown
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, attempts, max_attempts, result, error, callback_status,"
+                " created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def purge(self, retention=JOB_RETENTION_SECONDS):
+        """
+        Delete succeeded and failed jobs that finished more than retention seconds ago
+        Args:
+            retention (float): Seconds finished jobs are kept for polling
+        Returns:
+            int: Number of jobs deleted
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_SUCCEEDED, JOB_FAILED, time.time() - retention)
+            )
+            return cursor.rowcount
+
+    def counts(self):
+        """Number of jobs in each status"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+
+def check_callback_url(callback_url):
+    """
+    Reject callback URLs the server must not POST to: see check_public_url.
+    Hosts in JOB_CALLBACK_ALLOWED_HOSTS are allowed on any address.
+    Args:
+        callback_url (str): URL given with the job
+    Raises:
+        ValueError: If the URL is not http(s) or its host is not allowed
+    """
+    check_public_url(callback_url, JOB_CALLBACK_ALLOWED_HOSTS, 'callback_url')
+
+
+def _unwrap(response):
+    """Return the data of a service response, raising on failure so the job is retried"""
+    if not response['success']:
+        raise ValueError(response['error'])
+    return response['data']
+
+
+def _generate_alt_text(payload):
+    """Decode the job payload and caption it"""
+    # Left unconverted so multi-frame images keep their frames
+    image = decode_image(io.BytesIO(payload))
+    alt_text = image_processor.generate_alt_text(image)
+    if alt_text.startswith('Error generating alt text'):
+        raise ValueError(alt_text)
+    return image, alt_text
+
+
+def run_medical_job(payload, params):
+    """Job handler mirroring the /medical-image-analysis route"""
+    study = load_medical_study(io.BytesIO(payload))
+    alt_text, description, frame_captions = describe_study(study)
+    data = _unwrap(analyze_medical_image(study.frames[0][1], description))
+    return dict(data, alt_text=alt_text, frames=frame_captions, study=study.info)
+
+
+def run_seo_job(payload, params):
+    """Job handler mirroring the /seo route"""
+    _, alt_text = _generate_alt_text(payload)
+    context = _unwrap(generate_context(alt_text))['context']
+    data = _unwrap(generate_seo_description(context, alt_text))
+    return dict(data, alt_text=alt_text, context=context)
+
+
+JOB_HANDLERS = {
+    'medical': run_medical_job,
+    'seo': run_seo_job
+}
+
+
+class JobWorkerPool:
+    """
+    Local worker threads that process jobs from a JobQueue.
+    Args:
+        queue (JobQueue): Queue to consume
+        handlers (dict): Job kind -> handler(payload, params)
+        workers (int): Number of worker threads
+    """
+
+    def __init__(self, queue, handlers=JOB_HANDLERS, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL,
+                 retention=JOB_RETENTION_SECONDS, sweep_interval=JOB_SWEEP_INTERVAL):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.retention > 0:
+            thread = threading.Thread(target=self._sweep, name='job-sweeper', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} job workers on {self.queue.db_path}")
+
+    def stop(self, timeout=None):
+        """Signal the workers to stop and wait for them"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._process(job)
+
+    def _sweep(self):
+        """Delete expired finished jobs now and every sweep_interval seconds"""
+        while not self._stop.is_set():
+            try:
+                deleted = self.queue.purge(self.retention)
+                if deleted:
+                    logger.info(f"Deleted {deleted} jobs finished more than {self.retention}s ago")
+            except Exception as e:
+                logger.error(f"Error deleting finished jobs: {str(e)}")
+            self._stop.wait(self.sweep_interval)
+
+    def _process(self, job):
+        """Run one claimed job and record its outcome"""
+        job_id = job['id']
+        attempt = job['attempts']
+        try:
+            handler = self.handlers[job['kind']]
+            result = handler(job['payload'], json.loads(job['params']))
+        except Exception as e:
+            logger.error(f"Job {job_id} attempt {attempt} failed: {str(e)}")
+            status = self.queue.fail(job_id, str(e), attempt)
+            if status is None:
+                logger.warning(f"Job {job_id} attempt {attempt} outlived its lease; failure not recorded")
+            if status != JOB_FAILED:
+                return
+        else:
+            if not self.queue.complete(job_id, result, attempt):
+                logger.warning(f"Job {job_id} attempt {attempt} outlived its lease; result discarded")
+                return
+
+        if job['callback_url']:
+            self._notify(job_id, job['callback_url'])
+
+    def _notify(self, job_id, callback_url):
+        """POST the final job state to its callback URL"""
+        try:
+            # Checked again here: the host may resolve differently than at submission
+            check_callback_url(callback_url)
+        except ValueError as e:
+            logger.warning(f"Callback for job {job_id} rejected: {str(e)}")
+            self.queue.set_callback_status(job_id, f'rejected: {str(e)}')
+            return
+        try:
+            response = requests.post(callback_url, json=self.queue.get(job_id), timeout=JOB_CALLBACK_TIMEOUT,
+                                     allow_redirects=False)
+            self.queue.set_callback_status(job_id, f'HTTP {response.status_code}')
+        except Exception as e:
+            logger.error(f"Callback for job {job_id} failed: {str(e)}")
+            self.queue.set_callback_status(job_id, f'error: {str(e)}')
+
+
+_job_queue = None
+_worker_pool = None
+_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, creating it on first use"""
+    global _job_queue
+    with _lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
+
+
+def start_job_workers():
+    """Start the local job worker pool once per process"""
+    global _worker_pool
+    queue = get_job_queue()
+    with _lock:
+        if _worker_pool is None and JOB_WORKERS > 0:
+            _worker_pool = JobWorkerPool(queue)
+            _worker_pool.start()
+        return _worker_pool
@@ -0,0 +1,142 @@
+"""
+Keyframe selection for animated GIFs and multi-page TIFFs.
+
+Every frame is reduced to a 16x16 RGB thumbnail; a frame whose mean
+absolute difference from an earlier keyframe's thumbnail is below
+KEYFRAME_MIN_DISTANCE is counted as a repeat of it, anything further away
+starts a new keyframe. (Thumbnails are compared rather than dHashes, whose
+bits flip on the flat, dithered areas common in GIFs.) Only keyframes are
+kept, as small RGB copies, and captioned, so the model cost of an animation
+follows how much its content changes rather than how many frames it has.
+Frames are only converted to RGB at full size when they become keyframes,
+and scanning stops after KEYFRAME_SCAN_PIXELS decoded pixels, so large
+animations are bounded in CPU as well as in memory.
+"""
+from collections import namedtuple
+import logging
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from app.utils.tracing import span
+from config.config import (
+    KEYFRAME_MAX_FRAMES,
+    KEYFRAME_MIN_DISTANCE,
+    KEYFRAME_SCAN_FRAMES,
+    KEYFRAME_SCAN_PIXELS,
+    KEYFRAME_MAX_SIDE
+)
+
+logger = logging.getLogger(__name__)
+
+# Candidates tracked per kept keyframe before new frames are folded into the nearest one
+CANDIDATE_FACTOR = 4
+
+SIGNATURE_SIDE = 16
+
+# Pixels per signature cell sampled (nearest neighbour) before averaging
+SIGNATURE_SAMPLES = 4
+
+Keyframe = namedtuple('Keyframe', ['index', 'image', 'frames'])
+
+
+def is_multiframe(image):
+    """True for animated GIFs, multi-page TIFFs and other images with more than one frame"""
+    return getattr(image, 'n_frames', 1) > 1
+
+
+def frame_signature(frame):
+    """
+    Cheap content signature of a frame
+    A nearest-neighbour sample is taken in the frame's own mode, so only the
+    sample is converted to RGB, then averaged down to the signature size.
+    Args:
+        frame (PIL.Image): Frame in any mode
+    Returns:
+        numpy.ndarray: SIGNATURE_SIDE x SIGNATURE_SIDE x 3 thumbnail as int16
+    """
+    side = SIGNATURE_SIDE * SIGNATURE_SAMPLES
+    sample = frame.resize((side, side), Image.NEAREST).convert('RGB')
+    thumbnail = sample.resize((SIGNATURE_SIDE, SIGNATURE_SIDE), Image.BOX)
+    return np.asarray(thumbnail, dtype=np.int16)
+
+
+def signature_distance(first, second):
+    """Mean absolute difference of two signatures, 0-255"""
+    return float(np.abs(first - second).mean())
+
+
+def select_keyframes(image, max_frames=KEYFRAME_MAX_FRAMES, min_distance=KEYFRAME_MIN_DISTANCE,
+                     scan_frames=KEYFRAME_SCAN_FRAMES, max_side=KEYFRAME_MAX_SIDE, scan_pixels=KEYFRAME_SCAN_PIXELS):
+    """
+    Pick the visually distinct frames of a multi-frame image
+    Args:
+        image (PIL.Image): Opened GIF, TIFF or other multi-frame image
+        max_frames (int): Most keyframes returned
+        min_distance (float): Signature distance from every keyframe for a frame to be new
+        scan_frames (int): Frames examined; later ones are ignored
+        max_side (int): Longest side of the returned keyframe images
+        scan_pixels (int): Pixels decoded at most; lowers scan_frames for large frames (at least one is scanned)
+    Returns:
+        list: Keyframe(index, RGB image, number of frames it stands for), in frame
+            order; when there are more distinct frames than max_frames, those
+            standing for the most frames are kept
+    """
+    candidates = []  # [signature, Keyframe]
+    scanned = 0
+    scan_frames = min(scan_frames, max(1, scan_pixels // (image.width * image.height)))
+    with span('keyframes.select') as select:
+        try:
+            for index, frame in enumerate(ImageSequence.Iterator(image)):
+                if index >= scan_frames:
+                    break
+                scanned += 1
+                signature = frame_signature(frame)
+
+                nearest, distance = None, None
+                for position, (known, _) in enumerate(candidates):
+                    candidate_distance = signature_distance(signature, known)
+                    if distance is None or candidate_distance < distance:
+                        nearest, distance = position, candidate_distance
+
+                if nearest is not None and (distance < min_distance or len(candidates) >= max_frames * CANDIDATE_FACTOR):
+                    known, keyframe = candidates[nearest]
+                    candidates[nearest] = [known, keyframe._replace(frames=keyframe.frames + 1)]
+                    continue
+
+                rgb = frame.convert('RGB')
+                rgb.thumbnail((max_side, max_side), Image.BOX)
+                candidates.append([signature, Keyframe(index, rgb, 1)])
+        finally:
+            # Leave the image on its first frame for the caller
+            image.seek(0)
+
+        keyframes = [keyframe for _, keyframe in candidates]
+        if len(keyframes) > max_frames:
+            keyframes = sorted(keyframes, key=lambda keyframe: keyframe.frames, reverse=True)[:max_frames]
+            keyframes.sort(key=lambda keyframe: keyframe.index)
+
+        select.set_attributes({
+            'keyframes.frames': getattr(image, 'n_frames', scanned),
+            'keyframes.scanned': scanned,
+            'keyframes.distinct': len(candidates),
+            'keyframes.selected': len(keyframes)
+        })
+        logger.info(f"Selected {len(keyframes)} keyframes from {scanned} frames")
+        return keyframes
+
+
+def merge_captions(captions):
+    """
+    Combine the captions of consecutive keyframes into one description
+    Args:
+        captions (list): Captions in frame order
+    Returns:
+        str: The caption if all agree, otherwise the distinct captions in order
+    """
+    merged = []
+    for caption in captions:
+        caption = caption.strip()
+        if caption and caption.lower() not in (seen.lower() for seen in merged):
+            merged.append(caption)
+    return ', then '.join(merged)
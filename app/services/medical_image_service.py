@@ -0,0 +1,378 @@
+"""
+Medical image ingestion.
+
+Turns an uploaded DICOM file, 16-bit TIFF or ordinary image into a few
+8-bit RGB frames for captioning. Native (uncompressed) DICOM pixel data is
+memory-mapped from the upload instead of being read into memory, and every
+study is read one frame at a time, so peak memory is bounded by a frame
+rather than by the study. Stored values go through the modality rescale and
+a vectorized window/level to 8 bits. Multi-frame studies are reduced to a
+few representative frames, so BLIP and the report only see those.
+"""
+from collections import namedtuple
+import io
+import math
+import mmap
+import logging
+
+import numpy as np
+from PIL import Image
+import pydicom
+from pydicom.pixels import pixel_array
+
+from app.utils.file_utils import sniff_image_format
+from app.utils.tracing import span
+from config.config import MEDICAL_MAX_FRAMES, MEDICAL_FRAME_MAX_SIDE
+
+logger = logging.getLogger(__name__)
+
+PIXEL_DATA = 0x7FE00010
+SIGNATURE_SIDE = 32  # Samples per side of the frame signatures used for frame selection
+
+MedicalStudy = namedtuple('MedicalStudy', ['frames', 'info'])
+
+
+class MedicalImageError(Exception):
+    """
+    Raised when an upload cannot be read as a medical image.
+    Args:
+        message (str): Description of the problem
+        code (str): Error code returned to the client
+    """
+
+    def __init__(self, message, code='INVALID_IMAGE'):
+        super().__init__(message)
+        self.code = code
+
+
+def identify_medical_format(stream):
+    """
+    Identify a medical upload from its leading bytes
+    Args:
+        stream: Seekable binary stream, left at position 0
+    Returns:
+        str: 'dicom', an image format from sniff_image_format, or None
+    """
+    header = stream.read(132)
+    stream.seek(0)
+    if len(header) == 132 and header[128:132] == b'DICM':
+        return 'dicom'
+    return sniff_image_format(header)
+
+
+def window_to_uint8(values, center, width, invert=False):
+    """
+    Map values to 8 bits with a linear window (DICOM PS3.3 C.11.2.1.2.1)
+    Args:
+        values (np.ndarray): float32 modality values; overwritten
+        center (float): Window center
+        width (float): Window width
+        invert (bool): Invert the output (MONOCHROME1)
+    Returns:
+        np.ndarray: uint8 array of the same shape
+    """
+    if width <= 1:
+        values = np.where(values > center - 0.5, 255.0, 0.0).astype(np.float32)
+    else:
+        values -= center - 0.5
+        values *= 255.0 / (width - 1)
+        values += 127.5
+        np.clip(values, 0, 255, out=values)
+    if invert:
+        np.subtract(255.0, values, out=values)
+    return values.astype(np.uint8)
+
+
+def auto_window(values):
+    """Window covering the 0.5-99.5 percentile range of the values"""
+    low, high = np.percentile(values, [0.5, 99.5])
+    return float(low + high) / 2, float(high - low) + 1
+
+
+def reduce_frame(frame, max_side, chunk_bytes=8 * 1024 * 1024):
+    """
+    Downsample a frame by block averaging so its longest side is at most max_side.
+    Reads the frame in row chunks, so a memory-mapped frame is never fully
+    copied into memory.
+    Args:
+        frame (np.ndarray): (rows, cols) or (rows, cols, samples) array
+        max_side (int): Longest side of the result
+    Returns:
+        np.ndarray: float32 array
+    """
+    rows, cols = frame.shape[:2]
+    factor = max(1, math.ceil(max(rows, cols) / max_side))
+    if factor == 1:
+        return frame.astype(np.float32)
+
+    out_rows, out_cols = rows // factor, cols // factor
+    rest = frame.shape[2:]
+    out = np.empty((out_rows, out_cols) + rest, dtype=np.float32)
+    row_bytes = cols * factor * 4 * (rest[0] if rest else 1)
+    chunk = max(1, chunk_bytes // row_bytes)
+    for start in range(0, out_rows, chunk):
+        stop = min(out_rows, start + chunk)
+        block = frame[start * factor:stop * factor, :out_cols * factor].astype(np.float32)
+        out[start:stop] = block.reshape((stop - start, factor, out_cols, factor) + rest).mean(axis=(1, 3))
+    return out
+
+
+def select_representative_frames(signatures, max_frames):
+    """
+    Pick up to max_frames frames that carry content and differ from each other
+    Args:
+        signatures (list): Small float32 sample of every frame, all the same shape
+        max_frames (int): Frames to pick
+    Returns:
+        list: Frame indices, most detailed frame first
+    """
+    spreads = np.array([signature.std() for signature in signatures])
+    if spreads.max() <= 0:
+        return [0]
+
+    # Blank and near-uniform frames (e.g. padding slices) are never picked
+    candidates = [i for i, spread in enumerate(spreads) if spread >= 0.1 * spreads.max()]
+    normalized = np.stack([(signature - signature.mean()) / (signature.std() or 1) for signature in signatures])
+    chosen = [max(candidates, key=lambda i: spreads[i])]
+    distances = np.full(len(signatures), np.inf)
+    while len(chosen) < min(max_frames, len(candidates)):
+        distances = np.minimum(distances, np.abs(normalized - normalized[chosen[-1]]).mean(axis=tuple(range(1, normalized.ndim))))
+        best = max((i for i in candidates if i not in chosen), key=lambda i: distances[i])
+        if distances[best] <= 0:
+            break
+        chosen.append(best)
+    return chosen
+
+
+class _DicomSource:
+    """Frames of a DICOM file, memory-mapped when the pixel data is stored uncompressed"""
+
+    def __init__(self, stream):
+        try:
+            # Elements over 1 KB (the pixel data) are left in the file
+            self.dataset = pydicom.dcmread(stream, defer_size=1024)
+        except Exception as e:
+            raise MedicalImageError(f"Invalid DICOM file: {str(e)}")
+        ds = self.dataset
+        if 'PixelData' not in ds:
+            raise MedicalImageError("DICOM file has no pixel data", 'NO_PIXEL_DATA')
+
+        self.stream = stream
+        self.rows, self.cols = int(ds.Rows), int(ds.Columns)
+        self.samples = int(ds.get('SamplesPerPixel', 1))
+        self.n_frames = int(ds.get('NumberOfFrames') or 1)
+        self.photometric = str(ds.get('PhotometricInterpretation', 'MONOCHROME2'))
+        self.grayscale = self.photometric.startswith('MONOCHROME')
+        self.slope = float(ds.get('RescaleSlope', 1) or 1)
+        self.intercept = float(ds.get('RescaleIntercept', 0) or 0)
+        self.window = self._stored_window()
+        self.bits_stored = int(ds.get('BitsStored', ds.BitsAllocated))
+        self.signed = bool(ds.get('PixelRepresentation', 0))
+        self._buffer = None
+        self._pixels = self._map_pixels()
+
+    def _stored_window(self):
+        center, width = self.dataset.get('WindowCenter'), self.dataset.get('WindowWidth')
+        if center is None or width is None:
+            return None
+        # Multi-valued windows list presets; the first is the default
+        if isinstance(center, pydicom.multival.MultiValue):
+            center = center[0]
+        if isinstance(width, pydicom.multival.MultiValue):
+            width = width[0]
+        return float(center), float(width)
+
+    def _map_pixels(self):
+        """Zero-copy view of native pixel data, or None to decode frame by frame"""
+        ds = self.dataset
+        syntax = ds.file_meta.TransferSyntaxUID
+        element = ds.get_item(PIXEL_DATA, keep_deferred=True)
+        bits = int(ds.BitsAllocated)
+        deferred = getattr(element, 'value', None) is None and getattr(element, 'value_tell', None) is not None
+        # frame() only handles stored bits aligned to bit 0 (HighBit = BitsStored - 1)
+        aligned = int(ds.get('HighBit', self.bits_stored - 1)) == self.bits_stored - 1
+        if syntax.is_encapsulated or not deferred or bits not in (8, 16, 32) or not aligned or \
+                self.bits_stored > bits or \
+                (self.samples > 1 and (self.photometric != 'RGB' or ds.get('PlanarConfiguration', 0) != 0)):
+            return None
+
+        dtype = np.dtype(f"{'i' if self.signed else 'u'}{bits // 8}")
+        dtype = dtype.newbyteorder('<' if syntax.is_little_endian else '>')
+        shape = (self.n_frames, self.rows, self.cols) + ((self.samples,) if self.samples > 1 else ())
+        count = int(np.prod(shape))
+        if element.length < count * dtype.itemsize:
+            raise MedicalImageError("DICOM pixel data is shorter than its dimensions")
+
+        # A SpooledTemporaryFile keeps small uploads in a BytesIO and larger ones in a real file
+        source = getattr(self.stream, '_file', self.stream)
+        if isinstance(source, io.BytesIO):
+            self._buffer = source.getbuffer()
+        else:
+            try:
+                self._buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, io.UnsupportedOperation, ValueError):
+                return None
+        return np.frombuffer(self._buffer, dtype, count=count, offset=element.value_tell).reshape(shape)
+
+    def frame(self, index):
+        if self._pixels is not None:
+            pixels = self._pixels[index]
+            unused = pixels.dtype.itemsize * 8 - self.bits_stored
+            if not unused:
+                return pixels
+            # Bits above BitsStored may hold overlays or garbage: drop them and
+            # sign-extend from the stored high bit, as pixel_array does
+            if self.signed:
+                return (pixels << unused) >> unused
+            return pixels & ((1 << self.bits_stored) - 1)
+        self.stream.seek(0)
+        return pixel_array(self.stream, index=index)
+
+    def info(self):
+        ds = self.dataset
+        return {
+            'format': 'dicom',
+            'modality': str(ds.get('Modality', '')) or None,
+            'transfer_syntax': ds.file_meta.TransferSyntaxUID.name,
+            'photometric': self.photometric,
+            'bits_stored': self.bits_stored,
+            'memory_mapped': self._pixels is not None
+        }
+
+    def close(self):
+        self._pixels = None
+        if self._buffer is not None:
+            try:
+                self._buffer.release() if isinstance(self._buffer, memoryview) else self._buffer.close()
+            except BufferError:
+                # Still referenced by a frame view; freed with it
+                pass
+            self._buffer = None
+
+
+class _PillowSource:
+    """Frames (pages) of a TIFF or ordinary image, decoded one at a time by Pillow"""
+
+    def __init__(self, stream, format):
+        try:
+            self.image = Image.open(stream)
+        except Exception as e:
+            raise MedicalImageError(f"Invalid or corrupted image file: {str(e)}")
+        self.format = format
+        self.rows, self.cols = self.image.height, self.image.width
+        self.n_frames = getattr(self.image, 'n_frames', 1)
+        self.slope, self.intercept = 1.0, 0.0
+        self.window = None
+        self.photometric = self.image.mode
+        self.grayscale = self.image.mode in ('1', 'L', 'I', 'F') or self.image.mode.startswith('I;16')
+
+    def frame(self, index):
+        self.image.seek(index)
+        mode = self.image.mode
+        if mode in ('L', 'RGB', 'I', 'F') or mode.startswith('I;16'):
+            # 16-bit and float pages keep their full range until windowing
+            return np.asarray(self.image)
+        return np.asarray(self.image.convert('RGB'))
+
+    def info(self):
+        return {
+            'format': self.format,
+            'modality': None,
+            'mode': self.image.mode,
+            'memory_mapped': False
+        }
+
+    def close(self):
+        self.image.close()
+
+
+def _frame_signature(frame):
+    """Strided sample of a frame; only the sampled rows of a mapped frame are read"""
+    step = max(1, max(frame.shape[:2]) // SIGNATURE_SIDE)
+    sample = np.asarray(frame[::step, ::step][:SIGNATURE_SIDE, :SIGNATURE_SIDE], dtype=np.float32)
+    return sample.mean(axis=2) if sample.ndim == 3 else sample
+
+
+def load_medical_study(stream, max_frames=MEDICAL_MAX_FRAMES, max_side=MEDICAL_FRAME_MAX_SIDE):
+    """
+    Read a medical upload into a few 8-bit RGB frames ready for captioning
+    Args:
+        stream: Seekable binary stream of a DICOM file or image
+        max_frames (int): Representative frames kept from multi-frame studies
+        max_side (int): Longest side of the returned frames
+    Returns:
+        MedicalStudy: frames is a list of (frame index, PIL.Image), most
+            detailed frame first; info describes the study and the window used
+    Raises:
+        MedicalImageError: If the upload is not a readable medical image
+    """
+    format = identify_medical_format(stream)
+    if format is None:
+        raise MedicalImageError("Invalid or corrupted image file")
+
+    with span('medical.ingest', format=format) as ingest:
+        source = _DicomSource(stream) if format == 'dicom' else _PillowSource(stream, format)
+        try:
+            # One frame in memory at a time: signatures first, then the selected frames
+            if source.n_frames > 1:
+                signatures = [_frame_signature(source.frame(index)) for index in range(source.n_frames)]
+                indices = select_representative_frames(signatures, max_frames)
+            else:
+                indices = [0]
+            reduced = []
+            eight_bit = True
+            for index in indices:
+                frame = source.frame(index)
+                eight_bit = eight_bit and frame.dtype == np.uint8
+                reduced.append(reduce_frame(frame, max_side))
+                del frame
+            info = source.info()
+        finally:
+            source.close()
+
+        values = [frame * source.slope + source.intercept for frame in reduced]
+        # 8-bit grayscale without a rescale or stored window is already displayable
+        if source.grayscale and (source.window or not eight_bit or (source.slope, source.intercept) != (1.0, 0.0)):
+            window_source = 'dicom' if source.window else 'auto'
+            center, width = source.window or auto_window(np.concatenate([frame.ravel() for frame in values]))
+            invert = source.photometric == 'MONOCHROME1'
+            converted = [window_to_uint8(frame, center, width, invert) for frame in values]
+            info['window'] = {'center': round(center, 2), 'width': round(width, 2), 'source': window_source}
+        else:
+            converted = [np.clip(frame, 0, 255).astype(np.uint8) for frame in values]
+
+        frames = [(index, Image.fromarray(array).convert('RGB')) for index, array in zip(indices, converted)]
+        info.update({
+            'rows': source.rows,
+            'columns': source.cols,
+            'frames': source.n_frames,
+            'selected_frames': list(indices)
+        })
+        ingest.set_attributes({'medical.frames': source.n_frames, 'medical.selected': len(indices)})
+        return MedicalStudy(frames, info)
+
+
+def describe_study(study):
+    """
+    Caption the representative frames of a study
+    Args:
+        study (MedicalStudy): Loaded study
+    Returns:
+        tuple: (alt text of the most detailed frame, description of every
+            selected frame for the report, list of {'frame', 'alt_text'})
+    """
+    # Imported here so studies can be loaded without loading the model
+    from app.services.image_service import image_processor
+
+    captions = []
+    alt_texts = image_processor.generate_alt_text_batch([frame for _, frame in study.frames])
+    for (index, _), alt_text in zip(study.frames, alt_texts):
+        if not isinstance(alt_text, str) or not alt_text.strip() or alt_text.startswith('Error generating alt text'):
+            raise ValueError("Failed to generate image description")
+        captions.append({'frame': index, 'alt_text': alt_text})
+
+    if len(captions) == 1:
+        return captions[0]['alt_text'], captions[0]['alt_text'], captions
+    description = '\n'.join(f"Frame {caption['frame'] + 1} of {study.info['frames']}: {caption['alt_text']}"
+                            for caption in sorted(captions, key=lambda caption: caption['frame']))
+    return captions[0]['alt_text'], description, captions
@@ -0,0 +1,242 @@
+"""
+Perceptual hashing and a near-duplicate result cache.
+
+A 64-bit difference hash (dHash) is computed for every processed image and
+kept in a multi-index Hamming structure, so that resized, re-encoded or
+EXIF-stripped copies of an image can reuse the alt text, context and SEO
+output generated for the original. The dHash only sees grayscale gradients,
+so a match is confirmed with a coarse colour signature (mean RGB of each
+quadrant): colour variants of the same shape, such as product SKUs, are not
+near-duplicates. Flat and near-flat images, whose hash is almost all zeros
+or ones, are never cached.
+"""
+from collections import OrderedDict, namedtuple
+import threading
+import logging
+
+import numpy as np
+from PIL import Image
+
+from config.config import NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_CACHE_SIZE, NEAR_DUPLICATE_MAX_COLOR_DIFF
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+MIN_HASH_BITS = 8  # Hashes with fewer set (or unset) bits carry too little detail to identify an image
+
+ImageKey = namedtuple('ImageKey', ['dhash', 'color'])
+
+
+def compute_dhash(image, hash_size=HASH_SIZE):
+    """
+    Compute the difference hash of an image
+    Args:
+        image (PIL.Image): Input image
+        hash_size (int): Width and height of the comparison grid
+    Returns:
+        int: hash_size * hash_size bit perceptual hash
+    """
+    # Reduce first so the grayscale conversion only touches a tiny thumbnail
+    thumbnail = image.resize((hash_size + 1, hash_size), Image.BOX, reducing_gap=2.0)
+    pixels = np.asarray(thumbnail.convert('L'), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def compute_color_signature(image):
+    """
+    Compute a coarse colour signature of an image
+    Args:
+        image (PIL.Image): Input image
+    Returns:
+        tuple: Mean R, G and B of each quadrant, 12 values from 0 to 255
+    """
+    # Palette and bilevel images are resized by sampling single pixels; average real colours instead
+    if image.mode in ('P', '1'):
+        image = image.convert('RGB')
+    thumbnail = image.resize((2, 2), Image.BOX, reducing_gap=2.0)
+    if thumbnail.mode != 'RGB':
+        thumbnail = thumbnail.convert('RGB')
+    return tuple(thumbnail.tobytes())
+
+
+def near_duplicate_key(image):
+    """
+    Key an image is filed under in the near-duplicate cache
+    Args:
+        image (PIL.Image): Input image
+    Returns:
+        ImageKey: dHash and colour signature of the image, or None for
+            multi-frame images, whose first frame alone would match unrelated
+            stills, and for flat images, whose hash matches any other flat image
+    """
+    if getattr(image, 'n_frames', 1) > 1:
+        return None
+    dhash = compute_dhash(image)
+    if not MIN_HASH_BITS <= bin(dhash).count('1') <= HASH_BITS - MIN_HASH_BITS:
+        return None
+    return ImageKey(dhash, compute_color_signature(image))
+
+
+def hamming_distance(first, second):
+    """Number of differing bits between two hashes"""
+    return bin(first ^ second).count('1')
+
+
+def color_difference(first, second):
+    """Largest difference between two colour signatures, from 0 to 255"""
+    return max(abs(a - b) for a, b in zip(first, second))
+
+
+class MultiIndexHashIndex:
+    """
+    Multi-index hashing over fixed-width hashes.
+    The hash is split into max_distance + 1 chunks; by the pigeonhole principle
+    any hash within max_distance bits of a query matches it exactly on at least
+    one chunk, so candidates come from exact lookups in one table per chunk.
+    Args:
+        max_distance (int): Largest Hamming distance searches must support
+        hash_bits (int): Width of the indexed hashes
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_MAX_DISTANCE, hash_bits=HASH_BITS):
+        self.max_distance = max_distance
+        self.hash_bits = hash_bits
+        chunk_count = max_distance + 1
+        base_width, extra = divmod(hash_bits, chunk_count)
+
+        self._chunks = []  # (shift, mask) of each chunk
+        shift = 0
+        for i in range(chunk_count):
+            width = base_width + (1 if i < extra else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = set()
+
+    def add(self, value):
+        """Index a hash"""
+        if value in self._hashes:
+            return
+        self._hashes.add(value)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value >> shift) & mask, set()).add(value)
+
+    def remove(self, value):
+        """Remove a hash from the index"""
+        if value not in self._hashes:
+            return
+        self._hashes.discard(value)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            key = (value >> shift) & mask
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[key]
+
+    def search(self, value, max_distance=None):
+        """
+        Find indexed hashes within a Hamming distance of value
+        Args:
+            value (int): Query hash
+            max_distance (int): Search radius, at most the index's max_distance
+        Returns:
+            list: (hash, distance) pairs sorted by distance
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            bucket = table.get((value >> shift) & mask)
+            if bucket:
+                candidates.update(bucket)
+
+        matches = []
+        for candidate in candidates:
+            distance = hamming_distance(value, candidate)
+            if distance <= max_distance:
+                matches.append((candidate, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class NearDuplicateCache:
+    """
+    Size-bounded store of generated results keyed by ImageKey.
+    Args:
+        max_size (int): Maximum number of images kept before evicting the oldest
+        max_distance (int): Largest Hamming distance treated as the same image
+        max_color_diff (int): Largest colour signature difference treated as the same image
+    """
+
+    def __init__(self, max_size=NEAR_DUPLICATE_CACHE_SIZE, max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+                 max_color_diff=NEAR_DUPLICATE_MAX_COLOR_DIFF):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.max_color_diff = max_color_diff
+        self._index = MultiIndexHashIndex(max_distance)
+        self._results = OrderedDict()
+        self._keys = {}  # dHash -> ImageKeys stored under it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, phash):
+        """
+        Return the results stored for the nearest near-duplicate of an image
+        Args:
+            phash (ImageKey): near_duplicate_key of the new image, or None if it has none
+        Returns:
+            dict: Stored results (e.g. alt_text, context, seo), or None
+        """
+        if phash is None:
+            return None
+        with self._lock:
+            # Nearest hash first; the colours must agree as well
+            for candidate, distance in self._index.search(phash.dhash, self.max_distance):
+                keys = [(color_difference(key.color, phash.color), key) for key in self._keys[candidate]]
+                keys = [match for match in keys if match[0] <= self.max_color_diff]
+                if keys:
+                    color_diff, nearest = min(keys)
+                    self._results.move_to_end(nearest)
+                    self.hits += 1
+                    logger.info(f"Near-duplicate cache hit at Hamming distance {distance}, colour difference {color_diff}")
+                    return dict(self._results[nearest])
+
+            self.misses += 1
+            return None
+
+    def store(self, phash, **results):
+        """
+        Store generated results for an image, merging with any already stored
+        Args:
+            phash (ImageKey): near_duplicate_key of the image; nothing is stored for None
+            **results: Results to keep, e.g. alt_text=..., context=...
+        """
+        if phash is None:
+            return
+        with self._lock:
+            entry = self._results.setdefault(phash, {})
+            entry.update(results)
+            self._results.move_to_end(phash)
+            self._keys.setdefault(phash.dhash, set()).add(phash)
+            self._index.add(phash.dhash)
+
+            while len(self._results) > self.max_size:
+                evicted, _ = self._results.popitem(last=False)
+                keys = self._keys[evicted.dhash]
+                keys.discard(evicted)
+                if not keys:
+                    del self._keys[evicted.dhash]
+                    self._index.remove(evicted.dhash)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+# Create singleton instance
+near_duplicate_cache = NearDuplicateCache()
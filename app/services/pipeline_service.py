@@ -0,0 +1,134 @@
+"""
+Declarative analysis pipeline.
+
+Each stage names the values it needs. A request asks for a set of outputs;
+the pipeline resolves the stages they depend on, computes every
+intermediate value (alt text, context) once, and runs stages whose inputs
+are ready concurrently.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import threading
+import logging
+
+from app.services.text_service import generate_context, enhance_context, social_media_caption, analyze_sentiment
+from app.services.seo_service import generate_seo_description
+from app.utils.profiling import profile_thread
+from config.config import PIPELINE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+Stage = namedtuple('Stage', ['requires', 'run'])
+
+
+def _unwrap(response, key=None):
+    """Return the data of a service response, raising on failure"""
+    if not response['success']:
+        raise ValueError(response['error'])
+    return response['data'][key] if key else response['data']
+
+
+def _alt_text(values):
+    # Imported here so the pipeline can be resolved without loading the model
+    from app.services.image_service import image_processor
+    alt_text = image_processor.generate_alt_text(values['image'])
+    if alt_text.startswith('Error generating alt text'):
+        raise ValueError(alt_text)
+    return alt_text
+
+
+# Stage name -> values it requires ('image' is the pipeline input) and how to compute it
+PIPELINE_STAGES = {
+    'alt_text': Stage(('image',), _alt_text),
+    'context': Stage(('alt_text',), lambda values: _unwrap(generate_context(values['alt_text']), 'context')),
+    'enhanced': Stage(('context',), lambda values: _unwrap(enhance_context(values['context']), 'enhanced_context')),
+    'caption': Stage(('context',), lambda values: _unwrap(social_media_caption(values['context']), 'caption')),
+    'seo': Stage(('alt_text', 'context'),
+                 lambda values: _unwrap(generate_seo_description(values['context'], values['alt_text']))),
+    'sentiment': Stage(('alt_text',), lambda values: _unwrap(analyze_sentiment(values['alt_text']), 'sentiment'))
+}
+
+
+def resolve_stages(requested):
+    """
+    Expand requested outputs with the stages they depend on
+    Args:
+        requested (list): Names from PIPELINE_STAGES
+    Returns:
+        set: Requested stages plus everything they depend on
+    """
+    unknown = [name for name in requested if name not in PIPELINE_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown analyses: {', '.join(unknown)}. Supported: {', '.join(PIPELINE_STAGES)}")
+
+    resolved = set()
+    pending = list(requested)
+    while pending:
+        name = pending.pop()
+        if name not in resolved:
+            resolved.add(name)
+            pending.extend(requirement for requirement in PIPELINE_STAGES[name].requires
+                           if requirement in PIPELINE_STAGES)
+    return resolved
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Shared thread pool for stage execution, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
+        return _executor
+
+
+def run_pipeline(outputs, image=None, known=None):
+    """
+    Compute the requested outputs for one image
+    Args:
+        outputs (list): Names from PIPELINE_STAGES
+        image (PIL.Image): Input image; only needed if alt text must be generated
+        known (dict): Values already available (e.g. from a cache), which are not recomputed
+    Returns:
+        tuple: (values, errors) - values maps every computed or known stage to its
+            result, errors maps each failed stage to its error message
+    """
+    values = dict(known or {})
+    values['image'] = image
+    errors = {}
+    pending = {name for name in resolve_stages(outputs) if name not in values}
+    running = {}
+    executor = _get_executor()
+
+    while pending or running:
+        for name in sorted(pending):
+            requires = PIPELINE_STAGES[name].requires
+            failed = [requirement for requirement in requires if requirement in errors]
+            if failed:
+                errors[name] = f"Skipped because {failed[0]} failed"
+                pending.discard(name)
+            elif all(requirement in values for requirement in requires):
+                # Stages read the values dict, which only gains keys once their inputs are final;
+                # each runs in a copy of this context to inherit the request's admission and profiling state
+                running[executor.submit(contextvars.copy_context().run, profile_thread,
+                                        PIPELINE_STAGES[name].run, values)] = name
+                pending.discard(name)
+
+        if not running:
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                values[name] = future.result()
+            except Exception as e:
+                logger.error(f"Pipeline stage {name} failed: {str(e)}")
+                errors[name] = str(e)
+
+    del values['image']
+    return values, errors
@@ -0,0 +1,209 @@
+"""
+Approximate cache for LLM calls keyed on what a caption says.
+
+BLIP often words the same scene slightly differently ("a dog sitting on the
+grass" / "there is a dog sitting on a grassy field"), so exact-prompt caching
+rarely hits.
+Here each text is normalized and embedded as a hashed bag of character
+trigrams and words; a lookup scans the stored vectors for the nearest one
+by cosine similarity and reuses its result when the similarity reaches the
+threshold. The similarity of every lookup's nearest neighbour is recorded,
+so metrics() reports the hit rate each candidate threshold would give.
+"""
+from collections import OrderedDict
+import re
+import threading
+import zlib
+import logging
+
+import numpy as np
+
+from config.config import SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_DIMS
+
+logger = logging.getLogger(__name__)
+
+# Words that never change what a caption describes: articles and BLIP's
+# framing ("there is ...", "a close up of ...", "an image of ..."). Spatial
+# words stay: "a cat on top of a car" and "a cat inside a car" are different
+# scenes, even if "on the grass" / "in the grass" then no longer match
+STOPWORDS = frozenset({
+    'a', 'an', 'the', 'some', 'and', 'of', 'very',
+    'there', 'is', 'are', 'that', 'this', 'it', 'close', 'up', 'image', 'picture', 'photo'
+})
+
+# Whole words count for more than their trigrams, so a different subject
+# ("dog" / "cat") or relation ("on" / "inside") moves a caption further than
+# a different spelling of the same word
+WORD_WEIGHT = 3.0
+
+# Thresholds reported in metrics()
+REPORTED_THRESHOLDS = (0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_caption(text):
+    """
+    Canonical form of a caption: lowercase words without punctuation or stopwords
+    Args:
+        text (str): Caption or other short text
+    Returns:
+        str: Normalized text
+    """
+    return ' '.join(word for word in _TOKEN.findall(text.lower()) if word not in STOPWORDS)
+
+
+def caption_vector(normalized, dims=SEMANTIC_CACHE_DIMS):
+    """
+    Embed normalized text as an L2-normalized hashed bag of character trigrams and words
+    Args:
+        normalized (str): Output of normalize_caption
+        dims (int): Vector width
+    Returns:
+        numpy.ndarray: float32 vector of length dims (all zeros for empty text)
+    """
+    features = []
+    weights = []
+    for word in normalized.split():
+        padded = f'#{word}#'
+        for i in range(len(padded) - 2):
+            features.append(padded[i:i + 3])
+            weights.append(1.0)
+        features.append(word)
+        weights.append(WORD_WEIGHT)
+
+    vector = np.zeros(dims, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.array([zlib.crc32(feature.encode('utf-8')) for feature in features], dtype=np.uint64)
+    # The top hash bit picks the sign, so collisions cancel out on average instead of adding up
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    np.add.at(vector, (hashes % dims).astype(np.intp), signs * np.array(weights))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Size-bounded nearest-neighbour cache from texts to results.
+    Vectors live in one matrix, so a lookup is a single matrix-vector product.
+    Args:
+        name (str): Label used in logs and metrics
+        max_size (int): Texts kept before evicting the least recently used; 0 disables the cache
+        threshold (float): Cosine similarity at which a stored text counts as the same
+        dims (int): Vector width
+    """
+
+    def __init__(self, name, max_size=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD, dims=SEMANTIC_CACHE_DIMS):
+        self.name = name
+        self.max_size = max_size
+        self.threshold = threshold
+        self.dims = dims
+        self._vectors = np.zeros((min(max_size, 256), dims), dtype=np.float32)
+        self._rows = OrderedDict()  # normalized text -> row, least recently used first
+        self._keys = {}  # row -> normalized text
+        self._values = {}  # row -> stored result
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        # Lookups whose nearest neighbour reached each reported threshold
+        self._reached = dict.fromkeys(REPORTED_THRESHOLDS, 0)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _nearest(self, normalized):
+        """Row and similarity of the stored text nearest to normalized, or (None, 0.0)"""
+        row = self._rows.get(normalized)
+        if row is not None:
+            return row, 1.0
+        if not self._rows:
+            return None, 0.0
+        similarities = self._vectors[:len(self._rows)] @ caption_vector(normalized, self.dims)
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def lookup(self, text):
+        """
+        Return the result stored for the nearest text, if it is similar enough
+        Args:
+            text (str): Text the result would be generated from
+        Returns:
+            The stored result, or None
+        """
+        if not self.enabled or not text:
+            return None
+        normalized = normalize_caption(text)
+        with self._lock:
+            row, similarity = self._nearest(normalized)
+            for threshold in REPORTED_THRESHOLDS:
+                if similarity >= threshold:
+                    self._reached[threshold] += 1
+
+            if row is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if similarity >= 1.0:
+                self.exact_hits += 1
+            self._rows.move_to_end(self._keys[row])
+            logger.debug(f"Semantic {self.name} cache hit at similarity {similarity:.3f}")
+            return self._values[row]
+
+    def store(self, text, value):
+        """
+        Store the result generated from a text
+        Args:
+            text (str): Text the result was generated from
+            value: Result to reuse for similar texts
+        """
+        if not self.enabled or not text:
+            return
+        normalized = normalize_caption(text)
+        vector = caption_vector(normalized, self.dims)
+        with self._lock:
+            row = self._rows.get(normalized)
+            if row is None:
+                if len(self._rows) >= self.max_size:
+                    # Reuse the row of the least recently used text
+                    _, row = self._rows.popitem(last=False)
+                else:
+                    row = len(self._rows)
+                    if row >= len(self._vectors):
+                        grown = np.zeros((min(self.max_size, 2 * len(self._vectors)), self.dims), dtype=np.float32)
+                        grown[:row] = self._vectors
+                        self._vectors = grown
+                self._vectors[row] = vector
+                self._keys[row] = normalized
+            self._rows[normalized] = row
+            self._rows.move_to_end(normalized)
+            self._values[row] = value
+
+    def metrics(self):
+        """Hit counts, and the hit rate each reported threshold would have given so far"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._rows),
+                'max_size': self.max_size,
+                'threshold': self.threshold,
+                'lookups': lookups,
+                'hits': self.hits,
+                'exact_hits': self.exact_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'hit_rate_at': {f'{threshold:.2f}': round(count / lookups, 4) if lookups else None
+                                for threshold, count in self._reached.items()}
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+
+# Create singleton instances, one per cached LLM call
+context_cache = SemanticCache('context')
+enhanced_context_cache = SemanticCache('enhanced_context')
@@ -1,4 +1,4 @@
-from config.ai_config import get_openai_client, format_success_response, format_error_response, GPT_CONFIG
+from config.ai_config import create_chat_completion, format_success_response, format_error_response, GPT_CONFIG
 import openai
 import logging
 
@@ -82,8 +82,7 @@ Additional:
 • Highlight customization options, adjustability, or versatility features
 • End with compatibility features and integration capabilities"""
 
-    openai = get_openai_client()
-    response = openai.ChatCompletion.create(
+    response = create_chat_completion(
         model="gpt-4",
         messages=[
             {
@@ -127,8 +126,7 @@ def _generate_seo_title(context, alt_text):
     9. Use commas and parentheses for separation
     10. Match format of relevant category example"""
 
-    openai = get_openai_client()
-    response = openai.ChatCompletion.create(
+    response = create_chat_completion(
         model="gpt-4",
         messages=[
             {
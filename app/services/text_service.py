@@ -1,6 +1,8 @@
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 import httpx
-from config.ai_config import get_openai_client, format_success_response, format_error_response, GPT_CONFIG
+from config.ai_config import create_chat_completion, format_success_response, format_error_response, GPT_CONFIG
+from app.services.semantic_cache_service import context_cache, enhanced_context_cache
+from app.utils.tracing import span
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,15 +10,21 @@ logger = logging.getLogger(__name__)
 def generate_context(alt_text):
     """
     Generates context from alt text using OpenAI.
+    Contexts generated for near-identical alt text are reused.
     Args:
         alt_text (str): Alt text to generate context from
     Returns:
         dict: Response containing generated context
     """
-    prompt = f"Generate a brief context (maximum 70 words) for this image description:\n\n{alt_text}"
     try:
-        openai = get_openai_client()
-        response = openai.ChatCompletion.create(
+        if not isinstance(alt_text, str):
+            raise TypeError(f"alt text must be a string, not {type(alt_text).__name__}")
+        cached = context_cache.lookup(alt_text)
+        if cached is not None:
+            return format_success_response({'context': cached})
+
+        prompt = f"Generate a brief context (maximum 70 words) for this image description:\n\n{alt_text}"
+        response = create_chat_completion(
             model=GPT_CONFIG["model"],
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that provides concise context for images. Keep responses under 50 words."},
@@ -29,6 +37,7 @@ def generate_context(alt_text):
         words = context.split()
         if len(words) > 70:
             context = ' '.join(words[:70]) + '...'
+        context_cache.store(alt_text, context)
         return format_success_response({'context': context})
     except Exception as e:
         return format_error_response(
@@ -39,13 +48,19 @@ def generate_context(alt_text):
 def enhance_context(context):
     """
     Enhances the context with additional details.
+    Enhancements of near-identical contexts are reused.
     Args:
         context (str): Original context to enhance
     Returns:
         dict: Response containing enhanced context
     """
     try:
-        openai = get_openai_client()
+        if not isinstance(context, str):
+            raise TypeError(f"context must be a string, not {type(context).__name__}")
+        cached = enhanced_context_cache.lookup(context)
+        if cached is not None:
+            return format_success_response({'enhanced_context': cached})
+
         prompt = f"""Enhance this context with more descriptive details while maintaining accuracy:
 
 Original: {context}
@@ -56,7 +71,7 @@ Requirements:
 3. Maintain factual accuracy
 4. Keep the enhanced version under 100 words"""
 
-        response = openai.ChatCompletion.create(
+        response = create_chat_completion(
             model=GPT_CONFIG["model"],
             messages=[
                 {"role": "system", "content": "You are a detail-oriented writer that enhances descriptions while maintaining accuracy."},
@@ -67,6 +82,7 @@ Requirements:
         )
         
         enhanced = response.choices[0].message['content'].strip()
+        enhanced_context_cache.store(context, enhanced)
         return format_success_response({'enhanced_context': enhanced})
     except Exception as e:
         return format_error_response(
@@ -83,7 +99,6 @@ def social_media_caption(context):
         dict: Response containing caption and hashtags
     """
     try:
-        openai = get_openai_client()
         prompt = f"""Create an engaging social media caption with relevant hashtags based on this context:
 
 Context: {context}
@@ -94,7 +109,7 @@ Requirements:
 3. Maximum 2-3 sentences
 4. Include emojis where appropriate"""
 
-        response = openai.ChatCompletion.create(
+        response = create_chat_completion(
             model=GPT_CONFIG["model"],
             messages=[
                 {"role": "system", "content": "You are a social media expert that creates engaging captions."},
@@ -137,7 +152,8 @@ def analyze_sentiment(text):
             )
 
         try:
-            scores = analyzer.polarity_scores(text)
+            with span('vader.polarity_scores', text_length=len(text)):
+                scores = analyzer.polarity_scores(text)
         except Exception as e:
             logger.error(f"Error calculating sentiment scores: {str(e)}")
             return format_error_response(
@@ -184,7 +200,6 @@ def analyze_medical_image(image, alt_text):
                 error_code="MISSING_INPUT"
             )
 
-        openai = get_openai_client()
         prompt = f"""Analyze this medical image description and provide a detailed medical report:
 
 Image Description: {alt_text}
@@ -215,7 +230,7 @@ Please provide a comprehensive analysis following this exact format:
 Please maintain a professional, medical tone and be specific with anatomical terminology.
 If you cannot make specific observations, please provide general anatomical descriptions and standard medical imaging protocols."""
 
-        response = openai.ChatCompletion.create(
+        response = create_chat_completion(
             model="gpt-4",
             messages=[
                 {
@@ -0,0 +1,321 @@
+"""
+Bounded-memory analysis for very large images.
+
+Instead of decoding the whole image into one array, pixels are decoded in
+horizontal strips (or with reduced JPEG decoding) and the color statistics
+and quality metrics are accumulated incrementally. A downsampled preview is
+built along the way for captioning and dominant color clustering. Formats
+that cannot be decoded in parts (PNG, GIF, WebP, compressed TIFF) are
+decoded once in full and analyzed from a copy reduced to fit the ceiling,
+so they are only accepted while that full decode fits in the ceiling too;
+larger ones are rejected with IMAGE_TOO_LARGE.
+"""
+import math
+import logging
+
+import numpy as np
+from PIL import Image
+
+from app.utils.file_utils import ImageValidationError
+from config.config import COLOR_HISTOGRAM_BINS, TILED_ANALYSIS_MEMORY_CEILING, TILED_PREVIEW_MAX_SIDE
+
+logger = logging.getLogger(__name__)
+
+# Bytes PIL needs per pixel once an image is decoded to RGB
+DECODED_BYTES_PER_PIXEL = 4
+# Upper bound of the working memory used per strip pixel (PIL strip, HSV copy, bincount temporaries)
+STRIP_BYTES_PER_PIXEL = 64
+# Bytes per pixel of the raw modes that can be read strip by strip
+RAW_BYTES_PER_PIXEL = {
+    'L': 1,
+    'RGB': 3, 'BGR': 3,
+    'RGBX': 4, 'RGBA': 4, 'BGRX': 4, 'BGRA': 4, 'XBGR': 4, 'ABGR': 4
+}
+
+
+def estimate_decoded_bytes(size):
+    """Estimate the memory needed to decode an image of the given size to RGB"""
+    return size[0] * size[1] * DECODED_BYTES_PER_PIXEL
+
+
+def needs_tiling(size, memory_ceiling=TILED_ANALYSIS_MEMORY_CEILING):
+    """Check whether decoding an image of the given size in one piece would exceed the ceiling"""
+    return estimate_decoded_bytes(size) > memory_ceiling // 2
+
+
+def _full_decode_bytes(image):
+    """Memory to decode an image in full and convert it to a mode that reduce() supports"""
+    converted = image.mode not in ('L', 'LA', 'RGB', 'RGBA')
+    return estimate_decoded_bytes(image.size) * (2 if converted else 1)
+
+
+def check_within_ceiling(image, memory_ceiling=TILED_ANALYSIS_MEMORY_CEILING):
+    """
+    Check that an opened, not yet decoded image can be analyzed within the memory ceiling
+    Args:
+        image (PIL.Image): Opened image
+        memory_ceiling (int): Peak working memory, in bytes, the analysis may use
+    Raises:
+        ImageValidationError: IMAGE_TOO_LARGE if its decoder would need more than the ceiling
+    """
+    size = image.size
+    if not needs_tiling(size, memory_ceiling):
+        return
+    if image.format == 'JPEG':
+        # Decoded at up to 1/8 scale
+        fits = not needs_tiling((math.ceil(size[0] / 8), math.ceil(size[1] / 8)), memory_ceiling)
+    elif _raw_tile_layout(image) is not None:
+        fits = True
+    else:
+        # Decoded in full next to a copy reduced at least 2x (a quarter of the
+        # size); a quarter of the ceiling is left for the strips
+        fits = _full_decode_bytes(image) * 5 // 4 <= memory_ceiling * 3 // 4
+    if not fits:
+        raise ImageValidationError(
+            f"{size[0]}x{size[1]} {image.format} image is too large to analyze within the memory ceiling; "
+            f"very large images must be JPEG or uncompressed TIFF/BMP", 'IMAGE_TOO_LARGE')
+
+
+def build_quality_metrics(brightness, contrast, resolution):
+    """
+    Apply the quality thresholds of ImageProcessor.validate_image_quality
+    Args:
+        brightness (float): Mean pixel value
+        contrast (float): Standard deviation of pixel values
+        resolution (tuple): (width, height) of the full image
+    Returns:
+        dict: Quality metrics
+    """
+    quality_metrics = {
+        'brightness': float(brightness),
+        'contrast': float(contrast),
+        'resolution': tuple(resolution),
+        'is_valid': True,
+        'issues': []
+    }
+
+    if brightness < 30:
+        quality_metrics['issues'].append('Image too dark')
+    elif brightness > 225:
+        quality_metrics['issues'].append('Image too bright')
+
+    if contrast < 20:
+        quality_metrics['issues'].append('Low contrast')
+
+    if resolution[0] * resolution[1] < 200 * 200:
+        quality_metrics['issues'].append('Resolution too low')
+
+    quality_metrics['is_valid'] = len(quality_metrics['issues']) == 0
+    return quality_metrics
+
+
+class ColorStatsAccumulator:
+    """
+    Incrementally accumulates color statistics and quality metrics over strips.
+    Args:
+        size (tuple): Full (width, height) of the image
+        bins (int): Number of histogram bins per channel
+        preview_max_side (int): Longest side of the downsampled preview
+    """
+
+    def __init__(self, size, bins=COLOR_HISTOGRAM_BINS, preview_max_side=TILED_PREVIEW_MAX_SIDE):
+        self.size = size
+        self.bins = bins
+        self.pixel_count = 0
+        self.channel_sums = np.zeros(3, dtype=np.float64)
+        self.value_sum = 0.0
+        self.value_sq_sum = 0.0
+        self.histogram_counts = np.zeros((6, bins), dtype=np.int64)
+        self._bin_lut = ((np.arange(256) * bins) // 256).astype(np.uint8)
+
+        scale = min(1.0, preview_max_side / max(size))
+        self.preview_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        self.preview = Image.new('RGB', self.preview_size)
+
+    def update(self, strip, top, source_height=None):
+        """
+        Add one RGB strip to the statistics.
+        Args:
+            strip (PIL.Image): RGB strip spanning the full image width
+            top (int): Row of the strip in the source image
+            source_height (int): Height of the image the strip was taken from, if
+                it was decoded at a reduced scale
+        """
+        source_height = source_height or self.size[1]
+        pixels = np.asarray(strip).reshape(-1, 3)
+        hsv_pixels = np.asarray(strip.convert('HSV')).reshape(-1, 3)
+
+        self.pixel_count += len(pixels)
+        self.channel_sums += pixels.sum(axis=0, dtype=np.float64)
+        self.value_sum += float(pixels.sum(dtype=np.float64))
+        self.value_sq_sum += float(np.einsum('ij,ij->', pixels, pixels, dtype=np.float64))
+
+        for channel in range(3):
+            self.histogram_counts[channel] += np.bincount(self._bin_lut[pixels[:, channel]], minlength=self.bins)
+            self.histogram_counts[channel + 3] += np.bincount(self._bin_lut[hsv_pixels[:, channel]], minlength=self.bins)
+
+        # Paste the downsampled strip into the preview
+        preview_top = top * self.preview_size[1] // source_height
+        preview_bottom = (top + strip.size[1]) * self.preview_size[1] // source_height
+        if preview_bottom > preview_top:
+            reduced = strip.resize((self.preview_size[0], preview_bottom - preview_top), Image.BOX)
+            self.preview.paste(reduced, (0, preview_top))
+
+    def histogram(self):
+        """Return the normalized RGB/HSV histogram in the color analysis format"""
+        histogram = self.histogram_counts / max(self.pixel_count, 1)
+        return {
+            'bin_edges': np.linspace(0, 256, self.bins + 1).tolist(),
+            'rgb': {name: histogram[i].tolist() for i, name in enumerate(('r', 'g', 'b'))},
+            'hsv': {name: histogram[i + 3].tolist() for i, name in enumerate(('h', 's', 'v'))}
+        }
+
+    def distribution(self):
+        """Return the mean value of each RGB channel"""
+        return (self.channel_sums / max(self.pixel_count, 1)).tolist()
+
+    def quality_metrics(self):
+        """
+        Return quality metrics matching ImageProcessor.validate_image_quality
+        Returns:
+            dict: Quality metrics
+        """
+        value_count = max(self.pixel_count * 3, 1)
+        brightness = self.value_sum / value_count
+        contrast = math.sqrt(max(self.value_sq_sum / value_count - brightness ** 2, 0.0))
+
+        return build_quality_metrics(brightness, contrast, self.size)
+
+
+def _strip_rows(width, height, memory_ceiling, preview_height):
+    """Number of rows decoded per strip so one strip stays well under the ceiling"""
+    budget = memory_ceiling // 4
+    rows = max(1, budget // (width * STRIP_BYTES_PER_PIXEL))
+    # Keep strips at least one preview row tall so none are dropped from the preview
+    rows = max(rows, math.ceil(height / preview_height))
+    return min(rows, height)
+
+
+def _iter_decoded_strips(image, rows):
+    """Yield (top, strip) crops of an image that has been decoded in memory"""
+    for top in range(0, image.size[1], rows):
+        bottom = min(top + rows, image.size[1])
+        yield top, image.crop((0, top, image.size[0], bottom)).convert('RGB')
+
+
+def _raw_tile_layout(image):
+    """
+    Describe the raw, full-width tiles of an uncompressed image (PPM, BMP, TIFF).
+    Returns:
+        list: (top, bottom, offset, rawmode, stride, orientation) per tile, or None
+            if the image cannot be read strip by strip
+    """
+    if image.mode not in ('L', 'RGB') or not image.tile:
+        return None
+
+    layout = []
+    for decoder, extents, offset, args in image.tile:
+        if decoder != 'raw':
+            return None
+        x0, y0, x1, y1 = extents
+        if x0 != 0 or x1 != image.size[0]:
+            return None
+
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if rawmode not in RAW_BYTES_PER_PIXEL:
+            return None
+        if not stride:
+            stride = image.size[0] * RAW_BYTES_PER_PIXEL[rawmode]
+        layout.append((y0, y1, offset, rawmode, stride, orientation))
+    return sorted(layout)
+
+
+def _iter_raw_strips(image, fp, layout, rows):
+    """Yield (top, strip) pairs read directly from the raw pixel data of a file"""
+    width = image.size[0]
+    for tile_top, tile_bottom, offset, rawmode, stride, orientation in layout:
+        tile_height = tile_bottom - tile_top
+        for top in range(tile_top, tile_bottom, rows):
+            bottom = min(top + rows, tile_bottom)
+            strip_height = bottom - top
+            if orientation < 0:
+                # Bottom-up rows: the strip's last row is stored first
+                first_row = tile_height - (bottom - tile_top)
+            else:
+                first_row = top - tile_top
+            fp.seek(offset + first_row * stride)
+            data = fp.read(strip_height * stride)
+            if len(data) < strip_height * stride:
+                raise ValueError("Image data is truncated")
+            strip = Image.frombuffer(image.mode, (width, strip_height), data, 'raw', rawmode, stride, orientation)
+            yield top, strip.convert('RGB')
+
+
+def analyze_image_tiled(source, memory_ceiling=TILED_ANALYSIS_MEMORY_CEILING, bins=COLOR_HISTOGRAM_BINS):
+    """
+    Accumulate color statistics and quality metrics without decoding the full image at once.
+    Args:
+        source: Path or binary file object of the image
+        memory_ceiling (int): Peak working memory, in bytes, the analysis may use
+        bins (int): Number of histogram bins per channel
+    Returns:
+        ColorStatsAccumulator: Accumulated statistics, including the downsampled preview
+    """
+    image = Image.open(source)
+    size = image.size
+    check_within_ceiling(image, memory_ceiling)
+    accumulator = ColorStatsAccumulator(size, bins=bins)
+    preview_height = accumulator.preview_size[1]
+
+    if not needs_tiling(size, memory_ceiling):
+        image.load()
+        rows = _strip_rows(size[0], size[1], memory_ceiling, preview_height)
+        for top, strip in _iter_decoded_strips(image, rows):
+            accumulator.update(strip, top)
+        return accumulator
+
+    if image.format == 'JPEG':
+        # Let libjpeg decode at the smallest of 1/2, 1/4 or 1/8 scale that fits;
+        # draft() can only be applied once per opened image
+        for scale in (2, 4, 8):
+            draft_size = (math.ceil(size[0] / scale), math.ceil(size[1] / scale))
+            if not needs_tiling(draft_size, memory_ceiling):
+                break
+        image.draft('RGB', draft_size)
+
+        logger.info(f"Decoding {size[0]}x{size[1]} JPEG at reduced size {image.size[0]}x{image.size[1]}")
+        image.load()
+        rows = _strip_rows(image.size[0], image.size[1], memory_ceiling, preview_height)
+        for top, strip in _iter_decoded_strips(image, rows):
+            accumulator.update(strip, top, source_height=image.size[1])
+        return accumulator
+
+    layout = _raw_tile_layout(image)
+    if layout is None:
+        # The decoder needs the whole image at once; check_within_ceiling made sure it fits
+        factor = 1
+        while needs_tiling((math.ceil(size[0] / factor), math.ceil(size[1] / factor)), memory_ceiling):
+            factor += 1
+        logger.warning(f"Decoding {size[0]}x{size[1]} {image.format} in full, then reducing {factor}x")
+        if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        reduced = image.reduce(factor).convert('RGB')
+        image = None
+        rows = _strip_rows(reduced.size[0], reduced.size[1], memory_ceiling, preview_height)
+        for top, strip in _iter_decoded_strips(reduced, rows):
+            accumulator.update(strip, top, source_height=reduced.size[1])
+        return accumulator
+
+    rows = _strip_rows(size[0], size[1], memory_ceiling, preview_height)
+    if isinstance(source, str):
+        with open(source, 'rb') as fp:
+            for top, strip in _iter_raw_strips(image, fp, layout, rows):
+                accumulator.update(strip, top)
+    else:
+        for top, strip in _iter_raw_strips(image, source, layout, rows):
+            accumulator.update(strip, top)
+    return accumulator
@@ -0,0 +1,283 @@
+"""
+Text-to-speech with pluggable engines and a content-addressed audio cache.
+
+Audio is stored on disk under the SHA-256 of (engine, lang, text), so the
+same alt text is synthesized once and then served from the cache. The cache
+is bounded in bytes and evicts the least recently used files. Worker
+processes share the directory: a file written by one is adopted by the
+others when they look it up, and the byte bound applies to the directory,
+which is rescanned before evicting, with each file's last use kept in its atime.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
+import math
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import wave
+import logging
+
+from gtts import gTTS
+
+from config.config import TTS_ENGINE, TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class TTSEngine(ABC):
+    """
+    Interface of a speech synthesis engine.
+    Subclasses set name, mimetype and extension and implement synthesize().
+    """
+    name = None
+    mimetype = None
+    extension = None
+
+    @abstractmethod
+    def synthesize(self, text, lang, fp):
+        """
+        Write the spoken text to a binary file object
+        Args:
+            text (str): Text to speak
+            lang (str): Language code, e.g. 'en'
+            fp: Binary file object the audio is written to
+        """
+
+
+class GTTSEngine(TTSEngine):
+    """Google Translate text-to-speech; needs network access"""
+    name = 'gtts'
+    mimetype = 'audio/mpeg'
+    extension = 'mp3'
+
+    def synthesize(self, text, lang, fp):
+        gTTS(text=text, lang=lang).write_to_fp(fp)
+
+
+class OfflineToneEngine(TTSEngine):
+    """
+    Local stand-in engine for tests and offline development.
+    Writes a short tone per word as 16-bit mono WAV, so output length follows the text.
+    """
+    name = 'offline'
+    mimetype = 'audio/wav'
+    extension = 'wav'
+    sample_rate = 16000
+    word_seconds = 0.25
+
+    def synthesize(self, text, lang, fp):
+        samples_per_word = int(self.sample_rate * self.word_seconds)
+        frames = bytearray()
+        for word in text.split():
+            frequency = 220 + (sum(map(ord, word)) % 440)
+            for i in range(samples_per_word):
+                # Fade each word in and out so the tones are separated
+                envelope = min(1.0, i / 400, (samples_per_word - i) / 400)
+                value = int(8000 * envelope * math.sin(2 * math.pi * frequency * i / self.sample_rate))
+                frames += struct.pack('<h', value)
+
+        with wave.open(fp, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(bytes(frames))
+
+
+TTS_ENGINES = {engine.name: engine for engine in (GTTSEngine, OfflineToneEngine)}
+AUDIO_MIMETYPES = {engine.extension: engine.mimetype for engine in TTS_ENGINES.values()}
+AUDIO_FILENAME = re.compile(r'([0-9a-f]{64})\.(\w+)')
+
+
+def get_tts_engine(name=TTS_ENGINE):
+    """
+    Instantiate a registered engine
+    Args:
+        name (str): Key of TTS_ENGINES
+    Returns:
+        TTSEngine: The engine
+    """
+    if name not in TTS_ENGINES:
+        raise ValueError(f"Unknown TTS engine '{name}'. Available: {', '.join(TTS_ENGINES)}")
+    return TTS_ENGINES[name]()
+
+
+class AudioCache:
+    """
+    Size-bounded, content-addressed audio files on disk with LRU eviction.
+    Args:
+        directory (str): Cache directory
+        max_bytes (int): Total size of cached files before the least recently used are evicted
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        # Absolute, since send_file resolves relative paths against the app root
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._total = 0
+        self._scan()
+
+    def _scan(self):
+        """Re-index the files in the directory, including other processes' files, least recently used first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Evicted by another process meanwhile
+            if os.path.isfile(path):
+                entries.append((stat.st_atime, path, stat.st_size))
+        self._files = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self._total = sum(self._files.values())
+
+    @staticmethod
+    def key(engine, lang, text):
+        """Content address of the audio for (engine, lang, text)"""
+        return hashlib.sha256('\0'.join((engine, lang, text)).encode('utf-8')).hexdigest()
+
+    def path_for(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def get(self, path):
+        """Return path if it is cached, marking it as recently used"""
+        with self._lock:
+            if path in self._files:
+                if not os.path.exists(path):
+                    self._total -= self._files.pop(path)
+                    return None
+                self._files.move_to_end(path)
+            else:
+                # Possibly written by another worker process since the last scan
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                self._files[path] = size
+                self._total += size
+        try:
+            # Record the use in atime for the next process's eviction order;
+            # mtime is left alone since it feeds the ETag
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return path
+
+    def get_or_create(self, path, write):
+        """
+        Return a cached file, creating it with write(fp) on a miss.
+        Concurrent misses for the same path run write() only once.
+        Returns:
+            tuple: (path, True if it was already cached)
+        """
+        if self.get(path):
+            return path, True
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, threading.Lock())
+        with key_lock:
+            if self.get(path):
+                return path, True
+            try:
+                fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+                try:
+                    with os.fdopen(fd, 'wb') as fp:
+                        write(fp)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                self._add(path, os.path.getsize(path))
+            finally:
+                with self._lock:
+                    self._key_locks.pop(path, None)
+        return path, False
+
+    def _add(self, path, size):
+        with self._lock:
+            # Other processes add to (and evict from) the same directory
+            self._scan()
+            self._total += size - self._files.pop(path, 0)
+            self._files[path] = size
+            while self._total > self.max_bytes and len(self._files) > 1:
+                evicted, evicted_size = self._files.popitem(last=False)
+                self._total -= evicted_size
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+
+    @property
+    def total_bytes(self):
+        return self._total
+
+    def __len__(self):
+        return len(self._files)
+
+
+class TextToSpeechService:
+    """
+    Cached speech synthesis.
+    Args:
+        engine (TTSEngine): Engine used on cache misses
+        cache (AudioCache): Audio cache
+    """
+
+    def __init__(self, engine=None, cache=None):
+        self.engine = engine if engine is not None else get_tts_engine()
+        self.cache = cache if cache is not None else AudioCache()
+
+    def synthesize(self, text, lang='en'):
+        """
+        Return the audio file for text, synthesizing it on a cache miss
+        Args:
+            text (str): Text to speak
+            lang (str): Language code
+        Returns:
+            tuple: (path, mimetype, True if served from the cache)
+        """
+        key = AudioCache.key(self.engine.name, lang, text)
+        path = self.cache.path_for(key, self.engine.extension)
+        path, cached = self.cache.get_or_create(path, lambda fp: self.engine.synthesize(text, lang, fp))
+        if not cached:
+            logger.info(f"Synthesized {len(text)} characters with {self.engine.name}")
+        return path, self.engine.mimetype, cached
+
+    def cached_audio(self, filename):
+        """
+        Look up previously synthesized audio by its cache file name
+        Args:
+            filename (str): '<sha256>.<extension>' as returned by synthesize()
+        Returns:
+            tuple: (path, mimetype), or None if it is not cached
+        """
+        match = AUDIO_FILENAME.fullmatch(filename)
+        if not match or match.group(2) not in AUDIO_MIMETYPES:
+            return None
+        path = self.cache.get(self.cache.path_for(match.group(1), match.group(2)))
+        if path is None:
+            return None
+        return path, AUDIO_MIMETYPES[match.group(2)]
+
+
+_tts_service = None
+_tts_lock = threading.Lock()
+
+
+def get_tts_service():
+    """Return the process-wide text-to-speech service, creating it on first use"""
+    global _tts_service
+    with _tts_lock:
+        if _tts_service is None:
+            _tts_service = TextToSpeechService()
+        return _tts_service
@@ -1,5 +1,75 @@
-import imghdr
-from config.config import ALLOWED_EXTENSIONS
+from collections import namedtuple
+import hashlib
+import logging
+import os
+import tempfile
+from flask import Request
+from PIL import Image
+from config.config import (
+    ALLOWED_EXTENSIONS,
+    UPLOAD_SPILL_THRESHOLD,
+    MEDICAL_MAX_CONTENT_LENGTH,
+    IMAGE_MAX_PIXELS,
+    IMAGE_MAX_SIDE,
+    IMAGE_MAX_COMPRESSION_RATIO,
+    KEYFRAME_SCAN_FRAMES
+)
+from app.utils.tracing import span, traced
+
+logger = logging.getLogger(__name__)
+
+# Endpoints accepting whole medical studies, which may exceed MAX_CONTENT_LENGTH
+LARGE_UPLOAD_ENDPOINTS = {'main.analyze_medical_image_route'}
+
+# Sniffed format -> the only Pillow plugin allowed to parse it
+PIL_FORMATS = {
+    'png': 'PNG',
+    'jpg': 'JPEG',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'tiff': 'TIFF',
+    'webp': 'WEBP'
+}
+
+# Images smaller than this when decoded are never treated as bombs, however well they compress
+BOMB_CHECK_MIN_BYTES = 64 * 1024 * 1024
+
+SNIFF_BYTES = 16
+
+# Parsed header of a validated image. image is opened lazily on the stream:
+# its pixels are only decoded when decode_image (or image.load()) is called.
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'mode', 'image'])
+
+
+class ImageValidationError(ValueError):
+    """
+    Raised when an upload is not an image we are willing to decode.
+    Args:
+        message (str): Reason, safe to show to the client
+        code (str): Error code for the JSON response
+    """
+
+    def __init__(self, message, code='INVALID_IMAGE'):
+        super().__init__(message)
+        self.code = code
+
+
+class SpooledUploadRequest(Request):
+    """
+    Request class that keeps uploaded files in memory.
+    Werkzeug spools uploads larger than 500 KB to a temporary file; here they
+    stay in memory up to UPLOAD_SPILL_THRESHOLD bytes and only larger uploads
+    spill to disk. Medical studies may be up to MEDICAL_MAX_CONTENT_LENGTH.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPILL_THRESHOLD, mode='rb+')
+
+    @property
+    def max_content_length(self):
+        if self.endpoint in LARGE_UPLOAD_ENDPOINTS:
+            return MEDICAL_MAX_CONTENT_LENGTH
+        return super().max_content_length
 
 def allowed_file(filename, allowed_extensions=None):
     """
@@ -22,31 +92,157 @@ def allowed_file(filename, allowed_extensions=None):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in extensions
 
+def read_image_header(stream):
+    """
+    Identify an image from its magic bytes and parse its header, without decoding pixels.
+    Decompression bombs and oversized images are rejected here, before any pixel buffer is allocated.
+    Args:
+        stream: Seekable binary stream
+    Returns:
+        ImageHeader: Format, size and mode, plus the lazily opened image for decode_image
+    Raises:
+        ImageValidationError: If the stream is not a supported image or is too large to decode
+    """
+    stream.seek(0)
+    format = sniff_image_format(stream.read(SNIFF_BYTES))
+    if format is None:
+        raise ImageValidationError("Unrecognized image format")
+
+    stream.seek(0, os.SEEK_END)
+    file_size = stream.tell()
+    stream.seek(0)
+    try:
+        image = Image.open(stream, formats=[PIL_FORMATS[format]])
+    except Image.DecompressionBombError as e:
+        raise ImageValidationError(str(e), 'IMAGE_TOO_LARGE')
+    except Exception as e:
+        raise ImageValidationError(f"Unreadable {format} header: {str(e)}")
+
+    width, height = image.size
+    if width <= 0 or height <= 0:
+        raise ImageValidationError("Image has no pixels")
+    if max(width, height) > IMAGE_MAX_SIDE:
+        raise ImageValidationError(f"Image is {width}x{height}; sides are limited to {IMAGE_MAX_SIDE} pixels",
+                                   'IMAGE_TOO_LARGE')
+    # Animated GIFs and multi-page TIFFs have every frame decoded, up to the keyframe scan budget
+    try:
+        frames = min(getattr(image, 'n_frames', 1), KEYFRAME_SCAN_FRAMES)
+    except Exception as e:
+        raise ImageValidationError(f"Unreadable {format} frames: {str(e)}")
+    pixels = width * height * frames
+    if pixels > IMAGE_MAX_PIXELS:
+        raise ImageValidationError(f"Image has {pixels} pixels in {frames} frame(s); the limit is {IMAGE_MAX_PIXELS}",
+                                   'IMAGE_TOO_LARGE')
+    decoded_bytes = pixels * len(image.getbands())
+    if decoded_bytes > BOMB_CHECK_MIN_BYTES and decoded_bytes > file_size * IMAGE_MAX_COMPRESSION_RATIO:
+        raise ImageValidationError(f"Image would expand from {file_size} to {decoded_bytes} bytes",
+                                   'IMAGE_TOO_LARGE')
+
+    return ImageHeader(format, width, height, image.mode, image)
+
+
+@traced('validate_image')
 def validate_image(input_data):
     """
     Validate if the input is a valid image.
     Args:
         input_data: Either a file stream or a PIL Image object
     Returns:
-        str: The image format extension if valid, None otherwise
+        ImageHeader: Parsed header if valid (pass it on to decode_image), None otherwise
     """
     try:
         if hasattr(input_data, 'read'):  # If it's a file stream
-            header = input_data.read(512)
-            input_data.seek(0)
-            format = imghdr.what(None, header)
-        else:  # If it's a PIL Image
-            format = input_data.format.lower() if input_data.format else None
-            
+            return read_image_header(input_data)
+
+        # If it's a PIL Image
+        format = input_data.format.lower() if input_data.format else None
         if not format:
             return None
-            
-        # Normalize format name
-        if format == 'jpeg':
-            format = 'jpg'
-        return '.' + format
+        return ImageHeader('jpg' if format == 'jpeg' else format, input_data.width, input_data.height,
+                           input_data.mode, input_data)
+    except ImageValidationError as e:
+        logger.warning(f"Rejected image: {str(e)}")
+        return None
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error validating image: {str(e)}")
-        return None 
\ No newline at end of file
+        return None
+
+def compute_image_hash(input_data, chunk_size=64 * 1024):
+    """
+    Compute a SHA-256 content hash of an uploaded image.
+    Args:
+        input_data: A file stream or bytes
+        chunk_size (int): Number of bytes read at a time from streams
+    Returns:
+        str: Hex digest of the image content
+    """
+    digest = hashlib.sha256()
+    if isinstance(input_data, (bytes, bytearray)):
+        digest.update(input_data)
+    else:
+        position = input_data.tell()
+        for chunk in iter(lambda: input_data.read(chunk_size), b''):
+            digest.update(chunk)
+        input_data.seek(position)
+    return digest.hexdigest()
+
+
+def open_upload_image(file, header=None):
+    """
+    Open and decode an uploaded image directly from its stream, without saving it first.
+    Args:
+        file (FileStorage): Uploaded file
+        header (ImageHeader): Result of validate_image on the upload, if already available
+    Returns:
+        PIL.Image: Decoded image
+    """
+    return decode_image(file.stream, header)
+
+
+def decode_image(stream, header=None):
+    """
+    Decode an image from the start of a stream, traced as one span
+    Args:
+        stream: Seekable binary stream
+        header (ImageHeader): Header already read from the stream by validate_image;
+            read (and checked) here if not given
+    Returns:
+        PIL.Image: Decoded image
+    Raises:
+        ImageValidationError: If the stream is not an image we are willing to decode
+    """
+    with span('decode_image') as decode:
+        if header is None:
+            header = read_image_header(stream)
+        image = header.image
+        image.load()
+        decode.set_attributes({'image.format': image.format, 'image.width': image.width, 'image.height': image.height})
+        return image
+
+
+# Leading bytes of the image formats we accept from remote sources
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff')
+)
+
+
+def sniff_image_format(header):
+    """
+    Identify an image format from its leading bytes.
+    Args:
+        header (bytes): At least the first 12 bytes of the file
+    Returns:
+        str: Format extension (e.g. 'png'), or None if not a recognized image
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for signature, format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return format
+    return None
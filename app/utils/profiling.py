@@ -0,0 +1,266 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries the admin header (X-Profile set to
+PROFILE_TOKEN) or is picked at PROFILE_SAMPLE_RATE. Its thread runs under
+cProfile, pipeline stages it fans out to get their own profilers, and every
+model.generate call inside it is recorded with torch.profiler. Results are
+written to PROFILE_DIR as a .pstats file (open with pstats or snakeviz) and
+one Chrome trace per generate call (chrome://tracing or Perfetto); the
+profile ID is returned in the X-Profile-Id response header. The oldest
+dumps are deleted beyond PROFILE_MAX_FILES. torch.profiler records one
+generate call at a time per process; a profiled call that overlaps another
+gets no torch trace.
+
+With sampling off and no token configured no hooks are installed, and the
+model wrapper costs one context variable lookup.
+"""
+from contextlib import contextmanager
+import contextvars
+import cProfile
+import hmac
+import itertools
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+import logging
+
+from flask import request, g
+
+from config.config import PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_DIR, PROFILE_MAX_FILES, PROFILE_TORCH
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+
+
+class ProfileSession:
+    """
+    Profilers of one request, merged into a single dump when it ends.
+    Args:
+        label (str): Route endpoint, used in file names
+        directory (str): Where dumps are written
+    """
+
+    def __init__(self, label, directory=PROFILE_DIR):
+        self.id = uuid.uuid4().hex[:12]
+        self.directory = os.path.abspath(directory)
+        self.prefix = f"{time.strftime('%Y%m%dT%H%M%S')}-{self.id}-{re.sub(r'[^A-Za-z0-9_.-]', '_', label)}"
+        self._profiles = []
+        self._traces = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_thread_profile(self):
+        """
+        Start a cProfile profiler in the calling thread
+        Returns:
+            cProfile.Profile: The running profiler, or None if another one is active
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile per process
+            logger.debug("Another profiler is active; skipping CPU profile")
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def trace_path(self, name):
+        """Path for the next Chrome trace of this session"""
+        return os.path.join(self.directory, f"{self.prefix}-{next(self._traces)}-{name}.trace.json")
+
+    def dump(self):
+        """
+        Write the merged CPU profile and rotate the directory
+        Returns:
+            str: Path of the .pstats file, or None if nothing was profiled
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.prefix}.pstats")
+        stats.dump_stats(path)
+        rotate(self.directory)
+        return path
+
+
+def rotate(directory, max_files=PROFILE_MAX_FILES):
+    """Delete the oldest dumps beyond max_files"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except FileNotFoundError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+# Copied into pipeline threads with contextvars.copy_context()
+_session = contextvars.ContextVar('profile_session', default=None)
+# Forward markers opened by the torch-profiled block of the current context
+_markers = contextvars.ContextVar('profile_markers', default=None)
+# Held while torch.profiler is recording
+_torch_lock = threading.Lock()
+
+
+def active_session():
+    """ProfileSession of the current request, or None"""
+    return _session.get()
+
+
+def profile_thread(func, *args, **kwargs):
+    """
+    Call func, profiling it if the current context belongs to a profiled request.
+    For work a request hands to other threads (cProfile only sees its own thread).
+    """
+    session = _session.get()
+    if session is None:
+        return func(*args, **kwargs)
+
+    profile = session.start_thread_profile()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if profile is not None:
+            profile.disable()
+
+
+@contextmanager
+def torch_profile(name, modules=None):
+    """
+    Record the block with torch.profiler when the request is profiled,
+    and write it as a Chrome trace.
+    Args:
+        name (str): Label of the block and part of the trace file name
+        modules (dict): Label -> torch.nn.Module whose forward passes are
+            marked in the trace, e.g. a model's encoder and decoder
+    """
+    session = _session.get()
+    if session is None or not PROFILE_TORCH:
+        yield
+        return
+    # torch.profiler allows one session per process
+    if not _torch_lock.acquire(blocking=False):
+        logger.debug("Another torch profile is recording; skipping torch profile")
+        yield
+        return
+
+    try:
+        import torch
+        from torch.profiler import profile, record_function, ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        # The modules are shared with concurrent, unprofiled requests; their
+        # forward passes run in other contexts, where no marker stack is set
+        def pre_hook(label):
+            def hook(module, inputs):
+                markers = _markers.get()
+                if markers is not None:
+                    marker = record_function(label)
+                    marker.__enter__()
+                    markers.append(marker)
+            return hook
+
+        def post_hook(module, inputs, outputs):
+            markers = _markers.get()
+            if markers:
+                markers.pop().__exit__(None, None, None)
+
+        handles = []
+        for label, module in (modules or {}).items():
+            handles.append(module.register_forward_pre_hook(pre_hook(label)))
+            handles.append(module.register_forward_hook(post_hook))
+
+        markers_token = _markers.set([])
+        try:
+            with profile(activities=activities) as prof:
+                with record_function(name):
+                    yield
+        finally:
+            for handle in handles:
+                handle.remove()
+            _markers.reset(markers_token)
+    finally:
+        _torch_lock.release()
+
+    try:
+        os.makedirs(session.directory, exist_ok=True)
+        prof.export_chrome_trace(session.trace_path(name))
+        rotate(session.directory)
+    except Exception as e:
+        logger.error(f"Error writing torch profile: {str(e)}")
+
+
+def _should_profile():
+    if PROFILE_TOKEN:
+        token = request.headers.get(PROFILE_HEADER)
+        if token and hmac.compare_digest(token, PROFILE_TOKEN):
+            return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start_request_profile():
+    if not _should_profile():
+        return
+    session = ProfileSession(request.endpoint or 'unknown')
+    g.profile_token = _session.set(session)
+    g.profile = session.start_thread_profile()
+
+
+def _finish_request_profile(response):
+    session = _session.get()
+    if session is None:
+        return response
+
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+    try:
+        path = session.dump()
+        if path:
+            logger.info(f"Profiled {request.method} {request.path}: {path}")
+    except Exception as e:
+        logger.error(f"Error writing request profile: {str(e)}")
+    response.headers['X-Profile-Id'] = session.id
+    return response
+
+
+def _end_request_profile(exc):
+    token = g.pop('profile_token', None)
+    if token is not None:
+        # Disable the profiler if the request failed before after_request ran
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+        _session.reset(token)
+
+
+def init_profiling(app):
+    """Install the profiling hooks, unless profiling cannot be triggered"""
+    if PROFILE_SAMPLE_RATE <= 0 and not PROFILE_TOKEN:
+        return
+    app.before_request(_start_request_profile)
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_end_request_profile)
+    logger.info(f"Request profiling enabled (sample rate {PROFILE_SAMPLE_RATE}, "
+                f"admin header {'on' if PROFILE_TOKEN else 'off'}), writing to {os.path.abspath(PROFILE_DIR)}")
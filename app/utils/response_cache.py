@@ -0,0 +1,145 @@
+"""
+HTTP-level caching of JSON analysis responses.
+
+The ETag of a POST is derived from the route, the content hash of every
+uploaded file and the form parameters, so it is known before any work is
+done. Identical resubmissions within the route's TTL get the stored JSON
+back (or 304 Not Modified when the client sends the ETag in If-None-Match)
+without running BLIP or calling OpenAI. Only complete results are stored:
+each route says what a successful body looks like, and a route that built
+its response from a failed intermediate result (e.g. a context generated
+from failed alt text) keeps it out with skip_response_cache().
+"""
+import functools
+import hashlib
+import time
+
+from flask import request, make_response, current_app, g
+
+from app.utils.cache_utils import LRUCache
+from app.utils.file_utils import compute_image_hash
+from config.config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTLS, RESPONSE_CACHE_DEFAULT_TTL
+
+
+class ResponseCache:
+    """
+    Size-bounded store of response bodies keyed by ETag, each with its own expiry.
+    Args:
+        max_size (int): Maximum number of responses kept
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self._store = LRUCache(max_size)
+
+    def get(self, etag):
+        """
+        Return the live entry for an ETag
+        Returns:
+            tuple: (expires_at, body, status, mimetype), or None if missing or expired
+        """
+        entry = self._store.get(etag)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._store.pop(etag)
+            return None
+        return entry
+
+    def set(self, etag, ttl, body, status, mimetype):
+        self._store.set(etag, (time.time() + ttl, body, status, mimetype))
+
+    def clear(self):
+        self._store.clear()
+
+    def __len__(self):
+        return len(self._store)
+
+# Create singleton instance
+response_cache = ResponseCache()
+
+
+def request_etag(route):
+    """
+    Compute the strong ETag of the current request
+    Args:
+        route (str): Name of the route, so identical inputs to different routes differ
+    Returns:
+        str: Unquoted ETag, or None if the request carries no uploaded file
+    """
+    files = [(name, file) for name, file in request.files.items(multi=True) if file.filename]
+    if not files:
+        return None
+
+    digest = hashlib.sha256(route.encode('utf-8'))
+    for name, file in sorted(files, key=lambda item: item[0]):
+        digest.update(f'\0file:{name}='.encode('utf-8'))
+        digest.update(compute_image_hash(file.stream).encode('ascii'))
+    for name, value in sorted(request.form.items(multi=True)):
+        digest.update(f'\0form:{name}={value}'.encode('utf-8'))
+    for name, value in sorted(request.args.items(multi=True)):
+        digest.update(f'\0arg:{name}={value}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def skip_response_cache():
+    """Keep the response of the current request out of the response cache"""
+    g.skip_response_cache = True
+
+
+def _is_cacheable(response, succeeded=None):
+    """Only successful JSON results are stored; some routes report errors with status 200"""
+    if response.status_code != 200 or response.mimetype != 'application/json' or response.is_streamed:
+        return False
+    if g.get('skip_response_cache'):
+        return False
+    data = response.get_json(silent=True)
+    if not isinstance(data, dict):
+        return False
+    if data.get('success') is False or data.get('error'):
+        return False
+    return succeeded is None or bool(succeeded(data))
+
+
+def cached_response(route, succeeded=None):
+    """
+    Decorator caching a route's POST responses by ETag for the route's TTL.
+    The TTL comes from RESPONSE_CACHE_TTLS[route]; 0 disables caching.
+    Args:
+        route (str): Key into RESPONSE_CACHE_TTLS and part of the ETag
+        succeeded (callable): Takes the JSON body and returns whether it is a
+            complete result; routes that report failures of nested services
+            with status 200 must pass one
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            ttl = RESPONSE_CACHE_TTLS.get(route, RESPONSE_CACHE_DEFAULT_TTL)
+            if request.method != 'POST' or ttl <= 0:
+                return view(*args, **kwargs)
+
+            etag = request_etag(route)
+            if etag is None:
+                return view(*args, **kwargs)
+
+            entry = response_cache.get(etag)
+            if entry is not None:
+                expires_at, body, status, mimetype = entry
+                if request.if_none_match.contains(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = current_app.response_class(body, status=status, mimetype=mimetype)
+                response.headers['X-Cache'] = 'HIT'
+                max_age = max(0, int(expires_at - time.time()))
+            else:
+                response = make_response(view(*args, **kwargs))
+                if not _is_cacheable(response, succeeded):
+                    return response
+                response_cache.set(etag, ttl, response.get_data(), response.status_code, response.mimetype)
+                response.headers['X-Cache'] = 'MISS'
+                max_age = ttl
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = f'private, max-age={max_age}'
+            return response
+        return wrapper
+    return decorator
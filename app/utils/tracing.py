@@ -0,0 +1,345 @@
+"""
+Request tracing and structured logging.
+
+Every request opens a root span carrying a request ID (X-Request-ID, or a
+generated one) and continues the caller's trace if it sends a W3C
+traceparent header. Code inside the request opens child spans with span()
+or @traced; the current span lives in a context variable, so pipeline and
+batch threads started with contextvars.copy_context() attach their spans to
+the request, and work sent to another process can continue the trace from
+current_traceparent().
+
+Finished spans go to the exporters named in TRACE_EXPORTER: 'console'
+(one JSON line per span on stderr) or 'otlp-file' (OTLP/JSON lines in
+TRACE_FILE, readable by the OpenTelemetry collector's otlpjsonfile
+receiver). Log records are formatted as JSON with the trace, span and
+request IDs of the code that logged them.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+import logging
+
+from flask import request, g
+
+from config.config import TRACE_EXPORTER, TRACE_FILE, TRACE_SERVICE_NAME, LOG_FORMAT
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+
+class Span:
+    """
+    One timed operation of a trace.
+    Args:
+        name (str): Operation name
+        trace_id (str): 32 hex digits shared by every span of the trace
+        parent_id (str): Span ID of the parent, or None for a root span
+        request_id (str): ID of the request the span belongs to
+        kind (str): 'internal' or 'server'
+        attributes (dict): Initial attributes
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, request_id=None, kind='internal', attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.request_id = request_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        """W3C traceparent header value for continuing the trace elsewhere"""
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        self.attributes.update(attributes)
+
+    def record_exception(self, exc):
+        self.error = f'{type(exc).__name__}: {exc}'
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            export(self)
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+# Copied into pipeline and batch threads with contextvars.copy_context()
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def current_span():
+    """The innermost open span of the current context, or None"""
+    return _current_span.get()
+
+
+def current_traceparent():
+    """traceparent of the current span, for work handed to another process"""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def start_span(name, parent=None, request_id=None, kind='internal', attributes=None):
+    """
+    Open a span and make it current
+    Args:
+        name (str): Operation name
+        parent (str): traceparent to continue; defaults to the current span
+        request_id (str): Request ID; defaults to the parent's
+        kind (str): 'internal' or 'server'
+        attributes (dict): Initial attributes
+    Returns:
+        tuple: (span, token) - pass both to finish_span
+    """
+    current = _current_span.get()
+    match = TRACEPARENT.match(parent) if parent else None
+    if match:
+        trace_id, parent_id = match.groups()
+    elif current is not None:
+        trace_id, parent_id = current.trace_id, current.span_id
+        request_id = request_id or current.request_id
+    else:
+        trace_id, parent_id = uuid.uuid4().hex, None
+
+    span = Span(name, trace_id, parent_id, request_id, kind, attributes)
+    return span, _current_span.set(span)
+
+
+def finish_span(span, token):
+    """End a span opened with start_span and restore the previous current span"""
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Ended in another context, e.g. after a streamed response
+        pass
+    span.end()
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Trace a block as a child of the current span
+    Args:
+        name (str): Operation name
+        parent (str): traceparent to continue instead, e.g. in a worker process
+        **attributes: Initial attributes
+    Yields:
+        Span: The open span, to add attributes to
+    """
+    opened, token = start_span(name, parent, attributes=attributes)
+    try:
+        yield opened
+    except BaseException as e:
+        opened.record_exception(e)
+        raise
+    finally:
+        finish_span(opened, token)
+
+
+def traced(name):
+    """Decorator tracing every call of a function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ConsoleSpanExporter:
+    """Writes one JSON line per span to stderr"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps({
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'request_id': span.request_id,
+            'name': span.name,
+            'start': datetime.fromtimestamp(span.start_ns / 1e9, timezone.utc).isoformat(),
+            'duration_ms': round(span.duration_ms, 3),
+            'status': 'error' if span.error else 'ok',
+            'error': span.error,
+            'attributes': span.attributes
+        }, default=str)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OTLPFileSpanExporter:
+    """
+    Appends spans to a file as OTLP/JSON, one ExportTraceServiceRequest per line.
+    Lines are written with a single append, so several processes can share the file.
+    Args:
+        path (str): File to append to
+    """
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        otlp_span = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 2 if span.kind == 'server' else 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)}
+                           for key, value in span.attributes.items() if value is not None],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        if span.request_id:
+            otlp_span['attributes'].append({'key': 'request.id', 'value': {'stringValue': span.request_id}})
+
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': TRACE_SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [otlp_span]}]
+        }]}) + '\n'
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+
+# Exporter name -> factory
+TRACE_EXPORTERS = {
+    'console': ConsoleSpanExporter,
+    'otlp-file': OTLPFileSpanExporter
+}
+
+_exporters = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters():
+    """Exporters named in TRACE_EXPORTER, created on first use"""
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            names = [name.strip() for name in TRACE_EXPORTER.split(',') if name.strip() and name.strip() != 'none']
+            unknown = [name for name in names if name not in TRACE_EXPORTERS]
+            if unknown:
+                raise ValueError(f"Unknown trace exporters: {', '.join(unknown)}. Supported: {', '.join(TRACE_EXPORTERS)}")
+            _exporters = [TRACE_EXPORTERS[name]() for name in names]
+        return _exporters
+
+
+def export(span):
+    for exporter in get_exporters():
+        try:
+            exporter.export(span)
+        except Exception as e:
+            logger.error(f"Error exporting span {span.name}: {str(e)}")
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats log records as JSON lines with the trace context of the logging code"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        span = _current_span.get()
+        if span is not None:
+            entry['trace_id'] = span.trace_id
+            entry['span_id'] = span.span_id
+            if span.request_id:
+                entry['request_id'] = span.request_id
+        if record.exc_info:
+            entry['exception'] = ''.join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=logging.INFO):
+    """Log to stderr as JSON (LOG_FORMAT=json) or plain text"""
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler])
+
+
+def _start_request_span():
+    route = request.url_rule.rule if request.url_rule else request.path
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    root, token = start_span(f'{request.method} {route}', request.headers.get('traceparent'), request_id, 'server', {
+        'http.method': request.method,
+        'http.route': route,
+        'http.target': request.full_path.rstrip('?')
+    })
+    g.trace_span = root
+    g.trace_token = token
+
+
+def _tag_response(response):
+    root = g.get('trace_span')
+    if root is not None:
+        root.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Request-ID'] = root.request_id
+        response.headers['X-Trace-Id'] = root.trace_id
+    return response
+
+
+def _end_request_span(exc):
+    root = g.pop('trace_span', None)
+    if root is None:
+        return
+    if exc is not None:
+        root.record_exception(exc)
+    finish_span(root, g.pop('trace_token'))
+
+
+def init_tracing(app):
+    """Open a root span around every request"""
+    app.before_request(_start_request_span)
+    app.after_request(_tag_response)
+    app.teardown_request(_end_request_span)
@@ -0,0 +1,38 @@
+"""
+Guards for URLs the server requests on a client's behalf.
+"""
+import ipaddress
+import socket
+from urllib.parse import urlsplit
+
+
+def check_public_url(url, allowed_hosts=frozenset(), name='URL'):
+    """
+    Reject URLs the server must not request. Hosts in allowed_hosts are
+    allowed as they are; any other host must resolve only to global
+    addresses, so requests cannot reach loopback, link-local (cloud
+    metadata) or private network services.
+    Args:
+        url (str): URL given by the client
+        allowed_hosts (set): Lower-case host names allowed on any address
+        name (str): What the URL is, for the error messages
+    Raises:
+        ValueError: If the URL is not http(s) or its host is not allowed
+    """
+    parsed = urlsplit(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError(f'{name} must be an http(s) URL')
+    host = parsed.hostname.lower()
+    if host in allowed_hosts:
+        return
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise ValueError(f'{name} host {host} cannot be resolved: {str(e)}')
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        ip = getattr(ip, 'ipv4_mapped', None) or ip
+        if not ip.is_global:
+            raise ValueError(f'{name} host {host} resolves to non-public address {ip}')
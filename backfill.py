@@ -0,0 +1,264 @@
+"""
+Offline alt text backfill for image libraries.
+
+Walks a directory (or reads a manifest of paths), generates alt text with
+BLIP and optionally the context and SEO enrichment for every image, and
+appends one record per image to a JSONL or CSV file. Images already present
+in the output are skipped, so an interrupted run resumes where it stopped;
+a record it was killed halfway through writing is dropped and redone.
+
+Usage:
+    python backfill.py assets/ --output alt_text.jsonl --enrich context seo --workers 4
+    python backfill.py --manifest images.txt --output alt_text.csv
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from app.utils.file_utils import allowed_file
+
+BACKFILL_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'webp'}
+ENRICHMENTS = ('context', 'seo')
+CSV_FIELDS = ['path', 'success', 'alt_text', 'context', 'seo', 'error', 'seconds']
+
+
+def iter_directory(root):
+    """Yield (path, path relative to root) for the images under root, in a stable order"""
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if allowed_file(filename, BACKFILL_EXTENSIONS):
+                path = os.path.join(directory, filename)
+                yield path, os.path.relpath(path, root)
+
+
+def iter_manifest(manifest):
+    """Yield (path, listed path) for a manifest of one path per line; relative paths are resolved against it"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            path = line.strip()
+            if path and not path.startswith('#'):
+                yield (path if os.path.isabs(path) else os.path.join(base, path)), path
+
+
+def truncate_partial_line(output, chunk_size=65536):
+    """
+    Cut an unterminated last line, left by a run killed mid-write, off the output
+    file, so the next record is not appended onto it
+    Returns:
+        int: Number of bytes removed
+    """
+    with open(output, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - chunk_size, 0)
+            f.seek(start)
+            chunk = f.read(position - start)
+            if position == end and chunk.endswith(b'\n'):
+                return 0
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        f.truncate(position)
+    print(f'warning: removed an incomplete last line ({end - position} bytes) from {output}',
+          file=sys.stderr, flush=True)
+    return end - position
+
+
+def iter_jsonl(f, name):
+    """Yield the records of a JSONL file, skipping lines that are not valid JSON with a warning"""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f'warning: skipping undecodable line {number} of {name}: {str(e)}',
+                  file=sys.stderr, flush=True)
+
+
+def load_processed(output, output_format):
+    """
+    Read the paths already processed successfully from an existing output file
+    Returns:
+        set: Paths to skip
+    """
+    processed = set()
+    if not os.path.exists(output):
+        return processed
+
+    truncate_partial_line(output)
+    with open(output, encoding='utf-8', errors='replace', newline='') as f:
+        if output_format == 'csv':
+            records = csv.DictReader(f)
+        else:
+            records = iter_jsonl(f, output)
+        for record in records:
+            if record.get('success') in (True, 'True'):
+                processed.add(record['path'])
+    return processed
+
+
+class ResultWriter:
+    """Append-only JSONL/CSV writer that flushes every record, so a crash loses nothing"""
+
+    def __init__(self, output, output_format):
+        self.output_format = output_format
+        is_new = not os.path.exists(output) or os.path.getsize(output) == 0
+        self._file = open(output, 'a', encoding='utf-8', newline='')
+        if output_format == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self.output_format == 'csv':
+            row = dict(record)
+            if isinstance(row.get('seo'), dict):
+                row['seo'] = json.dumps(row['seo'])
+            self._csv.writerow({field: row.get(field) for field in CSV_FIELDS})
+        else:
+            self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def init_worker(analyses, torch_threads):
+    """Process pool initializer: load the BLIP model once per worker"""
+    global _analyses, _analyze_image_bytes
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    # Importing the image service loads the model into this worker
+    import app.services.image_service
+    from app.services.batch_service import analyze_image_bytes
+    _analyze_image_bytes = analyze_image_bytes
+    _analyses = ['alt_text'] + list(analyses)
+
+
+def process_image(path, display_path):
+    """Worker task: caption and enrich one image"""
+    start = time.perf_counter()
+    record = {'path': display_path}
+    try:
+        with open(path, 'rb') as f:
+            results = _analyze_image_bytes(f.read(), _analyses)
+        record.update(success=True, **results)
+    except Exception as e:
+        record.update(success=False, error=str(e))
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+
+
+class ProgressReporter:
+    """Periodic throughput and ETA line on stderr"""
+
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._first = None
+        self._last = 0.0
+
+    def update(self, record, force=False):
+        now = time.monotonic()
+        if record is not None:
+            self.done += 1
+            self.failed += not record['success']
+            if self._first is None:
+                self._first = now
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self.start
+        # Measure throughput from the first result so model loading does not skew the ETA
+        steady = now - self._first if self._first is not None else 0.0
+        rate = (self.done - 1) / steady if self.done > 1 and steady > 0 else 0.0
+        eta = format_duration((self.total - self.done) / rate) if rate > 0 else '?'
+        print(f'{self.done}/{self.total} images ({self.failed} failed) | '
+              f'{rate:.2f} images/s | elapsed {format_duration(elapsed)} | ETA {eta}',
+              file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('directory', nargs='?', help='Directory scanned recursively for images')
+    source.add_argument('--manifest', help='Text file listing one image path per line')
+    parser.add_argument('--output', required=True, help='Output .jsonl or .csv file; appended to and resumed from')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help='Output format (default: from the extension)')
+    parser.add_argument('--enrich', nargs='*', choices=ENRICHMENTS, default=[],
+                        help='Enrichments to run after alt text (these call the OpenAI API)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='Worker processes, each holding one copy of the model')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    # Images are identified in the output by their path relative to the directory, or as listed
+    paths = list(iter_manifest(args.manifest) if args.manifest else iter_directory(args.directory))
+    processed = load_processed(args.output, output_format)
+    pending = [(path, display) for path, display in paths if display not in processed]
+    print(f'{len(paths)} images found, {len(paths) - len(pending)} already processed, {len(pending)} to go',
+          file=sys.stderr, flush=True)
+    if not pending:
+        return 0
+
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    writer = ResultWriter(args.output, output_format)
+    progress = ProgressReporter(len(pending), args.progress_interval)
+    # Spawned workers start clean instead of inheriting threads and locks from this process
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_worker, initargs=(args.enrich, torch_threads))
+    try:
+        tasks = iter(pending)
+        in_flight = set()
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep each worker busy without queueing the whole library up front
+            while not exhausted and len(in_flight) < args.workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                in_flight.add(pool.submit(process_image, *task))
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                writer.write(record)
+                progress.update(record)
+    except KeyboardInterrupt:
+        print('Interrupted; rerun the same command to resume', file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+        return 130
+    finally:
+        writer.close()
+    pool.shutdown()
+    progress.update(None, force=True)
+    return 0 if progress.failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
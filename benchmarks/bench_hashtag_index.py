@@ -0,0 +1,127 @@
+"""
+Latency and agreement of the local hashtag index.
+
+Trains a HashtagIndex on synthetic (context, LLM hashtags) pairs, then
+replays held-out contexts: for each confidence threshold it reports the
+share the index would answer (when a caption has no hashtags of its own)
+and how many of those recommended hashtags the LLM also chose. Held-out contexts include topics
+the index never saw, which should fall below the threshold. Replaying a
+real log (--log, the HASHTAG_LOG_PATH file) measures the same on recorded
+pairs, holding out the last --holdout of them.
+
+Usage:
+    python -m benchmarks.bench_hashtag_index [--train 5000] [--queries 2000] [--thresholds 0.3,0.4,0.5,0.6] [--log data/hashtags.jsonl]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from app.services.hashtag_service import HashtagIndex
+
+FILLER = ['beautiful', 'scene', 'captured', 'moment', 'bright', 'natural', 'light', 'peaceful', 'vibrant', 'colors',
+          'setting', 'background', 'atmosphere', 'warm', 'sunny', 'day', 'gentle', 'calm', 'lovely', 'view']
+
+
+def synthetic_topics(count, rng):
+    """Topics with their own vocabulary and hashtag pool; popular hashtags are shared across topics"""
+    shared = ['#photography', '#instagood', '#photooftheday', '#nature', '#love']
+    topics = []
+    for topic in range(count):
+        words = [f'word{topic}x{i}' for i in range(12)]
+        hashtags = [f'#tag{topic}x{i}' for i in range(6)] + rng.sample(shared, 2)
+        topics.append((words, hashtags))
+    return topics
+
+
+def synthetic_pair(topic, rng):
+    words, hashtags = topic
+    context = ' '.join(rng.sample(words, 6) + rng.sample(FILLER, 6))
+    # The LLM favours the first few hashtags of a topic but varies its choice
+    chosen = rng.sample(hashtags[:4], 3) + rng.sample(hashtags[4:], 1)
+    return context, chosen
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def evaluate(index, queries, thresholds, count):
+    """Time recommendations and score local answers against the LLM's hashtags at each threshold"""
+    latencies = []
+    answers = []
+    for context, expected in queries:
+        start = time.perf_counter()
+        hashtags, confidence = index.recommend(context, count)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        answers.append((hashtags, confidence, set(expected)))
+    latencies.sort()
+
+    results = {}
+    for threshold in thresholds:
+        local = [(hashtags, expected) for hashtags, confidence, expected in answers
+                 if hashtags and confidence >= threshold]
+        results[f'{threshold:.2f}'] = {
+            'answered_locally': round(len(local) / len(answers), 4),
+            'precision': round(statistics.fmean(len(set(hashtags) & expected) / len(hashtags)
+                                                for hashtags, expected in local), 4) if local else None
+        }
+    return {
+        'recommend_p50_us': round(percentile(latencies, 0.50), 1),
+        'recommend_p99_us': round(percentile(latencies, 0.99), 1),
+        'thresholds': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train', type=int, default=5000, help='Synthetic pairs indexed')
+    parser.add_argument('--queries', type=int, default=2000, help='Synthetic held-out contexts')
+    parser.add_argument('--topics', type=int, default=200)
+    parser.add_argument('--unseen', type=float, default=0.2, help='Share of queries from topics never indexed')
+    parser.add_argument('--thresholds', default='0.2,0.3,0.4,0.5,0.6')
+    parser.add_argument('--count', type=int, default=5, help='Hashtags recommended')
+    parser.add_argument('--log', help='Evaluate on a recorded hashtag log instead')
+    parser.add_argument('--holdout', type=int, default=500, help='Pairs of --log held out as queries')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    thresholds = [float(value) for value in args.thresholds.split(',')]
+    rng = random.Random(args.seed)
+    index = HashtagIndex(max_docs=max(args.train, 1), log_path=None)
+
+    if args.log:
+        with open(args.log, encoding='utf-8') as f:
+            pairs = [json.loads(line) for line in f if line.strip()]
+        if len(pairs) <= args.holdout:
+            print(f"{args.log} has {len(pairs)} pairs; need more than --holdout {args.holdout}", file=sys.stderr)
+            return 1
+        train = [(' '.join(pair['terms']), pair['hashtags']) for pair in pairs[:-args.holdout]]
+        queries = [(' '.join(pair['terms']), pair['hashtags']) for pair in pairs[-args.holdout:]]
+    else:
+        topics = synthetic_topics(args.topics, rng)
+        seen_topics = topics[:int(len(topics) * (1 - args.unseen))]
+        train = [synthetic_pair(rng.choice(seen_topics), rng) for _ in range(args.train)]
+        queries = [synthetic_pair(rng.choice(topics), rng) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    for context, hashtags in train:
+        index.learn(context, hashtags)
+    build_seconds = time.perf_counter() - start
+
+    result = {
+        'indexed': len(index),
+        'queries': len(queries),
+        'source': args.log or 'synthetic',
+        'build_seconds': round(build_seconds, 3)
+    }
+    result.update(evaluate(index, queries, thresholds, args.count))
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Lookup latency of the perceptual-hash near-duplicate index.
+
+Indexes N random 64-bit hashes, then times near-duplicate queries (indexed
+hashes with a few flipped bits) and misses (fresh random hashes).
+
+Usage:
+    python -m benchmarks.bench_phash_index [--size 1000000] [--queries 10000] [--distance 4]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from app.services.phash_service import MultiIndexHashIndex, HASH_BITS
+
+
+def flip_bits(value, count, rng):
+    """Flip count distinct random bits of value"""
+    for bit in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def time_queries(index, queries):
+    """Return per-query latencies in microseconds and the number of queries with matches"""
+    latencies = []
+    found = 0
+    for query in queries:
+        start = time.perf_counter()
+        matches = index.search(query)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        found += bool(matches)
+    latencies.sort()
+    return latencies, found
+
+
+def summarize(latencies, found):
+    return {
+        'found': found,
+        'mean_us': round(statistics.fmean(latencies), 2),
+        'p50_us': round(percentile(latencies, 0.50), 2),
+        'p95_us': round(percentile(latencies, 0.95), 2),
+        'p99_us': round(percentile(latencies, 0.99), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--distance', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = [rng.getrandbits(HASH_BITS) for _ in range(args.size)]
+
+    index = MultiIndexHashIndex(max_distance=args.distance)
+    start = time.perf_counter()
+    for value in hashes:
+        index.add(value)
+    build_seconds = time.perf_counter() - start
+
+    near_queries = [flip_bits(rng.choice(hashes), rng.randint(0, args.distance), rng) for _ in range(args.queries)]
+    miss_queries = [rng.getrandbits(HASH_BITS) for _ in range(args.queries)]
+
+    result = {
+        'indexed': len(index),
+        'max_distance': args.distance,
+        'build_seconds': round(build_seconds, 2),
+        'near_duplicate_queries': summarize(*time_queries(index, near_queries)),
+        'miss_queries': summarize(*time_queries(index, miss_queries))
+    }
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Latency of remote image fetching against a local HTTP server.
+
+Serves a JPEG with an ETag from a local ThreadingHTTPServer and compares the
+old path (one requests.get per URL, full body buffered) with the pooled
+fetcher on first download and on revalidation (304). Also times how quickly
+oversized, non-image and mislabelled responses are rejected, and how many
+body bytes the server managed to send before the client hung up.
+
+Usage:
+    python -m benchmarks.bench_remote_fetch [--requests 200] [--size 2000x1500]
+"""
+import argparse
+import hashlib
+import io
+import json
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image
+
+from app.services.fetch_service import FetchError, RemoteImageFetcher
+
+
+def make_image(size):
+    """Encode a noisy JPEG of the given size"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_handler(image_bytes, sent_bytes):
+    etag = '"%s"' % hashlib.sha256(image_bytes).hexdigest()[:16]
+    junk = b'<html>' + b'x' * (32 * 1024 * 1024) + b'</html>'
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_body(self, content_type, body, length=None):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            if length is not None:
+                self.send_header('Content-Length', str(length))
+            self.end_headers()
+            try:
+                for start in range(0, len(body), 64 * 1024):
+                    self.wfile.write(body[start:start + 64 * 1024])
+                    sent_bytes[self.path] = sent_bytes.get(self.path, 0) + min(64 * 1024, len(body) - start)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def do_GET(self):
+            if self.path == '/image.jpg':
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(image_bytes)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(image_bytes)
+            elif self.path == '/declared-large':
+                self.send_body('image/jpeg', junk, len(junk))
+            elif self.path == '/undeclared-large':
+                self.close_connection = True
+                self.send_body('image/jpeg', b'\xff\xd8\xff' + junk)
+            elif self.path == '/page.html':
+                self.send_body('text/html', junk, len(junk))
+            elif self.path == '/mislabelled.png':
+                self.close_connection = True
+                self.send_body('image/png', junk)
+            else:
+                self.send_error(404)
+
+    return Handler
+
+
+def time_calls(call, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 3),
+        'mean_ms': round(statistics.fmean(latencies), 3)
+    }
+
+
+def time_rejection(fetcher, url):
+    start = time.perf_counter()
+    try:
+        fetcher.fetch(url)
+        code = None
+    except FetchError as e:
+        code = e.code
+    return {'code': code, 'ms': round((time.perf_counter() - start) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--size', default='2000x1500')
+    args = parser.parse_args()
+
+    image_bytes = make_image(tuple(int(value) for value in args.size.split('x')))
+    sent_bytes = {}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(image_bytes, sent_bytes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def old_fetch():
+        response = requests.get(f'{base}/image.jpg')
+        assert response.status_code == 200 and response.content
+
+    fetcher = RemoteImageFetcher()
+
+    def pooled_fetch():
+        assert fetcher.fetch(f'{base}/image.jpg', revalidate=False).content
+
+    def revalidated_fetch():
+        assert fetcher.fetch(f'{base}/image.jpg').not_modified
+
+    result = {
+        'image_bytes': len(image_bytes),
+        'unpooled_get': time_calls(old_fetch, args.requests),
+        'pooled_fetch': time_calls(pooled_fetch, args.requests),
+        'revalidated_fetch': time_calls(revalidated_fetch, args.requests),
+        'rejections': {
+            path: time_rejection(fetcher, f'{base}{path}')
+            for path in ('/declared-large', '/undeclared-large', '/page.html', '/mislabelled.png')
+        }
+    }
+    time.sleep(0.2)
+    result['server_body_bytes_sent'] = {path: sent for path, sent in sent_bytes.items()}
+    server.shutdown()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Hit rate and accuracy of the semantic context cache across similarity thresholds.
+
+Replays a caption log through SemanticCache (storing on every miss, as
+generate_context does) once per threshold and reports the hit rate, the
+rate of wrong hits and lookup latency, next to an exact-text cache. Without
+--log the captions are synthetic BLIP-style output: scenes drawn with Zipf
+popularity, each worded in the ways BLIP varies (prepositions, articles,
+"there is ...", "a close up of ..."), including scenes that differ only in
+a spatial relation ("on top of a car" / "inside a car"), and labelled with
+their scene so hits that returned another scene's context are counted as
+wrong. A real log (one caption per line, or the .jsonl written by
+backfill.py) has no labels; for it the closest pairs just below and above
+each threshold are listed for inspection instead.
+
+Usage:
+    python -m benchmarks.bench_semantic_cache [--captions 20000] [--thresholds 0.75,0.8,0.85,0.9,0.95] [--log alt_text.jsonl]
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from app.services.semantic_cache_service import SemanticCache, normalize_caption, caption_vector
+
+SUBJECTS = ['dog', 'cat', 'man', 'woman', 'little girl', 'boy', 'horse', 'bird', 'group of people', 'red car',
+            'white truck', 'plate of food', 'pizza', 'laptop', 'teddy bear', 'brown cow', 'giraffe', 'elephant',
+            'surfer', 'skateboarder', 'baseball player', 'train', 'motorcycle', 'bowl of fruit', 'vase of flowers']
+ACTIONS = {
+    'sitting': ['sitting', 'sitting down', 'laying'],
+    'standing': ['standing', 'standing up'],
+    'running': ['running', 'running around'],
+    'parked': ['parked', 'parked up'],
+    'riding a wave': ['riding a wave', 'riding a wave on a surfboard'],
+    'holding an umbrella': ['holding an umbrella', 'holding a umbrella'],
+    'eating': ['eating', 'eating food']
+}
+PLACES = {
+    'grass': ['on the grass', 'in the grass', 'on a grassy field', 'in a grassy field'],
+    'beach': ['on the beach', 'on a beach', 'at the beach'],
+    'street': ['on the street', 'on a city street', 'in the street', 'on the side of the road'],
+    'table': ['on a table', 'on top of a table', 'on a wooden table'],
+    'kitchen': ['in a kitchen', 'in the kitchen'],
+    'snow': ['in the snow', 'on the snow', 'in the snowy field'],
+    'bed': ['on a bed', 'on the bed', 'on top of a bed'],
+    'water': ['in the water', 'in the ocean', 'on the water'],
+    # Scenes told apart only by their spatial relation to the same object
+    'on a car': ['on top of a car', 'on the roof of a car'],
+    'inside a car': ['inside a car', 'in the back seat of a car'],
+    'under a car': ['under a car', 'underneath a car'],
+    'on a box': ['on top of a box', 'on a cardboard box'],
+    'inside a box': ['inside a box', 'inside a cardboard box']
+}
+FRAMES = ['{a} {s} {v} {p}', 'there is {a} {s} {v} {p}', 'a close up of {a} {s} {v} {p}',
+          '{a} {s} that is {v} {p}', 'an image of {a} {s} {v} {p}', '{a} {s} {v} {p} with trees in the background']
+
+
+def article(subject):
+    return 'an' if subject[0] in 'aeiou' else 'a'
+
+
+def synthetic_log(count, seed):
+    """Return (caption, scene) pairs; scenes follow a Zipf-like popularity"""
+    rng = random.Random(seed)
+    scenes = [(subject, action, place) for subject in SUBJECTS for action in ACTIONS for place in PLACES]
+    rng.shuffle(scenes)
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(len(scenes))]
+    log = []
+    for scene in rng.choices(scenes, weights, k=count):
+        subject, action, place = scene
+        caption = rng.choice(FRAMES).format(a=article(subject), s=subject, v=rng.choice(ACTIONS[action]),
+                                            p=rng.choice(PLACES[place]))
+        log.append((caption, '/'.join(scene)))
+    return log
+
+
+def read_log(path):
+    """Return (caption, None) pairs from a caption-per-line file or backfill .jsonl"""
+    log = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                line = json.loads(line).get('alt_text') or ''
+            if line and not line.startswith('Error generating alt text'):
+                log.append((line, None))
+    return log
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def replay(log, threshold, size, dims):
+    """Run the log through a fresh cache, storing each miss's label like generate_context stores its context"""
+    cache = SemanticCache('bench', max_size=size, threshold=threshold, dims=dims)
+    wrong = 0
+    latencies = []
+    for caption, label in log:
+        start = time.perf_counter()
+        hit = cache.lookup(caption)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        if hit is None:
+            cache.store(caption, label)
+        elif label is not None and hit != label:
+            wrong += 1
+    latencies.sort()
+    metrics = cache.metrics()
+    result = {
+        'hit_rate': metrics['hit_rate'],
+        'exact_hit_rate': round(metrics['exact_hits'] / len(log), 4),
+        'llm_calls': metrics['misses'],
+        'lookup_p50_us': round(percentile(latencies, 0.50), 1),
+        'lookup_p99_us': round(percentile(latencies, 0.99), 1),
+        'cache_size': metrics['size']
+    }
+    if log[0][1] is not None:
+        result['wrong_hit_rate'] = round(wrong / max(metrics['hits'], 1), 4)
+    return result
+
+
+def exact_cache_hit_rate(log):
+    """Hit rate of a cache keyed on the raw caption text"""
+    seen = set()
+    hits = 0
+    for caption, _ in log:
+        hits += caption in seen
+        seen.add(caption)
+    return round(hits / len(log), 4)
+
+
+def borderline_pairs(log, thresholds, dims, per_threshold=3):
+    """Closest distinct caption pairs just below and at or above each threshold, for eyeballing unlabelled logs"""
+    captions = list(dict.fromkeys(normalize_caption(caption) for caption, _ in log))[:2000]
+    vectors = [caption_vector(caption, dims) for caption in captions]
+    pairs = []
+    for i in range(len(captions)):
+        for j in range(i + 1, len(captions)):
+            pairs.append((float(vectors[i] @ vectors[j]), captions[i], captions[j]))
+    pairs.sort(reverse=True)
+    report = {}
+    for threshold in thresholds:
+        above = [pair for pair in pairs if pair[0] >= threshold][-per_threshold:]
+        below = [pair for pair in pairs if pair[0] < threshold][:per_threshold]
+        report[f'{threshold:.2f}'] = {
+            'lowest_hits': [[round(similarity, 3), first, second] for similarity, first, second in above],
+            'closest_misses': [[round(similarity, 3), first, second] for similarity, first, second in below]
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--captions', type=int, default=20000, help='Synthetic captions to generate')
+    parser.add_argument('--thresholds', default='0.75,0.8,0.85,0.9,0.95')
+    parser.add_argument('--size', type=int, default=10000, help='Cache size')
+    parser.add_argument('--dims', type=int, default=1024)
+    parser.add_argument('--log', help='Replay real captions instead (text lines or backfill .jsonl)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    thresholds = [float(value) for value in args.thresholds.split(',')]
+    log = read_log(args.log) if args.log else synthetic_log(args.captions, args.seed)
+    if not log:
+        print(f"No captions in {args.log}", file=sys.stderr)
+        return 1
+
+    result = {
+        'captions': len(log),
+        'distinct_captions': len({caption for caption, _ in log}),
+        'source': args.log or 'synthetic',
+        'exact_text_cache_hit_rate': exact_cache_hit_rate(log),
+        'thresholds': {f'{threshold:.2f}': replay(log, threshold, args.size, args.dims) for threshold in thresholds}
+    }
+    if log[0][1] is None:
+        result['borderline_pairs'] = borderline_pairs(log, thresholds, args.dims)
+    else:
+        result['distinct_scenes'] = len({label for _, label in log})
+        result['mean_caption_words'] = round(statistics.fmean(len(caption.split()) for caption, _ in log), 1)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
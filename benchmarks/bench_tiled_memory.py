@@ -0,0 +1,167 @@
+"""
+Peak memory check for tiled analysis of a very large image.
+
+Writes a synthetic 100 MP image, analyzes it in a fresh process and asserts
+that the peak RSS growth stays under the configured memory ceiling; exits
+non-zero otherwise. A PNG cannot be decoded in parts, so at 100 MP it must
+instead be rejected with IMAGE_TOO_LARGE before anything is decoded.
+
+Usage:
+    python -m benchmarks.bench_tiled_memory [--format ppm|bmp|jpeg|png] [--ceiling BYTES]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from config.config import TILED_ANALYSIS_MEMORY_CEILING
+
+WIDTH = 10000
+HEIGHT = 10000
+
+
+def _gradient_rows(top, bottom):
+    """Build RGB rows of a synthetic gradient without materializing the full image"""
+    y = np.arange(top, bottom, dtype=np.uint32)[:, None]
+    x = np.arange(WIDTH, dtype=np.uint32)[None, :]
+    rows = np.empty((bottom - top, WIDTH, 3), dtype=np.uint8)
+    rows[..., 0] = (x * 255 // WIDTH).astype(np.uint8)
+    rows[..., 1] = (y * 255 // HEIGHT).astype(np.uint8)
+    rows[..., 2] = ((x + y) % 256).astype(np.uint8)
+    return rows
+
+
+def write_ppm(path, chunk_rows=500):
+    """Write a binary PPM one chunk of rows at a time"""
+    with open(path, 'wb') as f:
+        f.write(f"P6\n{WIDTH} {HEIGHT}\n255\n".encode())
+        for top in range(0, HEIGHT, chunk_rows):
+            f.write(_gradient_rows(top, min(top + chunk_rows, HEIGHT)).tobytes())
+
+
+def write_bmp(path, chunk_rows=500):
+    """Write a bottom-up 24-bit BMP one chunk of rows at a time"""
+    stride = (WIDTH * 3 + 3) & ~3
+    pixel_bytes = stride * HEIGHT
+    with open(path, 'wb') as f:
+        f.write(b'BM' + (54 + pixel_bytes).to_bytes(4, 'little') + b'\0\0\0\0' + (54).to_bytes(4, 'little'))
+        f.write((40).to_bytes(4, 'little') + WIDTH.to_bytes(4, 'little') + HEIGHT.to_bytes(4, 'little'))
+        f.write((1).to_bytes(2, 'little') + (24).to_bytes(2, 'little') + b'\0' * 24)
+        padding = b'\0' * (stride - WIDTH * 3)
+        for bottom in range(HEIGHT, 0, -chunk_rows):
+            top = max(bottom - chunk_rows, 0)
+            rows = _gradient_rows(top, bottom)[::-1, :, ::-1]
+            for row in rows:
+                f.write(row.tobytes() + padding)
+
+
+def write_jpeg(path):
+    """Write a JPEG; encoding needs the full image once, in this parent process only"""
+    from PIL import Image
+    image = Image.fromarray(_gradient_rows(0, HEIGHT))
+    image.save(path, 'JPEG', quality=85)
+
+
+def write_png(path):
+    """Write a PNG; encoding needs the full image once, in this parent process only"""
+    from PIL import Image
+    image = Image.fromarray(_gradient_rows(0, HEIGHT))
+    image.save(path, 'PNG', compress_level=1)
+
+
+def _proc_status_bytes(field):
+    """
+    Read a memory field of /proc/self/status in bytes (Linux).
+    ru_maxrss is avoided where possible because it carries over the parent's
+    high-water mark across exec.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    """Current resident set size in bytes"""
+    return _proc_status_bytes('VmRSS')
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+    return _proc_status_bytes('VmHWM')
+
+
+def run_child(path, ceiling):
+    """Analyze the image and report peak RSS growth in bytes"""
+    from PIL import Image
+    from app.services.tiled_image_service import analyze_image_tiled
+    from app.utils.file_utils import ImageValidationError
+
+    Image.MAX_IMAGE_PIXELS = None
+    baseline = current_rss()
+    start = time.perf_counter()
+    try:
+        stats = analyze_image_tiled(path, memory_ceiling=ceiling)
+        report = {'pixels': stats.pixel_count, 'quality': stats.quality_metrics()}
+    except ImageValidationError as e:
+        report = {'error_code': e.code, 'error': str(e)}
+    elapsed = time.perf_counter() - start
+    peak = peak_rss()
+
+    print(json.dumps(dict(report, **{
+        'seconds': round(elapsed, 2),
+        'baseline_rss': baseline,
+        'peak_rss': peak,
+        'peak_growth': peak - baseline
+    })))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=('ppm', 'bmp', 'jpeg', 'png'), default='ppm')
+    parser.add_argument('--ceiling', type=int, default=TILED_ANALYSIS_MEMORY_CEILING)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.ceiling)
+        return 0
+
+    writers = {'ppm': write_ppm, 'bmp': write_bmp, 'jpeg': write_jpeg, 'png': write_png}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, f'large.{args.format}')
+        writers[args.format](path)
+
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_tiled_memory', '--child', path, '--ceiling', str(args.ceiling)],
+            check=True, capture_output=True, text=True
+        ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['ceiling'] = args.ceiling
+    result['within_ceiling'] = result['peak_growth'] <= args.ceiling
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if not result['within_ceiling']:
+        failures.append(f"peak RSS growth {result['peak_growth']} exceeds the ceiling {args.ceiling}")
+    if args.format == 'png' and result.get('error_code') != 'IMAGE_TOO_LARGE':
+        failures.append("100 MP PNG was not rejected with IMAGE_TOO_LARGE")
+    if args.format != 'png' and result.get('pixels') is None:
+        failures.append(f"analysis failed: {result.get('error')}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
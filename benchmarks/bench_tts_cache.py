@@ -0,0 +1,97 @@
+"""
+Latency of text-to-speech with and without the audio cache.
+
+Requests speech for N distinct alt texts (cache misses), then for the same
+texts again (cache hits), through a minimal app that serves the audio the
+same way /text-to-speech does. Also times a 64 KB Range request against the
+cached audio URL. The offline engine needs no network; pass --engine gtts
+to measure the real engine.
+
+Usage:
+    python -m benchmarks.bench_tts_cache [--texts 50] [--engine offline]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from flask import Flask, request, send_file, url_for
+
+from app.services.tts_service import AudioCache, TextToSpeechService, get_tts_engine
+
+SAMPLE_TEXT = 'a golden retriever sitting on the grass next to a red ball in a sunny park number {}'
+
+
+def build_app(service):
+    app = Flask(__name__)
+
+    @app.route('/tts', methods=['POST'])
+    def tts():
+        path, mimetype, _ = service.synthesize(request.json['text'])
+        response = send_file(path, mimetype=mimetype)
+        response.headers['Content-Location'] = url_for('cached', filename=os.path.basename(path))
+        return response
+
+    @app.route('/tts/<filename>')
+    def cached(filename):
+        path, mimetype = service.cached_audio(filename)
+        return send_file(path, mimetype=mimetype, conditional=True)
+
+    return app
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 3),
+        'mean_ms': round(statistics.fmean(latencies), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--texts', type=int, default=50)
+    parser.add_argument('--engine', default='offline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = TextToSpeechService(get_tts_engine(args.engine), AudioCache(cache_dir))
+        client = build_app(service).test_client()
+        texts = [SAMPLE_TEXT.format(i) for i in range(args.texts)]
+
+        def timed_post(text):
+            start = time.perf_counter()
+            response = client.post('/tts', json={'text': text})
+            response.get_data()
+            assert response.status_code == 200
+            return (time.perf_counter() - start) * 1000, response.headers['Content-Location']
+
+        uncached = [timed_post(text) for text in texts]
+        cached = [timed_post(text) for text in texts]
+
+        ranged = []
+        for _, location in cached:
+            start = time.perf_counter()
+            response = client.get(location, headers={'Range': 'bytes=0-65535'})
+            response.get_data()
+            assert response.status_code == 206
+            ranged.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            'engine': args.engine,
+            'texts': args.texts,
+            'cache_bytes': service.cache.total_bytes,
+            'uncached': summarize([latency for latency, _ in uncached]),
+            'cached': summarize([latency for latency, _ in cached]),
+            'range_request': summarize(ranged)
+        }
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
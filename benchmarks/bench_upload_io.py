@@ -0,0 +1,133 @@
+"""
+Per-request I/O and latency of upload ingestion under concurrent uploads.
+
+Compares the previous path (file.save() to disk, Image.open(path), delete)
+with in-memory ingestion from the upload stream. Both go through the real
+multipart parser, so Werkzeug's own spooling is included. Disk I/O is read
+from /proc/self/io (Linux).
+
+Usage:
+    python -m benchmarks.bench_upload_io [--requests 200] [--concurrency 16] [--size 2000x1500]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import Flask, Request, request, jsonify
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+from app.utils.file_utils import SpooledUploadRequest, open_upload_image
+
+
+def make_upload(size):
+    """Encode a noisy JPEG of the given size"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def build_app(mode, upload_dir):
+    """Minimal app with one upload route using the chosen ingestion path"""
+    app = Flask(__name__)
+    app.request_class = SpooledUploadRequest if mode == 'memory' else Request
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        file = request.files['image']
+        if mode == 'disk':
+            filepath = os.path.join(upload_dir, f"{uuid.uuid4().hex}.jpg")
+            file.save(filepath)
+            try:
+                image = Image.open(filepath)
+                image.load()
+            finally:
+                os.remove(filepath)
+        else:
+            image = open_upload_image(file)
+            image.load()
+        return jsonify({'size': image.size})
+
+    return app
+
+
+def io_counters():
+    """Bytes read and written by this process, as seen by the kernel"""
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def run(mode, payload, total, concurrency):
+    with tempfile.TemporaryDirectory() as upload_dir:
+        client = build_app(mode, upload_dir).test_client()
+        # Encode the body once, in memory, so only server-side ingestion is measured
+        boundary, body = encode_multipart({'image': FileStorage(io.BytesIO(payload), 'image.jpg')})
+
+        def one_request(_):
+            start = time.perf_counter()
+            response = client.post('/upload', data=body,
+                                   content_type=f'multipart/form-data; boundary={boundary}')
+            assert response.status_code == 200
+            return (time.perf_counter() - start) * 1000
+
+        before = io_counters()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = sorted(pool.map(one_request, range(total)))
+        elapsed = time.perf_counter() - start
+        after = io_counters()
+
+    def per_request(name):
+        if name not in before:
+            return None
+        return round((after[name] - before[name]) / total)
+
+    return {
+        'requests_per_second': round(total / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2], 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'write_syscall_bytes_per_request': per_request('wchar'),
+        'disk_write_bytes_per_request': per_request('write_bytes')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--size', default='2000x1500')
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.split('x'))
+    payload = make_upload(size)
+    result = {
+        'upload_bytes': len(payload),
+        'concurrency': args.concurrency,
+        'disk': run('disk', payload, args.requests, args.concurrency),
+        'memory': run('memory', payload, args.requests, args.concurrency)
+    }
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
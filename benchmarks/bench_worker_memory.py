@@ -0,0 +1,134 @@
+"""
+Memory per gunicorn worker with and without preloading the model.
+
+Starts the production server (gunicorn.conf.py) twice: once with the app
+preloaded in the master (SERVER_PRELOAD=1) and once with every worker
+loading its own copy (SERVER_PRELOAD=0). After the workers have answered a
+few requests, reads /proc/<pid>/smaps_rollup (Linux) of the master and each
+worker. RSS counts shared pages in full for every process; PSS divides them
+between the processes sharing them, so the PSS sum is the real footprint.
+
+Usage:
+    python -m benchmarks.bench_worker_memory [--workers 4] [--requests 20]
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    """PIDs of the direct children of a process"""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_kb(pid):
+    """RSS, PSS, private and shared memory of a process in kB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+    }
+
+
+def wait_until_serving(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def measure(preload, workers, request_count, startup_timeout):
+    port = free_port()
+    env = dict(os.environ, SERVER_PRELOAD='1' if preload else '0', SERVER_WORKERS=str(workers),
+               SERVER_BIND=f'127.0.0.1:{port}', JOB_WORKERS='0')
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f'http://127.0.0.1:{port}/'
+        wait_until_serving(url, process, startup_timeout)
+        # Without preloading, every worker loads the model on its own; wait for all of them
+        deadline = time.monotonic() + startup_timeout
+        while len(children(process.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.5)
+        for _ in range(request_count):
+            requests.get(url, timeout=30)
+        startup_seconds = time.monotonic() - start
+        time.sleep(2)
+
+        worker_pids = children(process.pid)
+        master = memory_kb(process.pid)
+        worker_memory = [memory_kb(pid) for pid in worker_pids]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def mb(kb):
+        return round(kb / 1024, 1)
+
+    return {
+        'workers': len(worker_memory),
+        'startup_seconds': round(startup_seconds, 1),
+        'master': {name: mb(value) for name, value in master.items()},
+        'per_worker_mb': {
+            name: mb(sum(m[name] for m in worker_memory) / max(1, len(worker_memory)))
+            for name in ('rss', 'pss', 'private', 'shared')
+        },
+        'total_pss_mb': mb(master['pss'] + sum(m['pss'] for m in worker_memory)),
+        'total_rss_mb': mb(master['rss'] + sum(m['rss'] for m in worker_memory))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    result = {
+        'preloaded': measure(True, args.workers, args.requests, args.startup_timeout),
+        'per_worker_loading': measure(False, args.workers, args.requests, args.startup_timeout)
+    }
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Deterministic synthetic image fixtures for benchmarks.
+
+Images mix smooth gradients, solid shapes or patterns and sensor-like
+noise, so they compress and cluster like photographs rather than like pure
+noise. Seeds cycle through layouts and named colors, so variants are
+captioned differently and caption-keyed caches (the semantic context cache)
+do not answer for each other.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+RESOLUTIONS = {
+    'small': (320, 240),
+    'medium': (1280, 960),
+    'large': (4000, 3000)
+}
+
+COLORS = {
+    'red': (200, 30, 30), 'green': (40, 160, 60), 'blue': (30, 60, 200), 'yellow': (235, 210, 40),
+    'purple': (120, 40, 160), 'orange': (240, 130, 20), 'black': (15, 15, 15), 'white': (245, 245, 245),
+    'pink': (240, 130, 180), 'brown': (120, 75, 35), 'teal': (20, 140, 140)
+}
+LAYOUTS = ('shapes', 'stripes', 'checkerboard', 'rings')
+
+
+def make_image(size, seed=0):
+    """
+    Build a synthetic RGB photo-like image
+    Args:
+        size (tuple): (width, height)
+        seed (int): Variant; different seeds give perceptually different images
+    Returns:
+        PIL.Image: RGB image
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, 3)
+    slope = rng.uniform(-1, 1, (3, 2))
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        pixels[..., channel] = base[channel] + 120 * (slope[channel, 0] * x / width + slope[channel, 1] * y / height)
+    pixels += rng.normal(0, 6, pixels.shape).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    draw = ImageDraw.Draw(image)
+    names = list(COLORS)
+    first, second = (COLORS[names[index]] for index in rng.choice(len(names), 2, replace=False))
+    layout = LAYOUTS[seed % len(LAYOUTS)]
+    if layout == 'shapes':
+        for _ in range(6):
+            x0, y0 = rng.integers(0, width), rng.integers(0, height)
+            radius = int(rng.integers(min(size) // 12, min(size) // 4))
+            color = first if rng.random() < 0.5 else second
+            if rng.random() < 0.5:
+                draw.ellipse((x0 - radius, y0 - radius, x0 + radius, y0 + radius), fill=color)
+            else:
+                draw.rectangle((x0 - radius, y0 - radius, x0 + radius, y0 + radius // 2), fill=color)
+    elif layout == 'stripes':
+        step = max(1, height // int(rng.integers(4, 12)))
+        for i, y0 in enumerate(range(0, height, step)):
+            draw.rectangle((0, y0, width, y0 + step // 2), fill=first if i % 2 else second)
+    elif layout == 'checkerboard':
+        step = max(1, min(size) // int(rng.integers(4, 10)))
+        for y0 in range(0, height, step):
+            for x0 in range(0, width, step):
+                if (x0 // step + y0 // step) % 2:
+                    draw.rectangle((x0, y0, x0 + step, y0 + step), fill=first)
+    else:
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        step = max(1, min(size) // int(rng.integers(6, 16)))
+        for i, radius in enumerate(range(max(size), 0, -step)):
+            draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=first if i % 2 else second)
+    return image
+
+
+def encode(image, fmt='JPEG'):
+    """Encode an image to bytes"""
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=90) if fmt == 'JPEG' else image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def image_bytes(resolution, seed=0, fmt='JPEG'):
+    """Encoded fixture for a named resolution from RESOLUTIONS"""
+    return encode(make_image(RESOLUTIONS[resolution], seed), fmt)
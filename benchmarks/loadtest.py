@@ -0,0 +1,480 @@
+"""
+HTTP load generator reporting throughput, errors and latency percentiles per endpoint.
+
+Drives the real routes over HTTP with a weighted mix of requests, one load
+level after another, and reports for each level the throughput, error rate
+and p50/p95/p99 latency per endpoint, plus the peak queue depth and average
+wait of every BLIP/OpenAI resource sampled from /metrics/capacity, which
+shows the stage that queues up first. The saturation curve lists throughput
+and p95 per level and the first level at which throughput stops scaling.
+
+Levels are concurrent users (closed loop: each user sends its next request
+when the previous one returns, after --think seconds) or, with --rates,
+arrival rates (open loop: Poisson arrivals served by up to --max-users
+connections; latency includes time spent waiting for a free connection).
+
+Without --url, the app is started in a subprocess on a threaded development
+server, with OpenAI calls going to the local stub (benchmarks.openai_stub),
+the response caches disabled and the offline TTS engine. The hit rates of
+the semantic context cache are fetched from /metrics/semantic-cache at the
+end of the run. Pass --url to load
+a running deployment instead, e.g. gunicorn started with OPENAI_API_BASE
+pointing at `python -m benchmarks.openai_stub`.
+
+Usage:
+    python -m benchmarks.loadtest [--users 20,50,100] [--duration 30] [--mix general=3,seo=2] [--output load.json]
+    python -m benchmarks.loadtest --rates 2,5,10 --max-users 100 --url http://127.0.0.1:4000
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.fixtures import RESOLUTIONS, image_bytes
+from benchmarks.openai_stub import OpenAIStubServer
+
+# Endpoint -> (path, upload field); None posts JSON text instead of an image
+ENDPOINTS = {
+    'general': ('/general', 'image'),
+    'seo': ('/seo', 'image'),
+    'social_media': ('/social-media', 'image'),
+    'image_analyzer': ('/image-analyzer', 'image'),
+    'advanced_analysis': ('/advanced-analysis', 'file'),
+    'medical': ('/medical-image-analysis', 'file'),
+    'text_to_speech': ('/text-to-speech', None)
+}
+
+DEFAULT_MIX = 'general=3,seo=2,social_media=2,image_analyzer=3,advanced_analysis=1,medical=1,text_to_speech=2'
+
+# One request; sent is the time it was sent (open loop: scheduled), done when its body was read
+Sample = namedtuple('Sample', ['endpoint', 'status', 'sent', 'done'])
+
+SPEECH_TEXT = 'a {} sitting on a wooden table next to a window in the afternoon light, sample {}'
+SUBJECTS = ('dog', 'cat', 'vase of flowers', 'laptop', 'teapot', 'pair of shoes', 'camera', 'plant')
+
+
+def parse_mix(value):
+    """Parse 'name=weight,...' into (names, weights)"""
+    names, weights = [], []
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}. Supported: {', '.join(ENDPOINTS)}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 1)
+
+
+def summarize(samples, window):
+    """
+    Aggregate the requests of a measured window
+    Args:
+        samples (list): Sample tuples; status 0 is a connection error
+        window (tuple): (start, stop) in time.monotonic() seconds
+    Returns:
+        dict: Requests sent in the window with their error rate, status counts and
+            latency percentiles, and the throughput of requests completed in it
+    """
+    start, stop = window
+    sent = [sample for sample in samples if start <= sample.sent < stop]
+    completed = sum(1 for sample in samples if start <= sample.done <= stop)
+    latencies = sorted((sample.done - sample.sent) * 1000 for sample in sent)
+    statuses = {}
+    for sample in sent:
+        statuses[str(sample.status)] = statuses.get(str(sample.status), 0) + 1
+    errors = sum(count for status, count in statuses.items() if status == '0' or int(status) >= 400)
+    return {
+        'requests': len(sent),
+        'throughput_rps': round(completed / (stop - start), 2),
+        'error_rate': round(errors / len(sent), 4) if sent else 0.0,
+        'statuses': statuses,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': round(latencies[-1], 1) if latencies else None
+    }
+
+
+class RequestFactory:
+    """
+    Builds request payloads from a pool of pre-encoded fixture images, so the
+    client spends no CPU encoding images during the run.
+    Args:
+        resolution (str): Key of benchmarks.fixtures.RESOLUTIONS
+        pool_size (int): Distinct images; repeats may hit the server's near-duplicate cache
+    """
+
+    def __init__(self, resolution, pool_size):
+        self.images = [image_bytes(resolution, seed) for seed in range(pool_size)]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            return next(self._counter)
+
+    def send(self, session, base_url, endpoint, timeout):
+        path, field = ENDPOINTS[endpoint]
+        n = self._next()
+        if field is None:
+            text = SPEECH_TEXT.format(SUBJECTS[n % len(SUBJECTS)], n)
+            response = session.post(base_url + path, json={'text': text}, timeout=timeout)
+        else:
+            upload = {field: ('fixture.jpg', self.images[n % len(self.images)], 'image/jpeg')}
+            response = session.post(base_url + path, files=upload, timeout=timeout)
+        response.content  # Read the whole body, as a client would
+        return response.status_code
+
+
+def new_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CapacitySampler(threading.Thread):
+    """Polls /metrics/capacity and keeps the peak queue depth of every resource"""
+
+    def __init__(self, base_url, interval=0.5):
+        super().__init__(daemon=True)
+        self.url = base_url + '/metrics/capacity'
+        self.interval = interval
+        self.peak_queue = {}
+        self.last = None
+        self._stop_event = threading.Event()
+        self._session = new_session(1)
+
+    def _sample(self):
+        try:
+            data = self._session.get(self.url, timeout=5).json()
+        except (requests.RequestException, ValueError):
+            return
+        resources = data.get('data') if isinstance(data, dict) else None
+        if not isinstance(resources, dict):
+            return
+        self.last = resources
+        for name, metrics in resources.items():
+            if isinstance(metrics, dict) and 'queue_depth' in metrics:
+                self.peak_queue[name] = max(self.peak_queue.get(name, 0), metrics['queue_depth'])
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self._sample()
+        return {
+            name: {
+                'peak_queue_depth': self.peak_queue.get(name, 0),
+                'avg_wait_ms': metrics.get('avg_wait_ms'),
+                'avg_hold_ms': metrics.get('avg_hold_ms'),
+                'shed': metrics.get('shed')
+            }
+            for name, metrics in (self.last or {}).items() if isinstance(metrics, dict)
+        }
+
+
+def prime(base_url, factory, endpoints, timeout):
+    """
+    Send one request to every endpoint before measuring, so one-off startup
+    work (NLTK data, the color analysis process pool) is not counted
+    Returns:
+        dict: Endpoint -> status of its priming request
+    """
+    session = new_session(1)
+    statuses = {}
+    for endpoint in endpoints:
+        try:
+            statuses[endpoint] = factory.send(session, base_url, endpoint, timeout)
+        except requests.RequestException:
+            statuses[endpoint] = 0
+    return statuses
+
+
+def run_closed(base_url, factory, mix, users, duration, warmup, think, timeout):
+    """
+    Run `users` concurrent users for warmup + duration seconds
+    Returns:
+        tuple: (samples, measured window)
+    """
+    samples = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def user(index):
+        rng = random.Random(index)
+        session = new_session(1)
+        while time.monotonic() < stop_at:
+            endpoint = rng.choices(mix[0], mix[1])[0]
+            sent = time.monotonic()
+            try:
+                status = factory.send(session, base_url, endpoint, timeout)
+            except requests.RequestException:
+                status = 0
+            with lock:
+                samples.append(Sample(endpoint, status, sent, time.monotonic()))
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, (measure_from, stop_at)
+
+
+def run_open(base_url, factory, mix, rate, max_users, duration, warmup, timeout):
+    """
+    Send Poisson arrivals at `rate` requests per second for warmup + duration seconds.
+    Latency is measured from the scheduled arrival, so a backlog of arrivals
+    waiting for a free connection counts against the server.
+    Returns:
+        tuple: (samples, measured window)
+    """
+    samples = []
+    lock = threading.Lock()
+    arrivals = queue.Queue()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        session = new_session(1)
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            scheduled, endpoint = item
+            try:
+                status = factory.send(session, base_url, endpoint, timeout)
+            except requests.RequestException:
+                status = 0
+            with lock:
+                samples.append(Sample(endpoint, status, scheduled, time.monotonic()))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max_users)]
+    for thread in threads:
+        thread.start()
+
+    rng = random.Random(0)
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled >= stop_at:
+            break
+        time.sleep(max(0.0, scheduled - time.monotonic()))
+        arrivals.put((scheduled, rng.choices(mix[0], mix[1])[0]))
+
+    for _ in threads:
+        arrivals.put(None)
+    for thread in threads:
+        thread.join()
+    return samples, (measure_from, stop_at)
+
+
+def run_level(args, base_url, factory, mix, level):
+    sampler = CapacitySampler(base_url)
+    sampler.start()
+    started = time.monotonic()
+    if args.rates:
+        samples, window = run_open(base_url, factory, mix, level, args.max_users, args.duration, args.warmup, args.timeout)
+    else:
+        samples, window = run_closed(base_url, factory, mix, level, args.duration, args.warmup, args.think, args.timeout)
+    capacity = sampler.stop()
+
+    endpoints = {}
+    for endpoint in mix[0]:
+        endpoints[endpoint] = summarize([sample for sample in samples if sample.endpoint == endpoint], window)
+    result = {'rate' if args.rates else 'users': level}
+    if args.rates:
+        # Poisson arrivals drift from the nominal rate over a short window
+        result['offered_rps'] = round(sum(1 for sample in samples if window[0] <= sample.sent < window[1])
+                                      / args.duration, 2)
+    result.update(summarize(samples, window))
+    result['wall_seconds'] = round(time.monotonic() - started, 1)
+    result['endpoints'] = endpoints
+    result['capacity'] = capacity
+    return result
+
+
+def saturation(levels, key, open_loop):
+    """
+    Throughput and p95 per level, and the first level at which throughput
+    stops scaling: it falls below 90% of the offered rate (open loop) or
+    grows less than 10% over the previous level (closed loop).
+    """
+    curve = [{name: level[name] for name in (key, 'offered_rps', 'throughput_rps', 'p95_ms', 'error_rate')
+              if name in level} for level in levels]
+    saturated_at = None
+    for i, level in enumerate(levels):
+        if open_loop:
+            scaling = level['throughput_rps'] >= 0.9 * level['offered_rps'] and level['error_rate'] < 0.01
+        elif i == 0:
+            scaling = level['error_rate'] < 0.01
+        else:
+            scaling = level['throughput_rps'] >= 1.1 * levels[i - 1]['throughput_rps'] and level['error_rate'] < 0.01
+        if not scaling:
+            saturated_at = level[key]
+            break
+    return {'curve': curve, 'saturated_at': saturated_at}
+
+
+def fetch_semantic_cache_metrics(base_url, timeout):
+    """Hit rates of the server's semantic context caches, or None if the server does not report them"""
+    try:
+        response = requests.get(base_url + '/metrics/semantic-cache', timeout=timeout)
+        return response.json()['data'] if response.status_code == 200 else None
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+
+def serve(port):
+    """Run the app on a threaded development server (subprocess entry point)"""
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    server = make_server('127.0.0.1', port, create_app(background_workers=False), threaded=True)
+    server.serve_forever()
+
+
+def start_local_server(args, stub):
+    """Start the app in a subprocess wired to the stub; returns (process, base_url)"""
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_BASE': stub.url,
+        'OPENAI_API_KEY': 'stub',
+        'TTS_ENGINE': 'offline'
+    })
+    for route in ('IMAGE_ANALYZER', 'MEDICAL', 'GENERAL', 'SEO', 'ANALYZE', 'SOCIAL_MEDIA'):
+        env[f'RESPONSE_CACHE_TTL_{route}'] = '0'
+
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.loadtest', '--serve', str(args.port)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{args.port}'
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'App server exited with status {process.returncode}')
+        try:
+            requests.get(base_url + '/metrics/capacity', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'App server did not start within {args.startup_timeout} seconds')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Base URL of a running server; default starts one locally')
+    parser.add_argument('--users', default='20,50,100', help='Concurrent users per level (closed loop)')
+    parser.add_argument('--rates', help='Arrival rates in requests/s per level (open loop)')
+    parser.add_argument('--max-users', type=int, default=100, help='Connections for open-loop arrivals')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weighted endpoint mix, name=weight,...')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each level')
+    parser.add_argument('--think', type=float, default=0.0, help='Mean user think time in seconds')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--resolution', default='small', choices=list(RESOLUTIONS))
+    parser.add_argument('--images', type=int, default=200, help='Distinct fixture images to upload')
+    parser.add_argument('--port', type=int, default=4100, help='Port of the local server')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--stub-latency', type=float, default=0.5, help='Stub seconds per completion')
+    parser.add_argument('--stub-per-token-latency', type=float, default=0.0)
+    parser.add_argument('--stub-tokens', type=int, default=120)
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    try:
+        mix = parse_mix(args.mix)
+        levels = [float(value) for value in args.rates.split(',')] if args.rates else \
+            [int(value) for value in args.users.split(',')]
+    except ValueError as e:
+        parser.error(str(e))
+
+    stub = process = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        stub = OpenAIStubServer(latency=args.stub_latency, per_token_latency=args.stub_per_token_latency,
+                                tokens=args.stub_tokens).start()
+        process, base_url = start_local_server(args, stub)
+
+    factory = RequestFactory(args.resolution, args.images)
+    results = []
+    try:
+        primed = prime(base_url, factory, mix[0], args.timeout)
+        for level in levels:
+            print(f"Running {'rate' if args.rates else 'users'}={level} for {args.duration:g}s", file=sys.stderr)
+            results.append(run_level(args, base_url, factory, mix, level))
+        semantic_cache = fetch_semantic_cache_metrics(base_url, args.timeout)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if stub is not None:
+            stub.stop()
+
+    key = 'rate' if args.rates else 'users'
+    report = {
+        'metadata': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'target': args.url or 'local',
+            'mode': 'open' if args.rates else 'closed',
+            'mix': dict(zip(*mix)),
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'think': args.think,
+            'resolution': args.resolution,
+            'stub_latency': None if args.url else args.stub_latency,
+            'primed': primed
+        },
+        'levels': results,
+        'saturation': saturation(results, key, bool(args.rates)),
+        'semantic_cache': semantic_cache
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Local OpenAI-compatible chat completions server for offline benchmarks.
+
+Answers POST /v1/chat/completions after a configurable latency with a
+deterministic reply of a configurable number of words. The reply is laid
+out the way the app's parsers expect (About/Technical/Additional sections,
+numbered medical report sections, hashtags), so every route exercises its
+full post-processing.
+
+Point the app at it with OPENAI_API_BASE=http://127.0.0.1:<port>/v1.
+
+Usage:
+    python -m benchmarks.openai_stub [--port 8099] [--latency 0.2] [--per-token-latency 0.002] [--tokens 120]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('durable lightweight precision crafted premium ergonomic stainless wireless '
+         'compact vibrant textured modern classic adjustable reliable efficient').split()
+SECTIONS = ('About:', 'Technical:', 'Additional:')
+MEDICAL_SECTIONS = ('1. Key Findings:', '2. Potential Observations:', '3. Recommendations:')
+
+
+def make_reply(prompt, tokens):
+    """Build a deterministic reply of roughly `tokens` words"""
+    headers = MEDICAL_SECTIONS if 'medical' in prompt.lower() else SECTIONS
+    per_section = max(1, tokens // len(headers))
+    lines = []
+    for s, header in enumerate(headers):
+        lines.append(header)
+        words = [WORDS[(s * 7 + i) % len(WORDS)] for i in range(per_section)]
+        for start in range(0, len(words), 8):
+            lines.append('• ' + ' '.join(words[start:start + 8]))
+    lines.append('#product #design #quality')
+    return '\n'.join(lines)
+
+
+class OpenAIStubServer:
+    """
+    Threaded stub server.
+    Args:
+        port (int): Port to listen on; 0 picks a free port
+        latency (float): Seconds before every reply
+        per_token_latency (float): Extra seconds per generated word
+        tokens (int): Words per reply, capped by the request's max_tokens
+    """
+
+    def __init__(self, port=0, latency=0.2, per_token_latency=0.0, tokens=120):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.tokens = tokens
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}/v1'
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                prompt = ' '.join(message.get('content', '') for message in body.get('messages', []))
+                tokens = min(stub.tokens, body.get('max_tokens') or stub.tokens)
+                with stub._lock:
+                    stub.requests += 1
+
+                time.sleep(stub.latency + stub.per_token_latency * tokens)
+                reply = json.dumps({
+                    'id': f'chatcmpl-{uuid.uuid4().hex}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': body.get('model', 'stub'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': make_reply(prompt, tokens)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {
+                        'prompt_tokens': len(prompt.split()),
+                        'completion_tokens': tokens,
+                        'total_tokens': len(prompt.split()) + tokens
+                    }
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--per-token-latency', type=float, default=0.0)
+    parser.add_argument('--tokens', type=int, default=120)
+    args = parser.parse_args()
+
+    server = OpenAIStubServer(args.port, args.latency, args.per_token_latency, args.tokens)
+    print(f'OpenAI stub listening on {server.url}', file=sys.stderr)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Offline benchmark suite for every route and the hot service functions.
+
+Starts the local OpenAI stub (benchmarks.openai_stub), points the app at it
+and disables the response caches, then times:
+  - micro: generate_alt_text and analyze_colors per fixture resolution,
+    analyze_sentiment, extract_keywords and _extract_sections on stub output;
+  - routes: each analysis route end to end through the Flask test client.
+Every iteration uploads a fresh fixture variant, so the near-duplicate and
+URL caches never short-circuit the work. Variants are captioned differently
+too; the semantic context cache stays on and its hit rates are reported
+with the results, so any context it reused is visible. Results are written
+as JSON; pass a previous run as --compare to flag regressions.
+
+Usage:
+    python -m benchmarks.suite [--iterations 5] [--resolutions small,medium] [--output bench.json] [--compare baseline.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fixtures import RESOLUTIONS, make_image, image_bytes
+from benchmarks.openai_stub import OpenAIStubServer, make_reply
+
+# Route -> (path, upload field, extra form fields)
+ROUTES = {
+    'image_analyzer': ('/image-analyzer', 'image', {}),
+    'general': ('/general', 'image', {}),
+    'social_media': ('/social-media', 'image', {}),
+    'seo': ('/seo', 'image', {}),
+    'medical': ('/medical-image-analysis', 'file', {}),
+    'advanced_analysis': ('/advanced-analysis', 'file', {}),
+    'analyze': ('/analyze', 'image', {'outputs': 'seo,caption,sentiment'})
+}
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'n': len(latencies),
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'min_ms': round(latencies[0], 3)
+    }
+
+
+def measure(func, inputs, warmup=1):
+    """Call func on each input, discarding the first `warmup` calls"""
+    latencies = []
+    for i, value in enumerate(inputs):
+        start = time.perf_counter()
+        func(value)
+        if i >= warmup:
+            latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_micro(results, resolutions, iterations, reply):
+    from app.services.advanced_image_service import AdvancedImageProcessor
+    from app.services.seo_service import _extract_sections, extract_keywords
+    from app.services.text_service import analyze_sentiment
+
+    try:
+        from app.services.image_service import image_processor
+    except Exception as e:
+        image_processor = None
+        for resolution in resolutions:
+            results[f'micro.generate_alt_text[{resolution}]'] = {'skipped': f'BLIP unavailable: {e}'}
+
+    processor = AdvancedImageProcessor()
+    for resolution in resolutions:
+        images = [make_image(RESOLUTIONS[resolution], seed) for seed in range(iterations + 1)]
+        if image_processor is not None:
+            results[f'micro.generate_alt_text[{resolution}]'] = measure(image_processor.generate_alt_text, images)
+        results[f'micro.analyze_colors[{resolution}]'] = measure(processor.analyze_colors, images)
+
+    texts = [reply] * (iterations * 10 + 1)
+    results['micro.analyze_sentiment'] = measure(analyze_sentiment, texts)
+    results['micro.extract_keywords'] = measure(extract_keywords, texts)
+    results['micro.extract_sections'] = measure(_extract_sections, texts)
+
+
+def run_routes(results, resolutions, iterations, routes):
+    try:
+        from app import create_app
+        client = create_app(background_workers=False).test_client()
+    except Exception as e:
+        for name in routes:
+            for resolution in resolutions:
+                results[f'route.{name}[{resolution}]'] = {'skipped': f'App unavailable: {e}'}
+        return
+
+    seed = 10_000  # Disjoint from the micro-benchmark fixtures
+    for name in routes:
+        path, field, form = ROUTES[name]
+        for resolution in resolutions:
+            uploads = []
+            for _ in range(iterations + 1):
+                seed += 1
+                uploads.append(image_bytes(resolution, seed))
+
+            failures = []
+
+            def post(content):
+                data = dict(form)
+                data[field] = (io.BytesIO(content), 'fixture.jpg')
+                response = client.post(path, data=data, content_type='multipart/form-data')
+                response.get_data()
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+            stats = measure(post, uploads)
+            if failures:
+                stats['failures'] = failures
+            results[f'route.{name}[{resolution}]'] = stats
+
+
+def semantic_cache_metrics():
+    """Metrics of the semantic context caches after the run, or None if the app could not be imported"""
+    try:
+        from app.services.semantic_cache_service import context_cache, enhanced_context_cache
+    except Exception:
+        return None
+    return {'context': context_cache.metrics(), 'enhanced_context': enhanced_context_cache.metrics()}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare p50 latencies with a previous run
+    Returns:
+        list: Regressions as dicts, slowest relative change first
+    """
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline.get(name)
+        if not previous or 'p50_ms' not in stats or 'p50_ms' not in previous or previous['p50_ms'] <= 0:
+            continue
+        change = stats['p50_ms'] / previous['p50_ms'] - 1
+        if change > threshold:
+            regressions.append({
+                'benchmark': name,
+                'baseline_p50_ms': previous['p50_ms'],
+                'p50_ms': stats['p50_ms'],
+                'change': round(change, 3)
+            })
+    return sorted(regressions, key=lambda regression: -regression['change'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5, help='Timed iterations per benchmark')
+    parser.add_argument('--resolutions', default='small,medium', help=f"Subset of {','.join(RESOLUTIONS)}")
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Routes to benchmark')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-routes', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stub seconds per completion')
+    parser.add_argument('--per-token-latency', type=float, default=0.0)
+    parser.add_argument('--tokens', type=int, default=120, help='Stub words per completion')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Relative p50 slowdown reported as regression')
+    args = parser.parse_args()
+
+    resolutions = [name.strip() for name in args.resolutions.split(',') if name.strip()]
+    routes = [name.strip() for name in args.routes.split(',') if name.strip()]
+    unknown = [name for name in resolutions if name not in RESOLUTIONS] + [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error(f"Unknown resolutions or routes: {', '.join(unknown)}")
+
+    stub = OpenAIStubServer(latency=args.latency, per_token_latency=args.per_token_latency,
+                            tokens=args.tokens).start()
+    # Must be set before the app's config is imported
+    os.environ['OPENAI_API_BASE'] = stub.url
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    for route in ('IMAGE_ANALYZER', 'MEDICAL', 'GENERAL', 'SEO', 'ANALYZE', 'SOCIAL_MEDIA'):
+        os.environ[f'RESPONSE_CACHE_TTL_{route}'] = '0'
+
+    results = {}
+    try:
+        if not args.skip_micro:
+            run_micro(results, resolutions, args.iterations, make_reply('', args.tokens))
+        if not args.skip_routes:
+            run_routes(results, resolutions, args.iterations, routes)
+    finally:
+        stub.stop()
+
+    report = {
+        'metadata': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'iterations': args.iterations,
+            'resolutions': resolutions,
+            'stub_latency': args.latency,
+            'stub_per_token_latency': args.per_token_latency,
+            'stub_tokens': args.tokens,
+            'stub_requests': stub.requests
+        },
+        'results': results,
+        'semantic_cache': semantic_cache_metrics()
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(results, baseline['results'], args.threshold)
+        report['baseline'] = baseline['metadata']
+        exit_code = 1 if report['regressions'] else 0
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,17 +2,37 @@
 Centralized configuration for AI services
 """
 import openai
-from config.config import OPENAI_API_KEY
+from config.config import OPENAI_API_KEY, OPENAI_API_BASE
+from app.services.capacity_service import capacity_manager
+from app.utils.tracing import span
 
 def configure_ai():
     """Configure AI services with appropriate API keys and settings"""
     openai.api_key = OPENAI_API_KEY
+    if OPENAI_API_BASE:
+        openai.api_base = OPENAI_API_BASE
 
 def get_openai_client():
     """Get configured OpenAI client"""
     configure_ai()
     return openai
 
+def create_chat_completion(**kwargs):
+    """
+    Create a chat completion within the capacity limits of the requested model.
+    Raises CapacityExceeded if the request is shed instead of queued.
+    """
+    with span('openai.chat_completion', **{'llm.model': kwargs.get('model'), 'llm.retry_count': 0}) as call:
+        with capacity_manager.slot(kwargs.get('model')):
+            response = get_openai_client().ChatCompletion.create(**kwargs)
+        usage = getattr(response, 'usage', None) or {}
+        call.set_attributes({
+            'llm.prompt_tokens': usage.get('prompt_tokens'),
+            'llm.completion_tokens': usage.get('completion_tokens'),
+            'llm.total_tokens': usage.get('total_tokens')
+        })
+        return response
+
 # Standard model configurations
 GPT_CONFIG = {
     "model": "gpt-3.5-turbo",
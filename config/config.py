@@ -13,6 +13,161 @@ MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 
 # OpenAI Config
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE')  # e.g. a local OpenAI-compatible server; unset uses api.openai.com
 
 # Model Config
-BLIP_MODEL = "Salesforce/blip-image-captioning-base" 
\ No newline at end of file
+BLIP_MODEL = "Salesforce/blip-image-captioning-base" 
+
+# Chart Config
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 256))  # Images whose charts are kept
+
+# Color Analysis Config
+COLOR_ANALYSIS_MAX_SIDE = int(os.environ.get('COLOR_ANALYSIS_MAX_SIDE', 256))  # Longest side of the analysis buffer
+COLOR_HISTOGRAM_BINS = int(os.environ.get('COLOR_HISTOGRAM_BINS', 16))  # Bins per RGB/HSV channel
+
+# Tiled Analysis Config
+TILED_ANALYSIS_MEMORY_CEILING = int(os.environ.get('TILED_ANALYSIS_MEMORY_CEILING', 256 * 1024 * 1024))  # Peak bytes per analysis
+TILED_PREVIEW_MAX_SIDE = int(os.environ.get('TILED_PREVIEW_MAX_SIDE', 1024))  # Longest side of the preview used for captioning
+
+# Color Analysis Pool Config
+COLOR_ANALYSIS_WORKERS = int(os.environ.get('COLOR_ANALYSIS_WORKERS', 2))  # Processes running color analysis
+COLOR_ANALYSIS_TIMEOUT = int(os.environ.get('COLOR_ANALYSIS_TIMEOUT', 60))  # Seconds to wait for a color analysis
+
+# Near-Duplicate Cache Config
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 4))  # Hamming bits out of 64
+NEAR_DUPLICATE_CACHE_SIZE = int(os.environ.get('NEAR_DUPLICATE_CACHE_SIZE', 100000))  # Images whose results are kept
+NEAR_DUPLICATE_MAX_COLOR_DIFF = int(os.environ.get('NEAR_DUPLICATE_MAX_COLOR_DIFF', 12))  # Per-channel quadrant mean difference, out of 255
+
+# Multi-Frame Image Config
+KEYFRAME_MAX_FRAMES = int(os.environ.get('KEYFRAME_MAX_FRAMES', 6))  # Keyframes captioned per animated GIF or multi-page TIFF
+KEYFRAME_MIN_DISTANCE = float(os.environ.get('KEYFRAME_MIN_DISTANCE', 12))  # Mean thumbnail difference (0-255) for a frame to count as new
+KEYFRAME_SCAN_FRAMES = int(os.environ.get('KEYFRAME_SCAN_FRAMES', 120))  # Frames examined before the rest are ignored
+KEYFRAME_SCAN_PIXELS = int(os.environ.get('KEYFRAME_SCAN_PIXELS', 32 * 1024 * 1024))  # Pixels decoded while scanning; large frames get fewer of KEYFRAME_SCAN_FRAMES
+KEYFRAME_MAX_SIDE = int(os.environ.get('KEYFRAME_MAX_SIDE', 768))  # Longest side of keyframes kept for captioning
+
+# Upload Config
+UPLOAD_SPILL_THRESHOLD = int(os.environ.get('UPLOAD_SPILL_THRESHOLD', 8 * 1024 * 1024))  # Uploads larger than this spill to disk
+
+# Image Validation Config
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 178956970))  # Pillow's own hard decompression bomb limit
+IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', 30000))  # Pixels along either side
+IMAGE_MAX_COMPRESSION_RATIO = int(os.environ.get('IMAGE_MAX_COMPRESSION_RATIO', 1024))  # Decoded bytes per file byte, for images over 64 MB decoded
+
+# Medical Ingestion Config
+MEDICAL_MAX_CONTENT_LENGTH = int(os.environ.get('MEDICAL_MAX_CONTENT_LENGTH', 512 * 1024 * 1024))  # Upload limit for medical studies
+MEDICAL_MAX_FRAMES = int(os.environ.get('MEDICAL_MAX_FRAMES', 3))  # Representative frames captioned per study
+MEDICAL_FRAME_MAX_SIDE = int(os.environ.get('MEDICAL_FRAME_MAX_SIDE', 1024))  # Longest side of frames passed to the model
+
+# Batch Config
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))  # Images processed concurrently per batch
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', 100))  # Images accepted per batch
+
+# Job Queue Config
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join('data', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # Local worker threads; 0 disables processing in this process
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_VISIBILITY_TIMEOUT = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', 300))  # Seconds before a claimed job is retried
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))  # Seconds between polls of an empty queue
+JOB_CALLBACK_TIMEOUT = int(os.environ.get('JOB_CALLBACK_TIMEOUT', 10))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))  # Finished jobs are deleted this long after finishing; 0 keeps them
+JOB_SWEEP_INTERVAL = int(os.environ.get('JOB_SWEEP_INTERVAL', 3600))  # Seconds between deletions of expired finished jobs
+JOB_CALLBACK_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()}  # Callback hosts allowed even on private addresses
+
+# Remote Image Fetch Config
+REMOTE_FETCH_CONNECT_TIMEOUT = float(os.environ.get('REMOTE_FETCH_CONNECT_TIMEOUT', 3.05))  # Seconds
+REMOTE_FETCH_READ_TIMEOUT = float(os.environ.get('REMOTE_FETCH_READ_TIMEOUT', 10))  # Seconds between received bytes
+REMOTE_FETCH_MAX_BYTES = int(os.environ.get('REMOTE_FETCH_MAX_BYTES', MAX_CONTENT_LENGTH))
+REMOTE_FETCH_POOL_SIZE = int(os.environ.get('REMOTE_FETCH_POOL_SIZE', 10))  # Keep-alive connections per host
+REMOTE_FETCH_CACHE_SIZE = int(os.environ.get('REMOTE_FETCH_CACHE_SIZE', 1024))  # URLs remembered for revalidation
+REMOTE_FETCH_MAX_REDIRECTS = int(os.environ.get('REMOTE_FETCH_MAX_REDIRECTS', 5))  # Redirects followed per download
+REMOTE_FETCH_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get('REMOTE_FETCH_ALLOWED_HOSTS', '').split(',') if host.strip()}  # Image hosts allowed even on private addresses
+
+# Text-to-Speech Config
+TTS_ENGINE = os.environ.get('TTS_ENGINE', 'gtts')  # 'gtts' or 'offline'
+TTS_DEFAULT_LANG = os.environ.get('TTS_DEFAULT_LANG', 'en')
+TTS_MAX_TEXT_LENGTH = int(os.environ.get('TTS_MAX_TEXT_LENGTH', 5000))  # Characters per request
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', os.path.join('data', 'tts_cache'))
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # Audio kept on disk
+TTS_CACHE_MAX_AGE = int(os.environ.get('TTS_CACHE_MAX_AGE', 86400))  # Seconds clients may reuse audio
+
+# Production Server Config (gunicorn.conf.py)
+SERVER_BIND = os.environ.get('SERVER_BIND', f"0.0.0.0:{os.environ.get('PORT', 4000)}")
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 2))  # Worker processes
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 4))  # Request threads per worker
+SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT', 120))  # Seconds before a silent worker is restarted
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))  # Seconds to finish requests on restart
+SERVER_PRELOAD = os.environ.get('SERVER_PRELOAD', '1') != '0'  # Load the model once in the master and share it
+SERVER_TORCH_THREADS = int(os.environ.get('SERVER_TORCH_THREADS', 0))  # Per worker; 0 splits the cores between workers
+
+# Analysis Pipeline Config
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 8))  # Threads running pipeline stages, shared by all requests
+
+# Response Cache Config
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))  # Responses kept across all routes
+RESPONSE_CACHE_DEFAULT_TTL = int(os.environ.get('RESPONSE_CACHE_DEFAULT_TTL', 600))  # Seconds
+# Seconds each route's responses are reused; 0 disables caching for the route.
+# Creative outputs get short TTLs so resubmissions soon get fresh wording.
+RESPONSE_CACHE_TTLS = {
+    'image_analyzer': int(os.environ.get('RESPONSE_CACHE_TTL_IMAGE_ANALYZER', 3600)),
+    'medical': int(os.environ.get('RESPONSE_CACHE_TTL_MEDICAL', 3600)),
+    'general': int(os.environ.get('RESPONSE_CACHE_TTL_GENERAL', 1800)),
+    'seo': int(os.environ.get('RESPONSE_CACHE_TTL_SEO', 1800)),
+    'analyze': int(os.environ.get('RESPONSE_CACHE_TTL_ANALYZE', 900)),
+    'social_media': int(os.environ.get('RESPONSE_CACHE_TTL_SOCIAL_MEDIA', 300))
+}
+
+# Semantic Context Cache Config
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', 10000))  # Captions kept per cache; 0 disables
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.9))  # Cosine similarity counted as the same caption; see benchmarks/bench_semantic_cache.py
+SEMANTIC_CACHE_DIMS = int(os.environ.get('SEMANTIC_CACHE_DIMS', 1024))  # Width of the hashed n-gram vectors
+
+# Hashtag Index Config
+HASHTAG_LOG_PATH = os.environ.get('HASHTAG_LOG_PATH', os.path.join('data', 'hashtags.jsonl'))  # Past (context, hashtags) pairs
+HASHTAG_INDEX_MAX_DOCS = int(os.environ.get('HASHTAG_INDEX_MAX_DOCS', 50000))  # Most recent pairs indexed
+HASHTAG_MIN_DOCS = int(os.environ.get('HASHTAG_MIN_DOCS', 200))  # Pairs indexed before the index answers on its own
+HASHTAG_MIN_CONFIDENCE = float(os.environ.get('HASHTAG_MIN_CONFIDENCE', 0.5))  # Confidence needed to use the index when a caption has no hashtags
+HASHTAG_COUNT = int(os.environ.get('HASHTAG_COUNT', 5))  # Hashtags recommended per context
+
+# Capacity Config
+# Concurrent calls per resource; resources not listed are not limited
+CAPACITY_SLOTS = {
+    'blip': int(os.environ.get('CAPACITY_SLOTS_BLIP', 2)),
+    'gpt-4': int(os.environ.get('CAPACITY_SLOTS_GPT4', 4)),
+    'gpt-3.5-turbo': int(os.environ.get('CAPACITY_SLOTS_GPT35', 8))
+}
+# Requests allowed to wait for each resource before new ones are shed
+CAPACITY_QUEUE_SIZE = {
+    'blip': int(os.environ.get('CAPACITY_QUEUE_BLIP', 16)),
+    'gpt-4': int(os.environ.get('CAPACITY_QUEUE_GPT4', 32)),
+    'gpt-3.5-turbo': int(os.environ.get('CAPACITY_QUEUE_GPT35', 64))
+}
+# Priority classes, lower is served first
+PRIORITY_CLASSES = {
+    'medical': 0,
+    'interactive': 1,
+    'social': 2,
+    'batch': 3,
+    'background': 4
+}
+# Seconds a request of each class may wait for capacity in total; None waits as long as it takes
+PRIORITY_DEADLINES = {
+    'medical': 60,
+    'interactive': 30,
+    'social': 20,
+    'batch': 120,
+    'background': None
+}
+DEFAULT_PRIORITY_CLASS = 'background'  # Work outside a request, e.g. queued jobs
+
+# Profiling Config
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests profiled
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # Requests sending it in X-Profile are profiled; unset disables the header
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('data', 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))  # Oldest dumps are deleted beyond this
+PROFILE_TORCH = os.environ.get('PROFILE_TORCH', '1') != '0'  # Chrome trace of model.generate in profiled requests
+
+# Tracing and Logging Config
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')  # 'none', 'console' or 'otlp-file'; comma-separate several
+TRACE_FILE = os.environ.get('TRACE_FILE', os.path.join('data', 'traces.jsonl'))  # Used by the otlp-file exporter
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'image-analyzer')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' (with trace and request IDs) or 'text'
@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for production.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master so the BLIP weights are loaded once and
+shared with every worker through copy-on-write pages after fork.
+"""
+import gc
+import os
+
+from config.config import (
+    SERVER_BIND,
+    SERVER_WORKERS,
+    SERVER_THREADS,
+    SERVER_TIMEOUT,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_PRELOAD,
+    SERVER_TORCH_THREADS
+)
+
+wsgi_app = 'wsgi:app'
+bind = SERVER_BIND
+workers = SERVER_WORKERS
+worker_class = 'gthread'
+threads = SERVER_THREADS
+timeout = SERVER_TIMEOUT
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+preload_app = SERVER_PRELOAD
+
+
+def when_ready(server):
+    # Move everything loaded so far into a permanent generation, so the
+    # collector in the workers never writes to (and un-shares) those pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+    from app.services.job_service import start_job_workers
+
+    # Each worker gets its share of the cores instead of all of them
+    torch.set_num_threads(SERVER_TORCH_THREADS or max(1, (os.cpu_count() or 1) // SERVER_WORKERS))
+    start_job_workers()
@@ -1,8 +1,11 @@
 from app import create_app
 import os
 
-app = create_app()
+# Process pool workers (spawn start method) import this module as __mp_main__;
+# they must not build the app and load the BLIP model again.
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 4000))
-    app.run(host="0.0.0.0",debug=True,port=port) 
\ No newline at end of file
+    app.run(host="0.0.0.0",debug=True,port=port) 
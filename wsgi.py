@@ -0,0 +1,7 @@
+from app import create_app
+
+# Production entry point, served by gunicorn with gunicorn.conf.py. With
+# preload_app the master imports this module, so the BLIP model is loaded once
+# and shared with the workers copy-on-write. Job workers are threads and do not
+# survive fork; gunicorn.conf.py starts them in each worker instead.
+app = create_app(background_workers=False)